@@ -57,6 +57,7 @@ objects = {'barostats': barostats.InputBaro(),
            'forcefield': forcefields.InputForceField(),
            'ffsocket': forcefields.InputFFSocket(),
            'fflj': forcefields.InputFFLennardJones(),
+           'ffqtip4pf': forcefields.InputFFQTIP4PF(),
            'ffdebye': forcefields.InputFFDebye(),
            'ffplumed': forcefields.InputFFPlumed(),           
            'ffyaff': forcefields.InputFFYaff(),           
@@ -31,7 +31,7 @@
          USE LJPolymer
          USE SG
          USE PSWATER
-         USE F90SOCKETS, ONLY : open_socket, writebuffer, readbuffer
+         USE F90SOCKETS, ONLY : open_socket, writebuffer, readbuffer, open_shm, close_shm
       IMPLICIT NONE
       
       ! SOCKET VARIABLES
@@ -52,6 +52,11 @@
       INTEGER cbuf, rid
       CHARACTER(LEN=2048) :: initbuffer      ! it's unlikely a string this large will ever be passed...
       DOUBLE PRECISION, ALLOCATABLE :: msgbuffer(:)
+
+      ! SHARED-MEMORY SEGMENT, IF THE WRAPPER SETS ONE UP: h(9), ih(9), pot, virial(9), positions(3*nat), forces(3*nat)
+      INTEGER, PARAMETER :: SHMHDR=28
+      INTEGER shmnat
+      DOUBLE PRECISION, POINTER :: shm(:) => NULL()
       
       ! PARAMETERS OF THE SYSTEM (CELL, ATOM POSITIONS, ...)
       DOUBLE PRECISION sigma, eps, rc, rn, ks ! potential parameters
@@ -351,13 +356,28 @@
             IF (verbose > 1) WRITE(*,*) "    !read!=> init_string: ", cbuf
             IF (verbose > 0) WRITE(*,*) " Initializing system from wrapper, using ", trim(initbuffer)
             isinit=.true. ! We actually do nothing with this string, thanks anyway. Could be used to pass some information (e.g. the input parameters, or the index of the replica, from the driver
-         ELSEIF (trim(header) == "POSDATA") THEN  ! The driver is sending the positions of the atoms. Here is where we do the calculation!
+         ELSEIF (trim(header) == "SHMOPEN") THEN  ! The wrapper is sharing a memory segment to exchange positions and forces
+            CALL readbuffer(socket, shmnat)
+            CALL readbuffer(socket, cbuf)
+            CALL readbuffer(socket, initbuffer, cbuf)
+            IF (verbose > 0) WRITE(*,*) " Mapping shared-memory segment ", initbuffer(1:cbuf)
+            IF (ASSOCIATED(shm)) CALL close_shm(shm)
+            CALL open_shm(initbuffer(1:cbuf), SHMHDR+6*shmnat, shm)
+         ELSEIF (trim(header) == "POSDATA" .or. trim(header) == "SHMPOSDATA") THEN  ! The driver is sending the positions of the atoms. Here is where we do the calculation!
 
-            ! Parses the flow of data from the socket
-            CALL readbuffer(socket, mtxbuf, 9)  ! Cell matrix
+            ! Parses the flow of data from the socket, or from the shared-memory segment
+            IF (trim(header) == "SHMPOSDATA") THEN
+               mtxbuf = shm(1:9)
+            ELSE
+               CALL readbuffer(socket, mtxbuf, 9)  ! Cell matrix
+            ENDIF
             IF (verbose > 1) WRITE(*,*) "    !read!=> cell: ", mtxbuf
             cell_h = RESHAPE(mtxbuf, (/3,3/))
-            CALL readbuffer(socket, mtxbuf, 9)  ! Inverse of the cell matrix (so we don't have to invert it every time here)
+            IF (trim(header) == "SHMPOSDATA") THEN
+               mtxbuf = shm(10:18)
+            ELSE
+               CALL readbuffer(socket, mtxbuf, 9)  ! Inverse of the cell matrix (so we don't have to invert it every time here)
+            ENDIF
             IF (verbose > 1) WRITE(*,*) "    !read!=> cell-1: ", mtxbuf
             cell_ih = RESHAPE(mtxbuf, (/3,3/))
 
@@ -369,7 +389,11 @@
             ! We assume an upper triangular cell-vector matrix
             volume = cell_h(1,1)*cell_h(2,2)*cell_h(3,3)
 
-            CALL readbuffer(socket, cbuf)       ! The number of atoms in the cell
+            IF (trim(header) == "SHMPOSDATA") THEN
+               cbuf = shmnat
+            ELSE
+               CALL readbuffer(socket, cbuf)       ! The number of atoms in the cell
+            ENDIF
             IF (verbose > 1) WRITE(*,*) "    !read!=> cbuf: ", cbuf
             IF (nat < 0) THEN  ! Assumes that the number of atoms does not change throughout a simulation, so only does this once
                nat = cbuf
@@ -383,7 +407,11 @@
                msgbuffer = 0.0d0
             ENDIF
 
-            CALL readbuffer(socket, msgbuffer, nat*3)
+            IF (trim(header) == "SHMPOSDATA") THEN
+               msgbuffer = shm(SHMHDR+1:SHMHDR+3*nat)
+            ELSE
+               CALL readbuffer(socket, msgbuffer, nat*3)
+            ENDIF
             IF (verbose > 1) WRITE(*,*) "    !read!=> positions: ", msgbuffer
             DO i = 1, nat
                atoms(i,:) = msgbuffer(3*(i-1)+1:3*i)
@@ -568,16 +596,24 @@
             ENDDO
             virial = transpose(virial)
 
-            CALL writebuffer(socket,"FORCEREADY  ",MSGLEN)
-            IF (verbose > 1) WRITE(*,*) "    !write!=> ", "FORCEREADY  "
-            CALL writebuffer(socket,pot)  ! Writing the potential
-            IF (verbose > 1) WRITE(*,*) "    !write!=> pot: ", pot
-            CALL writebuffer(socket,nat)  ! Writing the number of atoms
-            IF (verbose > 1) WRITE(*,*) "    !write!=> nat:", nat
-            CALL writebuffer(socket,msgbuffer,3*nat) ! Writing the forces
-            IF (verbose > 1) WRITE(*,*) "    !write!=> forces:", msgbuffer
-            CALL writebuffer(socket,reshape(virial,(/9/)),9)  ! Writing the virial tensor, NOT divided by the volume
-            IF (verbose > 1) WRITE(*,*) "    !write!=> strss: ", reshape(virial,(/9/))
+            IF (ASSOCIATED(shm)) THEN  ! Results go in the shared-memory segment, before the wrapper is told they are there
+               shm(19) = pot
+               shm(20:28) = reshape(virial,(/9/))
+               shm(SHMHDR+3*nat+1:SHMHDR+6*nat) = msgbuffer
+               CALL writebuffer(socket,"FORCEREADY  ",MSGLEN)
+               IF (verbose > 1) WRITE(*,*) "    !write!=> ", "FORCEREADY  "
+            ELSE
+               CALL writebuffer(socket,"FORCEREADY  ",MSGLEN)
+               IF (verbose > 1) WRITE(*,*) "    !write!=> ", "FORCEREADY  "
+               CALL writebuffer(socket,pot)  ! Writing the potential
+               IF (verbose > 1) WRITE(*,*) "    !write!=> pot: ", pot
+               CALL writebuffer(socket,nat)  ! Writing the number of atoms
+               IF (verbose > 1) WRITE(*,*) "    !write!=> nat:", nat
+               CALL writebuffer(socket,msgbuffer,3*nat) ! Writing the forces
+               IF (verbose > 1) WRITE(*,*) "    !write!=> forces:", msgbuffer
+               CALL writebuffer(socket,reshape(virial,(/9/)),9)  ! Writing the virial tensor, NOT divided by the volume
+               IF (verbose > 1) WRITE(*,*) "    !write!=> strss: ", reshape(virial,(/9/))
+            ENDIF
             
             IF (vstyle==5 .or. vstyle==6 .or. vstyle==8) THEN ! returns the dipole
                initbuffer = " "
@@ -601,6 +637,7 @@
          ENDIF
       ENDDO
       IF (nat > 0) DEALLOCATE(atoms, forces, msgbuffer)
+      IF (ASSOCIATED(shm)) CALL close_shm(shm)
  
     CONTAINS
       SUBROUTINE helpmessage
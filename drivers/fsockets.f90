@@ -30,6 +30,8 @@
 !      port number.
 !   write_buffer: Writes a string to the socket.
 !   read_buffer: Reads data from the socket.
+!   open_shm: Maps a shared-memory segment onto a Fortran array.
+!   close_shm: Unmaps a shared-memory segment.
 
    MODULE F90SOCKETS
    USE ISO_C_BINDING
@@ -74,6 +76,21 @@
     INTEGER(KIND=C_INT)                      :: plen
 
     END SUBROUTINE readbuffer_csocket   
+
+    SUBROUTINE open_cshm(path, psize, pshm) BIND(C, name="open_shm")
+      USE ISO_C_BINDING
+    CHARACTER(KIND=C_CHAR), DIMENSION(*)     :: path
+    INTEGER(KIND=C_INT)                      :: psize
+    TYPE(C_PTR)                              :: pshm
+
+    END SUBROUTINE open_cshm
+
+    SUBROUTINE close_cshm(pshm, psize) BIND(C, name="close_shm")
+      USE ISO_C_BINDING
+    TYPE(C_PTR), VALUE                       :: pshm
+    INTEGER(KIND=C_INT)                      :: psize
+
+    END SUBROUTINE close_cshm
   END INTERFACE
 
    CONTAINS
@@ -89,6 +106,27 @@
       CALL open_csocket(psockfd, inet, port, host)
    END SUBROUTINE
 
+   SUBROUTINE open_shm(path, psize, shm)
+      IMPLICIT NONE
+      CHARACTER(LEN=*), INTENT(IN) :: path
+      INTEGER, INTENT(IN) :: psize
+      REAL(KIND=8), POINTER :: shm(:)
+      CHARACTER(LEN=1,KIND=C_CHAR) :: cpath(LEN_TRIM(path)+1)
+      TYPE(C_PTR) :: pshm
+
+      CALL fstr2cstr(path, cpath)
+      CALL open_cshm(cpath, psize, pshm)
+      CALL C_F_POINTER(pshm, shm, (/ psize /))
+   END SUBROUTINE
+
+   SUBROUTINE close_shm(shm)
+      IMPLICIT NONE
+      REAL(KIND=8), POINTER :: shm(:)
+
+      CALL close_cshm(C_LOC(shm(1)), SIZE(shm))
+      NULLIFY(shm)
+   END SUBROUTINE
+
    SUBROUTINE fstr2cstr(fstr, cstr, plen)
       IMPLICIT NONE
       CHARACTER(LEN=*), INTENT(IN) :: fstr
@@ -32,6 +32,8 @@ Functions:
       port number.
    write_buffer_: Writes a string to the socket.
    read_buffer_: Reads data from the socket.
+   open_shm: Maps a shared-memory segment created by the server.
+   close_shm: Unmaps a shared-memory segment.
 */
 
 #include <stdio.h>
@@ -43,6 +45,8 @@ Functions:
 #include <netinet/in.h>
 #include <sys/un.h>
 #include <netdb.h>
+#include <fcntl.h>
+#include <sys/mman.h>
 
 void open_socket(int *psockfd, int* inet, int* port, const char* host)
 /* Opens a socket.
@@ -153,3 +157,41 @@ Args:
 }
 
 
+void open_shm(const char* path, int* psize, void** pshm)
+/* Maps a shared-memory segment.
+
+When i-PI runs in shm mode, positions, cell and forces are exchanged through
+a file (normally in /dev/shm) that is mapped in memory by both sides, and the
+socket only carries the control messages.
+
+Args:
+   path: The null-terminated name of the file that backs the segment.
+   psize: The size of the segment, in double precision words.
+   pshm: On exit, the address of the mapped segment.
+*/
+
+{
+   int fd;
+   void* shm;
+
+   fd = open(path, O_RDWR);
+   if (fd < 0) { perror("Error opening shared-memory segment"); exit(-1); }
+
+   shm = mmap(NULL, (size_t) *psize * sizeof(double), PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+   if (shm == MAP_FAILED) { perror("Error mapping shared-memory segment"); exit(-1); }
+   close(fd);   // the mapping stays valid, and i-PI can remove the file
+
+   *pshm=shm;
+}
+
+void close_shm(void* shm, int* psize)
+/* Unmaps a shared-memory segment.
+
+Args:
+   shm: The address of the mapped segment.
+   psize: The size of the segment, in double precision words.
+*/
+
+{
+   munmap(shm, (size_t) *psize * sizeof(double));
+}
@@ -438,43 +438,45 @@ class BaroBZP(Barostat):
 
         return self.thermostat.ethermo + self.kin + self.pot + self.cell_jacobian
 
+    @dhot
     def pstep(self, level=0):
         """Propagates the momentum of the barostat."""
 
         # we are assuming then that p the coupling between p^2 and dp/dt only involves the fast force
-        dt = self.pdt[level]  # this is already set to be half a time step at the specified MTS depth
+        dt = dview(self.pdt)[level]  # this is already set to be half a time step at the specified MTS depth
         dt2 = dt**2
         dt3 = dt**3 / 3.0
 
-        # computes the pressure associated with the forces at each MTS level.
-        press = np.trace(self.stress_mts(level)) / 3.0
-        self.p += dt * 3.0 * (self.cell.V * press)
+        with dbatch():
+            # computes the pressure associated with the forces at each MTS level.
+            press = np.trace(self.stress_mts(level)) / 3.0
+            self.p = dview(self.p) + dt * 3.0 * (self.cell.V * press)
 
-        # integerates the kinetic part of the pressure with the force at the inner-most level.
-        if(level == self.nmtslevels - 1):
-            press = 0
-            self.p += dt * 3.0 * (self.cell.V * (press - self.beads.nbeads * self.pext) + Constants.kb * self.temp)
+            # integerates the kinetic part of the pressure with the force at the inner-most level.
+            if(level == self.nmtslevels - 1):
+                press = 0
+                self.p = dview(self.p) + dt * 3.0 * (self.cell.V * (press - self.beads.nbeads * self.pext) + Constants.kb * self.temp)
 
-            pc = dstrip(self.beads.pc)
-            fc = np.sum(dstrip(self.forces.forces_mts(level)), axis=0) / self.beads.nbeads
-            m = dstrip(self.beads.m3)[0]
+                pc = dstrip(self.beads.pc)
+                fc = np.sum(dstrip(self.forces.forces_mts(level)), axis=0) / self.beads.nbeads
+                m = dstrip(self.beads.m3)[0]
 
-            self.p += (dt2 * np.dot(pc, fc / m) + dt3 * np.dot(fc, fc / m)) * self.beads.nbeads
+                self.p = dview(self.p) + (dt2 * np.dot(pc, fc / m) + dt3 * np.dot(fc, fc / m)) * self.beads.nbeads
 
+    @dhot
     def qcstep(self):
         """Propagates the centroid position and momentum and the volume."""
 
-        v = self.p[0] / self.m[0]
+        v = dview(self.p)[0] / dview(self.m)[0]
         halfdt = self.qdt  # this is set to half the inner loop in all integrators that use a barostat
         expq, expp = (np.exp(v * halfdt), np.exp(-v * halfdt))
 
         m = dstrip(self.beads.m3)[0]
 
-        self.nm.qnm[0, :] *= expq
-        self.nm.qnm[0, :] += ((expq - expp) / (2.0 * v)) * (dstrip(self.nm.pnm)[0, :] / m)
-        self.nm.pnm[0, :] *= expp
+        self.nm.qnm[0] = dview(self.nm.qnm)[0] * expq + ((expq - expp) / (2.0 * v)) * (dview(self.nm.pnm)[0] / m)
+        self.nm.pnm[0] = dview(self.nm.pnm)[0] * expp
 
-        self.cell.h *= expq
+        self.cell.h = dview(self.cell.h) * expq
 
 
 class BaroSCBZP(Barostat):
@@ -603,19 +605,20 @@ class BaroSCBZP(Barostat):
         dt2 = dt**2
         dt3 = dt**3 / 3.0
 
-        # computes the pressure associated with the forces at each MTS level and adds the +- 1/3 SC correction.
-        press = np.trace(self.stress_mts_sc(level)) / 3.0
-        self.p += dt * 3.0 * (self.cell.V * press)
+        with dbatch():
+            # computes the pressure associated with the forces at each MTS level and adds the +- 1/3 SC correction.
+            press = np.trace(self.stress_mts_sc(level)) / 3.0
+            self.p += dt * 3.0 * (self.cell.V * press)
 
-        # integerates the kinetic part of the pressure with the force at the inner-most level.
-        if (level == self.nmtslevels - 1):
-            press = 0
-            self.p += dt * 3.0 * (self.cell.V * (press - self.beads.nbeads * self.pext) + Constants.kb * self.temp)
-            pc = dstrip(self.beads.pc)
-            fc = np.sum(dstrip(self.forces.forces_mts(level)) * (1 + self.forces.coeffsc_part_1), axis=0) / self.beads.nbeads
-            m = dstrip(self.beads.m3)[0]
+            # integerates the kinetic part of the pressure with the force at the inner-most level.
+            if (level == self.nmtslevels - 1):
+                press = 0
+                self.p += dt * 3.0 * (self.cell.V * (press - self.beads.nbeads * self.pext) + Constants.kb * self.temp)
+                pc = dstrip(self.beads.pc)
+                fc = np.sum(dstrip(self.forces.forces_mts(level)) * (1 + self.forces.coeffsc_part_1), axis=0) / self.beads.nbeads
+                m = dstrip(self.beads.m3)[0]
 
-            self.p += (dt2 * np.dot(pc, fc / m) + dt3 * np.dot(fc, fc / m)) * self.beads.nbeads
+                self.p += (dt2 * np.dot(pc, fc / m) + dt3 * np.dot(fc, fc / m)) * self.beads.nbeads
 
     def qcstep(self):
         """Propagates the centroid position and momentum and the volume."""
@@ -791,19 +794,20 @@ class BaroRGB(Barostat):
         pi_ext = np.dot(hh0, np.dot(self.stressext, hh0.T)) * self.h0.V / self.cell.V
         L = np.diag([3, 2, 1])
 
-        stress = dstrip(self.stress_mts(level))
-        self.p += dt * (self.cell.V * np.triu(stress))
+        with dbatch():
+            stress = dstrip(self.stress_mts(level))
+            self.p += dt * (self.cell.V * np.triu(stress))
 
-        # integerates the kinetic part of the stress with the force at the inner-most level.
-        if(level == self.nmtslevels - 1):
+            # integerates the kinetic part of the stress with the force at the inner-most level.
+            if(level == self.nmtslevels - 1):
 
-            self.p += dt * (self.cell.V * np.triu(-self.beads.nbeads * pi_ext) + Constants.kb * self.temp * L)
+                self.p += dt * (self.cell.V * np.triu(-self.beads.nbeads * pi_ext) + Constants.kb * self.temp * L)
 
-            pc = dstrip(self.beads.pc).reshape(self.beads.natoms, 3)
-            fc = np.sum(dstrip(self.forces.forces_mts(level)), axis=0).reshape(self.beads.natoms, 3) / self.beads.nbeads
-            fcTonm = (fc / dstrip(self.beads.m3)[0].reshape(self.beads.natoms, 3)).T
+                pc = dstrip(self.beads.pc).reshape(self.beads.natoms, 3)
+                fc = np.sum(dstrip(self.forces.forces_mts(level)), axis=0).reshape(self.beads.natoms, 3) / self.beads.nbeads
+                fcTonm = (fc / dstrip(self.beads.m3)[0].reshape(self.beads.natoms, 3)).T
 
-            self.p += np.triu(dt2 * np.dot(fcTonm, pc) + dt3 * np.dot(fcTonm, fc)) * self.beads.nbeads
+                self.p += np.triu(dt2 * np.dot(fcTonm, pc) + dt3 * np.dot(fcTonm, fc)) * self.beads.nbeads
 
     def qcstep(self):
         """Propagates the centroid position and momentum and the volume."""
@@ -9,8 +9,11 @@ layer for a driver that gets positions and returns forces (and energy).
 # See the "licenses" directory for full license information.
 
 
+import os
 import time
 import threading
+import hashlib
+from collections import deque, OrderedDict
 
 import numpy as np
 
@@ -18,13 +21,16 @@ from ipi.utils.softexit import softexit
 from ipi.utils.messages import verbosity
 from ipi.utils.messages import info
 from ipi.interfaces.sockets import InterfaceSocket
+from ipi.interfaces.processes import ProcessPool
 from ipi.utils.depend import dobject
 from ipi.utils.depend import dstrip
 from ipi.utils.io import read_file
+from ipi.utils.neighbours import NeighbourList
+from ipi.utils.ewald import ewald_parameters, kvectors, real_space, reciprocal_space, self_energy
 from ipi.utils.units import unit_to_internal
 
 
-__all__ = ['ForceField', 'FFSocket', 'FFLennardJones', 'FFDebye', 'FFPlumed', 'FFYaff']
+__all__ = ['ForceField', 'ForceCache', 'ForceDatabase', 'FFSocket', 'FFLennardJones', 'FFQTIP4PF', 'FFDebye', 'FFProcessPool', 'FFPlumed', 'FFYaff']
 
 
 class ForceRequest(dict):
@@ -42,6 +48,295 @@ class ForceRequest(dict):
         return self is y
 
 
+STATSWINDOW = 100  # number of recent requests the forcefield timings are averaged over
+
+
+class ForceFieldStats(object):
+
+    """Keeps track of where the time of the requests of a forcefield goes.
+
+    For each completed request records the time it waited to be dispatched,
+    the time spent by i-PI sending and receiving its data, the rest of the
+    time it took to be computed, and the number of bytes moved.
+
+    Attributes:
+        nrequests: The number of requests completed so far.
+        totals: An array with the total wait, dispatch and compute times and
+            bytes moved by all the requests completed so far.
+        recent: The same quantities for the last STATSWINDOW requests.
+    """
+
+    def __init__(self):
+        """Initialises ForceFieldStats."""
+
+        self.nrequests = 0
+        self.totals = np.zeros(4)
+        self.recent = deque(maxlen=STATSWINDOW)
+
+    def record(self, r):
+        """Adds the timings of a completed request.
+
+        Args:
+            r: The completed request.
+        """
+
+        wait = r["t_dispatched"] - r["t_queued"]
+        compute = r["t_finished"] - r["t_dispatched"] - r["t_io"]
+        timings = np.array([wait, r["t_io"], compute, r["nbytes"]], float)
+        self.nrequests += 1
+        self.totals += timings
+        self.recent.append(timings)
+
+    def summary(self):
+        """Returns a dictionary with the average timings of the recent
+        requests and the totals of all the requests."""
+
+        if len(self.recent) > 0:
+            avg = np.mean(self.recent, axis=0)
+        else:
+            avg = np.zeros(4)
+        return {"requests": self.nrequests,
+                "wait": float(avg[0]), "dispatch": float(avg[1]), "compute": float(avg[2]), "bytes": float(avg[3]),
+                "total_wait": float(self.totals[0]), "total_dispatch": float(self.totals[1]),
+                "total_compute": float(self.totals[2]), "total_bytes": float(self.totals[3])}
+
+
+class ForceCache(object):
+
+    """A bounded cache of the results of a forcefield.
+
+    Results are keyed by a hash of the positions, the cell and the parameters
+    of a request, with the coordinates rounded to a multiple of the tolerance,
+    and a hit is only accepted if no coordinate differs by more than the
+    tolerance. When the cache is full the least recently used result is
+    discarded.
+
+    Attributes:
+        size: The maximum number of results that are kept.
+        tolerance: The largest difference in the coordinates for which two
+            configurations are considered identical.
+        hits: The number of requests found in the cache.
+        misses: The number of requests not found in the cache.
+        _entries: An ordered dictionary of the cached (pos, cell, result)
+            tuples, from the least to the most recently used.
+        _lock: A lock that makes the cache thread-safe.
+    """
+
+    def __init__(self, size, tolerance=0.0):
+        """Initialises ForceCache.
+
+        Args:
+            size: The maximum number of results that are kept.
+            tolerance: The largest difference in the coordinates for which two
+                configurations are considered identical.
+        """
+
+        self.size = size
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, r):
+        """Returns the hash of the configuration of a request."""
+
+        pos, cell = r["pos"], r["cell"][0]
+        if self.tolerance > 0.0:
+            # adding zero turns -0.0 into 0.0, which would hash differently
+            pos, cell = np.round(pos / self.tolerance) + 0.0, np.round(cell / self.tolerance) + 0.0
+        return hashlib.sha1(np.ascontiguousarray(pos).tostring() + np.ascontiguousarray(cell).tostring() + r["pars"]).digest()
+
+    def _match(self, entry, r):
+        """Checks that a cached entry is within the tolerance of a request."""
+
+        pos, cell, result = entry
+        return (len(pos) == len(r["pos"]) and np.abs(pos - r["pos"]).max() <= self.tolerance and
+                np.abs(cell - r["cell"][0]).max() <= self.tolerance)
+
+    def lookup(self, r):
+        """Looks for the result of a request.
+
+        Args:
+            r: The request.
+
+        Returns:
+            A copy of the cached result, or None if the request is not in the cache.
+        """
+
+        key = self.key(r)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._match(entry, r):
+                self.misses += 1
+                return None
+            self.hits += 1
+            del self._entries[key]
+            self._entries[key] = entry
+        pot, f, vir, extra = entry[2]
+        return [pot, f.copy(), vir.copy(), extra]
+
+    def store(self, r):
+        """Adds the result of a completed request to the cache.
+
+        Args:
+            r: The completed request.
+        """
+
+        key = self.key(r)
+        with self._lock:
+            if key in self._entries:
+                return
+            pot, f, vir, extra = r["result"]
+            self._entries[key] = (r["pos"].copy(), r["cell"][0].copy(), [pot, np.array(f, float), np.array(vir, float), extra])
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def summary(self):
+        """Returns a dictionary with the number of hits and misses."""
+
+        return {"cache_hits": self.hits, "cache_misses": self.misses, "cache_size": len(self._entries)}
+
+
+class ForceDatabase(ForceCache):
+
+    """A persistent store of the results of a forcefield.
+
+    Results are appended to a data file, and their positions in the file
+    are appended to an index file together with the hash of the configuration,
+    computed as in ForceCache. The index is read back into a dictionary when
+    the database is opened, so results computed in previous runs are reused.
+    The data file is memory-mapped to read the results back. Records whose
+    index entry has not been written completely, e.g. because the run crashed,
+    are ignored. Only one process at a time should write to a database.
+
+    Each record holds, as 8-byte floats, the cell, the positions, the
+    potential, the forces and the virial, followed by the extra string padded
+    to a multiple of 8 bytes.
+
+    Attributes:
+        path: The prefix of the data (.dat) and index (.idx) files.
+        _index: A dictionary with the (offset, natoms, extra length) of each
+            record, keyed by the hash of its configuration.
+        _data: The data file, opened for appending, or None once the database
+            has been closed.
+        _idx: The index file, opened for appending, or None once the database
+            has been closed.
+        _map: The memory map of the data file, or None if it must be updated.
+    """
+
+    def __init__(self, path, tolerance=0.0):
+        """Initialises ForceDatabase, reading the index of an existing database.
+
+        Args:
+            path: The prefix of the data and index files.
+            tolerance: The largest difference in the coordinates for which two
+                configurations are considered identical.
+        """
+
+        super(ForceDatabase, self).__init__(0, tolerance)
+        self.path = path
+        self._index = {}
+        self._map = None
+
+        self._data = open(path + ".dat", "ab")
+        size = os.path.getsize(path + ".dat")
+        if os.path.exists(path + ".idx"):
+            with open(path + ".idx", "r") as idx:
+                for line in idx:
+                    fields = line.split()
+                    # skips lines that have not been written completely
+                    if len(fields) != 4 or not line.endswith("\n"):
+                        continue
+                    offset, nat, nextra = int(fields[1]), int(fields[2]), int(fields[3])
+                    if offset + self._record_size(nat, nextra) <= size:
+                        self._index[fields[0].decode("hex")] = (offset, nat, nextra)
+        self._idx = open(path + ".idx", "a+")
+        # terminates a line left incomplete, so that new entries start on a line of their own
+        self._idx.seek(0, os.SEEK_END)
+        if self._idx.tell() > 0:
+            self._idx.seek(-1, os.SEEK_END)
+            if self._idx.read(1) != "\n":
+                self._idx.write("\n")
+        info(" @ForceField: Opened force database %s with %d configurations." % (path, len(self._index)), verbosity.low)
+
+    @staticmethod
+    def _record_size(nat, nextra):
+        """Returns the size in bytes of a record."""
+
+        return 8 * (19 + 6 * nat) + 8 * ((nextra + 7) // 8)
+
+    def lookup(self, r):
+        """Looks for the result of a request.
+
+        Args:
+            r: The request.
+
+        Returns:
+            The stored result, or None if the request is not in the database.
+        """
+
+        key = self.key(r)
+        with self._lock:
+            record = self._index.get(key)
+            if record is not None and self._data is not None:
+                offset, nat, nextra = record
+                if self._map is None or len(self._map) < offset + self._record_size(nat, nextra):
+                    self._map = np.memmap(self.path + ".dat", dtype=np.uint8, mode="r")
+                values = self._map[offset:offset + 8 * (19 + 6 * nat)].view(np.float64)
+                cell, pos = values[0:9].reshape((3, 3)), values[9:9 + 3 * nat]
+                if self._match((pos, cell, None), r):
+                    self.hits += 1
+                    extra = self._map[offset + 8 * (19 + 6 * nat):offset + 8 * (19 + 6 * nat) + nextra].tostring()
+                    return [values[9 + 3 * nat], values[10 + 3 * nat:10 + 6 * nat].copy(),
+                            values[10 + 6 * nat:19 + 6 * nat].reshape((3, 3)).copy(), extra]
+            self.misses += 1
+            return None
+
+    def store(self, r):
+        """Appends the result of a completed request to the database.
+
+        Args:
+            r: The completed request.
+        """
+
+        key = self.key(r)
+        with self._lock:
+            if key in self._index or self._data is None:
+                return
+            pot, f, vir, extra = r["result"]
+            nat = len(r["pos"]) / 3
+            extra = str(extra)
+            offset = self._data.tell()
+            self._data.write(np.concatenate((r["cell"][0].flatten(), r["pos"], [pot], np.asarray(f, float), np.asarray(vir, float).flatten())).tostring())
+            self._data.write(extra + "\0" * (self._record_size(nat, len(extra)) - 8 * (19 + 6 * nat) - len(extra)))
+            self._data.flush()
+            # the index entry is written last, so it only points to complete records
+            self._idx.write("%s %d %d %d\n" % (key.encode("hex"), offset, nat, len(extra)))
+            self._idx.flush()
+            self._index[key] = (offset, nat, len(extra))
+
+    def close(self):
+        """Closes the files of the database.
+
+        Results computed later are not stored any more, and can be called
+        more than once.
+        """
+
+        with self._lock:
+            if self._data is not None:
+                self._data.close()
+                self._idx.close()
+            self._data = None
+            self._idx = None
+            self._map = None
+
+    def summary(self):
+        """Returns a dictionary with the number of hits and misses."""
+
+        return {"db_hits": self.hits, "db_misses": self.misses, "db_size": len(self._index)}
+
+
 class ForceField(dobject):
 
     """Base forcefield class.
@@ -53,29 +348,47 @@ class ForceField(dobject):
         pars: A dictionary of the parameters needed to initialize the forcefield.
             Of the form {'name1': value1, 'name2': value2, ... }.
         name: The name of the forcefield.
-        latency: A float giving the number of seconds the socket will wait
-            before updating the client list.
+        latency: A float giving the maximum number of seconds the polling
+            thread will sleep when there is nothing to do.
         requests: A list of all the jobs to be given to the client codes.
         dopbc: A boolean giving whether or not to apply the periodic boundary
             conditions before sending the positions to the client code.
+        threaded: A boolean giving whether the requests are evaluated by a
+            polling thread. If not, they are evaluated by the first thread
+            that waits for them.
         _thread: The thread on which the socket polling loop is being run.
         _doloop: A list of booleans. Used to decide when to stop running the
             polling loop.
         _threadlock: Python handle used to lock the thread held in _thread.
+        _pollcond: Condition used to wake up the polling thread when there
+            is new work to do.
+        _pollflag: A boolean that is set when the polling thread is woken up.
+        _donecond: Condition used to signal threads waiting for a request
+            that some request has been completed.
+        stats: A ForceFieldStats object with the timings of the requests.
+        cache: A ForceCache object with the results of recent requests, or
+            None if results are not cached.
+        database: A ForceDatabase object with the results stored on disk, or
+            None if results are not stored.
+        nhints: The number of previous configurations of each replica that
+            are attached to its requests, so that the clients can extrapolate
+            a starting guess for their calculation. If 0 no history is kept.
     """
 
-    def __init__(self, latency=1.0, name="", pars=None, dopbc=True, active=np.array([-1])):
+    def __init__(self, latency=1.0, name="", pars=None, dopbc=True, active=np.array([-1]), threaded=False):
         """Initialises ForceField.
 
         Args:
-            latency: The number of seconds the socket will wait before updating
-                the client list.
+            latency: The maximum number of seconds the polling thread will
+                sleep when there is nothing to do.
             name: The name of the forcefield.
             pars: A dictionary used to initialize the forcefield, if required.
                 Of the form {'name1': value1, 'name2': value2, ... }.
             dopbc: Decides whether or not to apply the periodic boundary conditions
                 before sending the positions to the client code.
             active: Indexes of active atoms in this forcefield
+            threaded: Decides whether the requests are evaluated by a polling
+                thread, or by the threads waiting for them.
         """
 
         if pars is None:
@@ -88,11 +401,19 @@ class ForceField(dobject):
         self.requests = []
         self.dopbc = dopbc
         self.active = active
+        self.threaded = threaded
         self._thread = None
         self._doloop = [False]
         self._threadlock = threading.Lock()
-
-    def queue(self, atoms, cell, reqid=-1):
+        self._pollcond = threading.Condition()
+        self._pollflag = True
+        self._donecond = threading.Condition()
+        self.stats = ForceFieldStats()
+        self.cache = None
+        self.database = None
+        self.nhints = 0
+
+    def queue(self, atoms, cell, reqid=-1, output=None, priority=0, hints=None):
         """Adds a request.
 
         Note that the pars dictionary need to be sent as a string of a
@@ -105,6 +426,15 @@ class ForceField(dobject):
                 driver for initialisation. Defaults to {}.
             reqid: An optional integer that identifies requests of the same type,
                e.g. the bead index
+            output: An optional tuple (f, vir) of preallocated arrays that
+               forcefields can fill with the forces and the virial, rather
+               than allocating new ones for the result.
+            priority: An optional number giving how urgent the request is.
+               Requests with a higher priority are evaluated first.
+            hints: An optional tuple (step, q, history) with the index of
+               this configuration in the trajectory of the replica, its
+               positions and a list of the previous positions, the most
+               recent first.
 
         Returns:
             A list giving the status of the request of the form {'pos': An array
@@ -113,7 +443,10 @@ class ForceField(dobject):
             'result': holds the result as a list once the computation is done,
             'status': a string labelling the status of the calculation,
             'id': the id of the request, usually the bead number, 'start':
-            the starting time for the calculation, used to check for timeouts.}.
+            the starting time for the calculation, used to check for timeouts,
+            'output': the arrays the results can be stored into, or None,
+            'priority': the priority of the request,
+            'hints': the history of the replica, or None.}.
         """
 
         par_str = " "
@@ -156,42 +489,153 @@ class ForceField(dobject):
             "cell": (dstrip(cell.h).copy(), dstrip(cell.ih).copy()),
             "pars": par_str,
             "result": None,
+            "output": output,
+            "priority": priority,
+            "hints": hints,
             "status": "Queued",
             "start": -1,
             "t_queued": time.time(),
             "t_dispatched": 0,
-            "t_finished": 0
+            "t_finished": 0,
+            "t_io": 0.0,
+            "nbytes": 0
         })
 
+        # a configuration that has already been computed needs not be dispatched
+        for store in (self.cache, self.database):
+            if store is not None and newreq["status"] == "Queued":
+                newreq["result"] = store.lookup(newreq)
+                if newreq["result"] is not None:
+                    newreq["status"] = "Done"
+                    newreq["t_dispatched"] = newreq["t_finished"] = newreq["t_queued"]
+
         self._threadlock.acquire()
         try:
             self.requests.append(newreq)
         finally:
             self._threadlock.release()
 
+        if newreq["status"] == "Queued":
+            self.wake()
         return newreq
 
     def poll(self):
-        """Polls the forcefield object to check if it has finished."""
+        """Polls the forcefield checking if there are requests that should
+        be answered, and if necessary evaluates the associated forces and energy.
 
-        for r in self.requests:
-            if r["status"] == "Queued":
-                r["t_dispatched"] = time.time()
-                r["result"] = [0.0, np.zeros(len(r["pos"]), float), np.zeros((3, 3), float), ""]
-                r["status"] = "Done"
-                r["t_finished"] = time.time()
+        All the queued requests are evaluated at once, passing those with the
+        same number of atoms (e.g. all the beads of a system) together to
+        evaluate_batch, with the most urgent requests first.
+        """
+
+        # We have to be thread-safe, as in multi-system mode this might get
+        # called by many threads at once.
+        self._threadlock.acquire()
+        try:
+            batches = OrderedDict()
+            for r in sorted(self.requests, key=lambda r: -r["priority"]):
+                if r["status"] == "Queued":
+                    r["status"] = "Running"
+                    r["t_dispatched"] = time.time()
+                    batches.setdefault(len(r["pos"]), []).append(r)
+            for batch in batches.values():
+                pot, f, vir, extra = self.evaluate_batch(batch)
+                t_finished = time.time()
+                for k, r in enumerate(batch):
+                    r["result"] = [pot[k], f[k], vir[k], extra[k]]
+                    r["status"] = "Done"
+                    r["t_finished"] = t_finished
+        finally:
+            self._threadlock.release()
+        self.notify()
+
+    def evaluate_batch(self, requests):
+        """Evaluates a batch of requests.
+
+        By default the requests are evaluated one at a time with evaluate.
+        Forcefields that can compute many configurations at once override this
+        method instead, and work on the stack of the positions of the batch.
+
+        Args:
+            requests: A list of requests with the same number of atoms.
+
+        Returns:
+            A list [pot, f, vir, extra] with an array of the nreq potentials,
+            an array (nreq, 3*natoms) of forces, an array (nreq, 3, 3) of
+            virials and a list of nreq strings of extra output.
+        """
+
+        results = [self.evaluate(r) for r in requests]
+        return [np.array([res[0] for res in results]), np.array([res[1] for res in results]),
+                np.array([res[2] for res in results]), [res[3] for res in results]]
+
+    def evaluate(self, r):
+        """Evaluates a single request. Returns zero energy, forces and virial.
+
+        Args:
+            r: The request to evaluate.
+
+        Returns:
+            A list [pot, f, vir, extra] with the potential, the forces, the
+            virial and a string of extra output.
+        """
+
+        return [0.0, np.zeros(len(r["pos"]), float), np.zeros((3, 3), float), ""]
+
+    def wake(self):
+        """Wakes up the polling thread, e.g. because a request was queued."""
+
+        with self._pollcond:
+            self._pollflag = True
+            self._pollcond.notify()
+
+    def wait_events(self):
+        """Blocks the polling thread until there is something to do."""
+
+        with self._pollcond:
+            while self._doloop[0] and not self._pollflag:
+                self._pollcond.wait()
+            self._pollflag = False
+
+    def notify(self):
+        """Signals the threads blocked in wait() that requests have changed status."""
+
+        with self._donecond:
+            self._donecond.notify_all()
+
+    def wait(self, request):
+        """Blocks until a request has been completed.
+
+        Also returns if the forcefield is stopped, in which case the status
+        of the request is set to "Exit", or if a soft exit has been triggered.
+        If there is no polling thread, evaluates the request, together with
+        all the other queued ones, in the calling thread.
+
+        Args:
+            request: The request to wait for.
+        """
+
+        if not self.threaded and self._doloop[0] and request["status"] == "Queued":
+            self.poll()
+
+        # the timeout lets the main thread run the signal handlers of softexit,
+        # which python 2 defers while it is blocked on a lock
+        with self._donecond:
+            while request["status"] not in ("Done", "Exit") and not softexit.triggered:
+                self._donecond.wait(self.latency)
 
     def _poll_loop(self):
         """Polling loop.
 
         Loops over the different requests, checking to see when they have
-        finished.
+        finished. Between iterations it sleeps until there is something new
+        to do, rather than for a fixed time.
         """
 
         info(" @ForceField: Starting the polling thread main loop.", verbosity.low)
         while self._doloop[0]:
-            time.sleep(self.latency)
             self.poll()
+            self.wait_events()
 
     def release(self, request):
         """Shuts down the client code interface thread.
@@ -205,6 +649,12 @@ class ForceField(dobject):
         self._threadlock.acquire()
         try:
             if request in self.requests:
+                if request["status"] == "Done":
+                    self.stats.record(request)
+                    if self.cache is not None:
+                        self.cache.store(request)
+                    if self.database is not None:
+                        self.database.store(request)
                 try:
                     self.requests.remove(request)
                 except ValueError:
@@ -215,17 +665,22 @@ class ForceField(dobject):
             self._threadlock.release()
 
     def stop(self):
-        """Dummy stop method."""
+        """Stops the polling loop and closes the database of results, if any."""
 
         self._doloop[0] = False
         for r in self.requests:
             r["status"] = "Exit"
+        self.wake()
+        self.notify()
+        if self.database is not None:
+            self.database.close()
 
     def run(self):
         """Spawns a new thread.
 
         Splits the main program into two threads, one that runs the polling loop
-        which updates the client list, and one which gets the data.
+        which updates the client list, and one which gets the data. If the
+        forcefield is not threaded, just enables the evaluation of the requests.
 
         Raises:
             NameError: Raised if the polling thread already exists.
@@ -235,12 +690,26 @@ class ForceField(dobject):
             raise NameError("Polling thread already started")
 
         self._doloop[0] = True
+        if not self.threaded:
+            softexit.register_function(self.softexit)
+            return
         self._thread = threading.Thread(target=self._poll_loop, name="poll_" + self.name)
         self._thread.daemon = True
         self._thread.start()
         softexit.register_function(self.softexit)
         softexit.register_thread(self._thread, self._doloop)
 
+    def get_stats(self):
+        """Returns a dictionary with the average timings of the recent
+        requests, as described in ForceFieldStats.summary."""
+
+        stats = self.stats.summary()
+        if self.cache is not None:
+            stats.update(self.cache.summary())
+        if self.database is not None:
+            stats.update(self.database.summary())
+        return stats
+
     def softexit(self):
         """ Takes care of cleaning up upon softexit """
 
@@ -266,12 +735,12 @@ class FFSocket(ForceField):
             communication between the forcefield and the driver is done.
     """
 
-    def __init__(self, latency=1.0, name="", pars=None, dopbc=True, active=np.array([-1]), interface=None):
+    def __init__(self, latency=1.0, name="", pars=None, dopbc=True, active=np.array([-1]), interface=None, hints=0):
         """Initialises FFSocket.
 
         Args:
-           latency: The number of seconds the socket will wait before updating
-              the client list.
+           latency: The maximum number of seconds the polling thread will
+              wait for the clients before checking for timeouts.
            name: The name of the forcefield.
            pars: A dictionary used to initialize the forcefield, if required.
               Of the form {'name1': value1, 'name2': value2, ... }.
@@ -279,10 +748,13 @@ class FFSocket(ForceField):
               before sending the positions to the client code.
            interface: The object used to create the socket used to interact
               with the client codes.
+           hints: The number of previous configurations of each replica
+              used to compute the extrapolation hints sent to the clients.
         """
 
         # a socket to the communication library is created or linked
-        super(FFSocket, self).__init__(latency, name, pars, dopbc, active)
+        super(FFSocket, self).__init__(latency, name, pars, dopbc, active, threaded=True)
+        self.nhints = hints
         if interface is None:
             self.socket = InterfaceSocket()
         else:
@@ -292,7 +764,26 @@ class FFSocket(ForceField):
     def poll(self):
         """Function to check the status of the client calculations."""
 
-        self.socket.poll()
+        if self.socket.poll() > 0:
+            self.notify()
+
+    def wake(self):
+        """Wakes up the polling thread, interrupting its wait on the socket."""
+
+        self.socket.wake()
+
+    def wait_events(self):
+        """Blocks the polling thread until a client needs attention."""
+
+        self.socket.wait(self.latency)
+
+    def get_stats(self):
+        """Returns a dictionary with the average timings of the recent
+        requests, together with the activity of the clients."""
+
+        stats = super(FFSocket, self).get_stats()
+        stats.update(self.socket.get_stats())
+        return stats
 
     def run(self):
         """Spawns a new thread."""
@@ -314,84 +805,394 @@ class FFLennardJones(ForceField):
 
     """Basic fully pythonic force provider.
 
-    Computes LJ interactions without minimum image convention, cutoffs or
-    neighbour lists. Parallel evaluation with threads.
+    Computes LJ interactions, optionally with a sharp cutoff and periodic
+    boundary conditions in a general triclinic cell. The pairs are found with
+    a Verlet neighbour list, one for each bead, built using cell lists and
+    only rebuilt when the atoms have moved by more than half the skin.
+    Without a cutoff, all the pairs of atoms interact.
 
     Attributes:
         parameters: A dictionary of the parameters used by the driver. Of the
-            form {'name': value}.
+            form {'name': value}. Besides 'eps' and 'sigma', it can contain a
+            'cutoff' (mandatory with PBC) and a 'skin' for the neighbour lists.
         requests: During the force calculation step this holds a dictionary
             containing the relevant data for determining the progress of the step.
             Of the form {'atoms': atoms, 'cell': cell, 'pars': parameters,
                          'status': status, 'result': result, 'id': bead id,
                          'start': starting time}.
+        nlists: A dictionary with the neighbour list of each request id.
     """
 
-    def __init__(self, latency=1.0e-3, name="", pars=None, dopbc=False):
+    def __init__(self, latency=1.0e-3, name="", pars=None, dopbc=False, threaded=False):
         """Initialises FFLennardJones.
 
         Args:
            pars: Optional dictionary, giving the parameters needed by the driver.
         """
 
-        # check input - PBCs are not implemented here
-        if dopbc:
-            raise ValueError("Periodic boundary conditions are not supported by FFLennardJones.")
-
         # a socket to the communication library is created or linked
-        super(FFLennardJones, self).__init__(latency, name, pars, dopbc=False)
+        super(FFLennardJones, self).__init__(latency, name, pars, dopbc=dopbc, threaded=threaded)
         self.epsfour = float(self.pars["eps"]) * 4
         self.sixepsfour = 6 * self.epsfour
         self.sigma2 = float(self.pars["sigma"]) * float(self.pars["sigma"])
+        self.cutoff = float(self.pars["cutoff"]) if "cutoff" in self.pars else None
+        self.skin = float(self.pars.get("skin", 0.0 if self.cutoff is None else 0.1 * self.cutoff))
+        self.nlists = {}
 
-    def poll(self):
-        """Polls the forcefield checking if there are requests that should
-        be answered, and if necessary evaluates the associated forces and energy."""
-
-        # We have to be thread-safe, as in multi-system mode this might get
-        # called by many threads at once.
-        self._threadlock.acquire()
-        try:
-            for r in self.requests:
-                if r["status"] == "Queued":
-                    r["status"] = "Running"
-                    r["t_dispatched"] = time.time()
-                    self.evaluate(r)
-        finally:
-            self._threadlock.release()
+        # check input - a periodic system needs a cutoff
+        if dopbc and self.cutoff is None:
+            raise ValueError("FFLennardJones needs a cutoff to apply periodic boundary conditions.")
 
     def evaluate(self, r):
-        """Just a silly function evaluating a non-cutoffed, non-pbc and
-        non-neighbour list LJ potential."""
+        """Evaluates the LJ energy, forces and virial over the pairs in the
+        neighbour list of the request."""
 
         q = r["pos"].reshape((-1, 3))
         nat = len(q)
 
-        v = 0.0
-        f = np.zeros(q.shape)
-        for i in range(1, nat):
-            dij = q[i] - q[:i]
-            rij2 = (dij**2).sum(axis=1)
+        if r["id"] not in self.nlists:
+            self.nlists[r["id"]] = NeighbourList(self.cutoff, self.skin, self.dopbc)
+        i, j, d = self.nlists[r["id"]].pairs(q, r["cell"][0])
+
+        rij2 = (d**2).sum(axis=1)
+        if self.cutoff is not None:
+            inside = rij2 < self.cutoff**2
+            i, j, d, rij2 = i[inside], j[inside], d[inside], rij2[inside]
+
+        x6 = (self.sigma2 / rij2)**3
+        x12 = x6**2
+        v = self.epsfour * (x12 - x6).sum()
+
+        # d goes from atom i to atom j, so fij is the force acting on j
+        fij = d * (self.sixepsfour * (2.0 * x12 - x6) / rij2)[:, np.newaxis]
+        f = np.zeros((nat, 3))
+        for k in range(3):
+            f[:, k] = np.bincount(j, fij[:, k], minlength=nat) - np.bincount(i, fij[:, k], minlength=nat)
+        vir = np.dot(fij.T, d)
+
+        return [v, f.reshape(nat * 3), vir, ""]
+
+
+class FFQTIP4PF(ForceField):
+
+    """In-process q-TIP4P/F water model.
+
+    Computes the flexible water model of Habershon, Markland and Manolopoulos,
+    J. Chem. Phys. 131, 024501 (2009), with the same parameters and
+    conventions as the qtip4pf potential of the Fortran driver: the atoms are
+    ordered as O H H O H H ..., the oxygens interact through a Lennard-Jones
+    potential with a sharp cutoff of 9 angstrom, and the electrostatics are
+    computed with an Ewald sum. Unlike the driver, the cell can be triclinic.
+
+    The pairs of molecules are found with Verlet neighbour lists of the
+    oxygens, one for each bead, so that the fast motion of the hydrogens does
+    not cause the lists to be rebuilt. All the requests that share the same
+    cell (e.g. all the beads of a system) are evaluated together, so that the
+    reciprocal-space sum and the intramolecular terms are computed for all of
+    them at once. Molecules that have been split by wrapping the atoms in the
+    cell are reassembled using the minimum image convention.
+
+    Attributes:
+        parameters: A dictionary of the parameters used by the driver. Of the
+            form {'name': value}. It can contain the 'skin' of the neighbour
+            lists, in atomic units, which defaults to 1.0.
+        nlists: A dictionary with the neighbour list of the molecules of each
+            request id.
+        _kcache: The cell and the wavevectors of the reciprocal-space sum for
+            the last cell that has been used.
+    """
+
+    # parameters of the potential, in atomic units
+    qo = -1.1128
+    qh = 0.5564
+    gamma = 0.73612
+    oo_eps = 2.95147e-4
+    oo_sig = 5.96946
+    oo_cut = 9.0 / 0.5291772108
+    theta = 107.4 * np.pi / 180.0
+    reoh = 1.78
+    apot = 0.185
+    bpot = 0.07
+    alp = 1.21
+    # largest O-H distance for which the molecular neighbour lists are guaranteed to be complete
+    rmol = 2.5
+
+    def __init__(self, latency=1.0e-3, name="", pars=None, dopbc=True, threaded=False):
+        """Initialises FFQTIP4PF.
+
+        Args:
+           pars: Optional dictionary, giving the parameters needed by the driver.
+        """
+
+        super(FFQTIP4PF, self).__init__(latency, name, pars, dopbc=dopbc, threaded=threaded)
+        self.skin = float(self.pars.get("skin", 1.0))
+        self.nlists = {}
+        self._kcache = (None, None, None, None)
+
+    def evaluate_batch(self, requests):
+        """Evaluates a batch of requests, all the requests with the same cell at once."""
+
+        nreq = len(requests)
+        if len(requests[0]["pos"]) % 9 != 0:
+            raise ValueError("q-TIP4P/F expects water molecules, with the atoms ordered as O H H O H H ...")
+
+        pot = np.zeros(nreq)
+        f = np.zeros((nreq, len(requests[0]["pos"])))
+        vir = np.zeros((nreq, 3, 3))
+        groups = OrderedDict()
+        for k, r in enumerate(requests):
+            groups.setdefault(r["cell"][0].tostring(), []).append(k)
+        for group in groups.values():
+            pot[group], f[group], vir[group] = self.evaluate_cell([requests[k] for k in group])
+        return [pot, f, vir, [""] * nreq]
+
+    def evaluate_cell(self, requests):
+        """Evaluates the energy, forces and virial of requests that share the same cell.
+
+        Args:
+            requests: A list of requests with the same number of atoms and cell.
+
+        Returns:
+            A tuple (pot, f, vir) with an array of the potentials, an array
+            (nreq, 3*natoms) of forces and an array (nreq, 3, 3) of virials.
+        """
+
+        h, ih = requests[0]["cell"]
+        nreq = len(requests)
+        q = np.array([r["pos"] for r in requests]).reshape((nreq, -1, 3, 3))
+        nmol = q.shape[1]
+
+        # reassembles the molecules, and puts the negative charge on the M site
+        doh = q[:, :, 1:] - q[:, :, :1]
+        doh -= np.dot(np.round(np.dot(doh, ih.T)), h.T)
+        if (doh**2).sum(axis=3).max() > self.rmol**2:
+            raise ValueError("O-H distance larger than %f in q-TIP4P/F water." % self.rmol)
+        sites = np.empty(q.shape)
+        sites[:, :, 0] = q[:, :, 0] + 0.5 * (1.0 - self.gamma) * doh.sum(axis=2)
+        sites[:, :, 1:] = q[:, :, :1] + doh
+
+        # the pairs of molecules close enough for their charges to be within the Ewald cutoff
+        rcut, alpha, kcut = ewald_parameters(h, 3 * nmol)
+        oxygens = q[:, :, 0].reshape((-1, 3))
+        i, j, shifts = self.pairs(requests, oxygens.reshape((nreq, nmol, 3)), max(self.oo_cut, rcut + 2.0 * self.rmol), h)
+        tshift = np.dot(shifts, h.T)
+
+        pot, fsites, vir = self.coulomb(sites.reshape((-1, 3, 3)), i, j, tshift, h, rcut, alpha, kcut, nreq)
+        # the force on the M site is shared between the atoms of the molecule
+        f = fsites.copy()
+        f[:, :, 0] = self.gamma * fsites[:, :, 0]
+        f[:, :, 1:] += 0.5 * (1.0 - self.gamma) * fsites[:, :, :1]
+
+        vlj, flj, virlj = self.lennard_jones(oxygens, i, j, tshift, h, nreq)
+        f[:, :, 0] += flj
+
+        vintra, fintra, virintra = self.intramolecular(doh)
+        f += fintra
+
+        return pot + vlj + vintra, f.reshape((nreq, -1)), vir + virlj + virintra
+
+    def pairs(self, requests, oxygens, cutoff, h):
+        """Lists the pairs of molecules whose oxygens are closer than a cutoff.
+
+        Args:
+            requests: The list of the requests.
+            oxygens: An array (nreq, nmol, 3) with the positions of the oxygens.
+            cutoff: The cutoff.
+            h: The cell matrix.
+
+        Returns:
+            A tuple (i, j, shifts) with the indices of the molecules in each
+            pair, counting the molecules of all the requests one after the
+            other, and the lattice translations of molecule j.
+        """
+
+        nmol = oxygens.shape[1]
+        pi, pj, pshift = [], [], []
+        for b, r in enumerate(requests):
+            nlist = self.nlists.get(r["id"])
+            if nlist is None or nlist.cutoff != cutoff:
+                # the Ewald cutoff depends on the cell, so it changes at constant pressure
+                nlist = self.nlists[r["id"]] = NeighbourList(cutoff, self.skin)
+            i, j, d = nlist.pairs(oxygens[b], h)
+            close = (d**2).sum(axis=1) < cutoff**2
+            pi.append(i[close] + b * nmol)
+            pj.append(j[close] + b * nmol)
+            pshift.append(nlist.shifts[close])
+        return np.concatenate(pi), np.concatenate(pj), np.concatenate(pshift)
+
+    @staticmethod
+    def pair_sums(i, j, fij, d, nreq, nsites):
+        """Sums the forces and virials of a list of central pair interactions.
+
+        Args:
+            i, j: The indices of the sites in each pair, counting the sites of
+                all the requests one after the other.
+            fij: An array (npairs, 3) with the forces acting on site j.
+            d: An array (npairs, 3) with the vectors going from site i to site j.
+            nreq: The number of requests.
+            nsites: The number of sites in each request.
+
+        Returns:
+            A tuple (f, vir) with an array (nreq * nsites, 3) of forces and an
+            array (nreq, 3, 3) of virials.
+        """
+
+        f = np.zeros((nreq * nsites, 3))
+        vir = np.zeros((nreq, 3, 3))
+        b = i // nsites
+        for k in range(3):
+            f[:, k] = np.bincount(j, fij[:, k], minlength=nreq * nsites) - np.bincount(i, fij[:, k], minlength=nreq * nsites)
+            for l in range(3):
+                vir[:, k, l] = np.bincount(b, fij[:, k] * d[:, l], minlength=nreq)
+        return f, vir
+
+    def coulomb(self, sites, i, j, tshift, h, rcut, alpha, kcut, nreq):
+        """Computes the electrostatic energy, forces on the charges and virial with an Ewald sum.
+
+        Args:
+            sites: An array (nreq * nmol, 3, 3) with the positions of the M, H
+                and H sites of the molecules of all the requests.
+            i, j, tshift: The pairs of molecules, and the translation of the
+                second molecule of each pair.
+            h: The cell matrix.
+            rcut, alpha, kcut: The parameters of the Ewald sum.
+            nreq: The number of requests.
+
+        Returns:
+            A tuple (pot, f, vir) with the energies, an array (nreq, nmol, 3, 3)
+            with the forces on the sites, and the virials.
+        """
+
+        nmol = len(sites) / nreq
+        z = np.array([self.qo, self.qh, self.qh])
+
+        # the real-space sum over the pairs of charges of different molecules within the cutoff
+        pi, pj, pd, pq, pbonded = [], [], [], [], []
+        for a in range(3):
+            for b in range(3):
+                d = sites[j, b] - sites[i, a] + tshift
+                close = (d**2).sum(axis=1) < rcut**2
+                pi.append(3 * i[close] + a)
+                pj.append(3 * j[close] + b)
+                pd.append(d[close])
+                pq.append(np.repeat(z[a] * z[b], close.sum()))
+                pbonded.append(np.zeros(close.sum(), bool))
+        # the charges of the same molecule do not interact directly, but with their screening charges
+        mol = np.arange(len(sites))
+        for a, b in [(0, 1), (0, 2), (1, 2)]:
+            pi.append(3 * mol + a)
+            pj.append(3 * mol + b)
+            pd.append(sites[:, b] - sites[:, a])
+            pq.append(np.repeat(z[a] * z[b], len(sites)))
+            pbonded.append(np.ones(len(sites), bool))
+        pi, pj, pd = np.concatenate(pi), np.concatenate(pj), np.concatenate(pd)
+        vij, fij = real_space(pd, np.concatenate(pq), alpha, np.concatenate(pbonded))
+        pot = np.bincount(pi // (3 * nmol), vij, minlength=nreq)
+        f, vir = self.pair_sums(pi, pj, fij, pd, nreq, 3 * nmol)
+
+        if self._kcache[0] is None or not np.array_equal(self._kcache[0], h):
+            self._kcache = (h.copy(),) + kvectors(h, alpha, kcut)
+        zall = np.tile(z, nmol)
+        vk, fk, virk = reciprocal_space(sites.reshape((nreq, -1, 3)), zall, h, self._kcache[1], self._kcache[2], self._kcache[3], alpha)
+
+        return pot + vk - self_energy(zall, alpha), f.reshape((nreq, nmol, 3, 3)) + fk.reshape((nreq, nmol, 3, 3)), vir + virk
+
+    def lennard_jones(self, oxygens, i, j, tshift, h, nreq):
+        """Computes the Lennard-Jones energy, forces on the oxygens and virial.
+
+        As in the driver, the virial includes the long-range correction to
+        the pressure due to the cutoff, but the energy does not.
+
+        Args:
+            oxygens: An array (nreq * nmol, 3) with the positions of the oxygens
+                of all the requests.
+            i, j, tshift: The pairs of molecules, and the translation of the
+                second molecule of each pair.
+            h: The cell matrix.
+            nreq: The number of requests.
+
+        Returns:
+            A tuple (pot, f, vir) with the energies, an array (nreq, nmol, 3)
+            with the forces on the oxygens, and the virials.
+        """
+
+        nmol = len(oxygens) / nreq
+        d = oxygens[j] - oxygens[i] + tshift
+        rij2 = (d**2).sum(axis=1)
+        close = rij2 < self.oo_cut**2
+        i, j, d, rij2 = i[close], j[close], d[close], rij2[close]
+
+        x6 = (self.oo_sig**2 / rij2)**3
+        x12 = x6**2
+        pot = np.bincount(i // nmol, 4.0 * self.oo_eps * (x12 - x6), minlength=nreq)
+        fij = d * (24.0 * self.oo_eps * (2.0 * x12 - x6) / rij2)[:, np.newaxis]
+        f, vir = self.pair_sums(i, j, fij, d, nreq, nmol)
+
+        sc3 = (self.oo_sig / self.oo_cut)**3
+        ptail = 16.0 * np.pi * nmol**2 * self.oo_eps * self.oo_sig**3 * (2.0 / 3.0 * sc3**3 - sc3) / (3.0 * abs(np.linalg.det(h)))
+        vir += ptail * np.identity(3)
+
+        return pot, f.reshape((nreq, nmol, 3)), vir
+
+
+    def intramolecular(self, doh):
+        """Computes the intramolecular energy, forces and virial.
+
+        The O-H stretches are described by a quartic expansion of a Morse
+        potential, and the H-O-H bend by a harmonic potential. As in the
+        driver, the angle is written in terms of the three interatomic
+        distances, so that the forces are sums of central pair forces.
+
+        Args:
+            doh: An array (nreq, nmol, 2, 3) with the two O-H vectors of
+                each molecule.
+
+        Returns:
+            A tuple (pot, f, vir) with the energy of each configuration, an
+            array (nreq, nmol, 3, 3) with the forces on the O, H and H atoms
+            of each molecule, and an array (nreq, 3, 3) of virials.
+        """
+
+        # the O-H1, O-H2 and H1-H2 vectors and distances
+        d = np.concatenate((doh, doh[:, :, 1:] - doh[:, :, :1]), axis=2)
+        r = np.sqrt((d**2).sum(axis=3))
+        r1, r2, r3 = r[..., 0], r[..., 1], r[..., 2]
 
-            x6 = (self.sigma2 / rij2)**3
-            x12 = x6**2
+        cos = np.clip((r1**2 + r2**2 - r3**2) / (2.0 * r1 * r2), -1.0, 1.0)
+        dang = np.arccos(cos) - self.theta
+        dcos = np.array([1.0 / r2 - cos / r1, 1.0 / r1 - cos / r2, -r3 / (r1 * r2)])
+        dtheta = -dcos / np.sqrt(1.0 - cos**2)
 
-            v += (x12 - x6).sum()
-            dij *= (self.sixepsfour * (2.0 * x12 - x6) / rij2)[:, np.newaxis]
-            f[i] += dij.sum(axis=0)
-            f[:i] -= dij
+        a = self.alp * (r[..., :2] - self.reoh)
+        pot = (self.apot * (a**2 - a**3 + 7.0 / 12.0 * a**4)).sum(axis=(1, 2)) + (self.bpot * dang**2).sum(axis=1)
+        dvdr = 2.0 * self.bpot * dang * dtheta
+        dvdr[:2] += np.rollaxis(self.apot * self.alp * (2.0 * a - 3.0 * a**2 + 7.0 / 3.0 * a**3), 2)
 
-        v *= self.epsfour
+        # forces acting on the second atom of each pair
+        fij = -d * (np.rollaxis(dvdr, 0, 3) / r)[..., np.newaxis]
+        f = np.empty(doh.shape[:2] + (3, 3))
+        f[:, :, 0] = -fij[:, :, 0] - fij[:, :, 1]
+        f[:, :, 1] = fij[:, :, 0] - fij[:, :, 2]
+        f[:, :, 2] = fij[:, :, 1] + fij[:, :, 2]
+        vir = np.einsum("bmpk,bmpl->bkl", fij, d)
 
-        r["result"] = [v, f.reshape(nat * 3), np.zeros((3, 3), float), ""]
-        r["status"] = "Done"
+        return pot, f, vir
+
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
 
 
 class FFDebye(ForceField):
 
     """Debye crystal harmonic reference potential
 
-    Computes a harmonic forcefield.
+    Computes a harmonic forcefield. The Hessian can be a dense array, a
+    sparse matrix (which requires scipy), or be given in a low-rank plus
+    diagonal form, diag(Hdiag) + Hvecs diag(Hvals) Hvecs^T, so that the
+    forces on large crystals can be computed without storing a dense matrix.
 
     Attributes:
        parameters: A dictionary of the parameters used by the driver. Of the
@@ -401,62 +1202,160 @@ class FFDebye(ForceField):
           Of the form {'atoms': atoms, 'cell': cell, 'pars': parameters,
                        'status': status, 'result': result, 'id': bead id,
                        'start': starting time}.
+       H: The Hessian, as a dense array or a CSR sparse matrix, or None if it
+          is given in the low-rank plus diagonal form.
+       Hdiag: The diagonal of the low-rank plus diagonal form of the Hessian.
+       Hvecs: An array (3*natoms, k) with the vectors of the low-rank part.
+       Hvals: The k weights of the vectors of the low-rank part.
+       hessian_file: The file the Hessian has been read from, if any.
     """
 
-    def __init__(self, latency=1.0, name="", H=None, xref=None, vref=0.0, pars=None, dopbc=False, threaded=True):
+    def __init__(self, latency=1.0, name="", H=None, xref=None, vref=0.0, pars=None, dopbc=False, threaded=False,
+                 Hdiag=None, Hvecs=None, Hvals=None, diagonalise=False, hessian_file=""):
         """Initialises FFDebye.
 
         Args:
            pars: Optional dictionary, giving the parameters needed by the driver.
+           H: The Hessian, as a dense array or a scipy sparse matrix.
+           Hdiag: The diagonal of the Hessian in the low-rank plus diagonal form,
+              used if H is not given.
+           Hvecs: The vectors of the low-rank part. Defaults to none.
+           Hvals: The weights of the vectors of the low-rank part. Default to one.
+           diagonalise: Computes and prints the eigenvalues of the Hessian,
+              which requires a dense copy of it.
+           hessian_file: The file the Hessian has been read from, if any.
         """
 
         # a socket to the communication library is created or linked
         # NEVER DO PBC -- forces here are computed without.
-        super(FFDebye, self).__init__(latency, name, pars, dopbc=False)
+        super(FFDebye, self).__init__(latency, name, pars, dopbc=False, threaded=threaded)
 
-        if H is None:
+        if H is None and Hdiag is None:
             raise ValueError("Must provide the Hessian for the Debye crystal.")
         if xref is None:
             raise ValueError("Must provide a reference configuration for the Debye crystal.")
 
+        if H is not None and not isinstance(H, np.ndarray):
+            if sparse is None or not sparse.issparse(H):
+                raise ValueError("The Hessian of the Debye crystal must be an array or a scipy sparse matrix.")
+            H = sparse.csr_matrix(H)
+        if H is None:
+            if Hvecs is None:
+                Hvecs = np.zeros((len(Hdiag), 0))
+            if Hvals is None:
+                Hvals = np.ones(Hvecs.shape[1])
+            if Hvecs.shape[0] != len(Hdiag) or Hvals.shape != (Hvecs.shape[1],):
+                raise ValueError("Inconsistent sizes of the low-rank and diagonal parts of the Hessian.")
+
         self.H = H
+        self.Hdiag = Hdiag
+        self.Hvecs = Hvecs
+        self.Hvals = Hvals
         self.xref = xref
         self.vref = vref
+        self.hessian_file = hessian_file
 
-        eigsys = np.linalg.eigh(self.H)
-        info(" @ForceField: Hamiltonian eigenvalues: " + ' '.join(map(str, eigsys[0])), verbosity.medium)
+        if diagonalise:
+            eigvals = np.linalg.eigvalsh(self.dense_hessian())
+            info(" @ForceField: Hamiltonian eigenvalues: " + ' '.join(map(str, eigvals)), verbosity.medium)
 
-    def poll(self):
-        """ Polls the forcefield checking if there are requests that should
-        be answered, and if necessary evaluates the associated forces and energy. """
+    def size(self):
+        """Returns the number of degrees of freedom of the Hessian."""
 
-        # we have to be thread-safe, as in multi-system mode this might get called by many threads at once
-        self._threadlock.acquire()
-        try:
-            for r in self.requests:
-                if r["status"] == "Queued":
-                    r["status"] = "Running"
+        return self.H.shape[0] if self.H is not None else len(self.Hdiag)
 
-                    self.evaluate(r)
-        finally:
-            self._threadlock.release()
+    def dense_hessian(self):
+        """Returns the Hessian as a dense array."""
 
-    def evaluate(self, r):
-        """ A simple evaluator for a harmonic Debye crystal potential. """
+        if self.H is None:
+            return np.diag(self.Hdiag) + np.dot(self.Hvecs * self.Hvals, self.Hvecs.T)
+        elif isinstance(self.H, np.ndarray):
+            return self.H
+        else:
+            return self.H.toarray()
 
-        q = r["pos"]
-        n3 = len(q)
-        if self.H.shape != (n3, n3):
+    def hessian_dot(self, d):
+        """Multiplies the Hessian by each row of an array of displacements.
+
+        Args:
+           d: An array (nbeads, 3*natoms) of displacements.
+
+        Returns:
+           An array (nbeads, 3*natoms) with the products.
+        """
+
+        if self.H is None:
+            return d * self.Hdiag + np.dot(np.dot(d, self.Hvecs) * self.Hvals, self.Hvecs.T)
+        elif isinstance(self.H, np.ndarray):
+            return np.dot(d, self.H.T)
+        else:
+            # a single sparse matrix-matrix product for all the beads
+            return np.asarray(self.H.dot(d.T)).T
+
+    def evaluate_batch(self, requests):
+        """ A simple evaluator for a harmonic Debye crystal potential.
+        Computes the forces on all the beads with a single matrix product. """
+
+        q = np.array([r["pos"] for r in requests])
+        n3 = q.shape[1]
+        if self.size() != n3 or (self.H is not None and self.H.shape != (n3, n3)):
             raise ValueError("Hessian size mismatch")
         if self.xref.shape != (n3,):
             raise ValueError("Reference structure size mismatch")
 
         d = q - self.xref
-        mf = np.dot(self.H, d)
+        mf = self.hessian_dot(d)
+
+        return [self.vref + 0.5 * (d * mf).sum(axis=1), -mf, np.zeros((len(requests), 3, 3), float), [""] * len(requests)]
+
 
-        r["result"] = [self.vref + 0.5 * np.dot(d, mf), -mf, np.zeros((3, 3), float), ""]
-        r["status"] = "Done"
-        r["t_finished"] = time.time()
+class FFProcessPool(ForceField):
+
+    """Evaluates a Python potential in a pool of worker processes.
+
+    Loads a user-provided function in several processes, so that the beads
+    are evaluated in parallel on different cores, without sockets or
+    external drivers. See ProcessPool for the form of the function.
+
+    Attributes:
+       pool: The ProcessPool object running the workers.
+    """
+
+    def __init__(self, latency=1.0, name="", pars=None, dopbc=False, active=np.array([-1]), threaded=False,
+                 module="", function="potential", nprocs=1):
+        """Initialises FFProcessPool.
+
+        Args:
+           pars: Optional dictionary, passed to the function as keyword arguments.
+           module: The name of the module, or the path of the Python file,
+              containing the potential.
+           function: The name of the function computing the potential.
+           nprocs: The number of worker processes.
+        """
+
+        super(FFProcessPool, self).__init__(latency, name, pars, dopbc, active, threaded=threaded)
+        if module == "":
+            raise ValueError("Must provide the module containing the potential of FFProcessPool.")
+        self.pool = ProcessPool(module, function, nprocs, self.pars)
+
+    def evaluate_batch(self, requests):
+        """Evaluates all the requests at once, distributing them over the workers."""
+
+        results = self.pool.evaluate([(r["pos"], r["cell"][0], r["cell"][1]) for r in requests])
+        return [np.array([res[0] for res in results]), np.array([res[1] for res in results]),
+                np.array([res[2] for res in results]), [res[3] for res in results]]
+
+    def run(self):
+        """Starts the worker processes."""
+
+        self.pool.start()
+        super(FFProcessPool, self).run()
+
+    def stop(self):
+        """Terminates the worker processes."""
+
+        super(FFProcessPool, self).stop()
+        self.pool.stop()
 
 
 try:
@@ -480,7 +1379,7 @@ class FFPlumed(ForceField):
                       'start': starting time}.  
     """
 
-    def __init__(self, latency=1.0e-3, name="", pars=None, dopbc=False, init_file="", plumeddat="", precision=8, plumedstep=0):
+    def __init__(self, latency=1.0e-3, name="", pars=None, dopbc=False, threaded=False, init_file="", plumeddat="", precision=8, plumedstep=0):
         """Initialises FFPlumed.
 
         Args:
@@ -490,7 +1389,7 @@ class FFPlumed(ForceField):
         # a socket to the communication library is created or linked
         if plumed is None:
             raise ImportError("Cannot find plumed libraries to link to a FFPlumed object/")
-        super(FFPlumed, self).__init__(latency, name, pars, dopbc=False)
+        super(FFPlumed, self).__init__(latency, name, pars, dopbc=False, threaded=threaded)
         self.plumed = plumed.Plumed(precision)
         self.precision = precision
         self.plumeddat = plumeddat
@@ -522,22 +1421,6 @@ class FFPlumed(ForceField):
         self.masses = dstrip(myatoms.m)
         self.lastq = np.zeros(3 * self.natoms)
 
-    def poll(self):
-        """Polls the forcefield checking if there are requests that should
-        be answered, and if necessary evaluates the associated forces and energy."""
-
-        # We have to be thread-safe, as in multi-system mode this might get
-        # called by many threads at once.
-        self._threadlock.acquire()
-        try:
-            for r in self.requests:
-                if r["status"] == "Queued":
-                    r["status"] = "Running"
-                    r["t_dispatched"] = time.time()
-                    self.evaluate(r)
-        finally:
-            self._threadlock.release()
-
     def evaluate(self, r):
         """A wrapper function to call the PLUMED evaluation routines
         and return forces."""
@@ -570,8 +1453,7 @@ class FFPlumed(ForceField):
         self.plumed.cmd("getBias", bias)
         v = bias[0]
 
-        r["result"] = [v, f, vir, ""]
-        r["status"] = "Done"
+        return [v, f, vir, ""]
 
     def mtd_update(self, pos, cell):
         """ Makes updates to the potential that only need to be triggered
@@ -599,7 +1481,7 @@ class FFYaff(ForceField):
 
     """ Use Yaff as a library to construct a force field """
 
-    def __init__(self, latency=1.0, name="", yaffpara=None, yaffsys=None, yafflog='yaff.log', rcut=18.89726133921252, alpha_scale=3.5, gcut_scale=1.1, skin=0, smooth_ei=False, reci_ei='ewald', pars=None, dopbc=False, threaded=True):
+    def __init__(self, latency=1.0, name="", yaffpara=None, yaffsys=None, yafflog='yaff.log', rcut=18.89726133921252, alpha_scale=3.5, gcut_scale=1.1, skin=0, smooth_ei=False, reci_ei='ewald', pars=None, dopbc=False, threaded=False):
         """Initialises FFYaff and enables a basic Yaff force field.
 
         Args:
@@ -623,7 +1505,7 @@ class FFYaff(ForceField):
         import atexit
 
         # a socket to the communication library is created or linked
-        super(FFYaff, self).__init__(latency, name, pars, dopbc)
+        super(FFYaff, self).__init__(latency, name, pars, dopbc, threaded=threaded)
 
         # A bit weird to use keyword argument for a required argument, but this
         # is also done in the code above.
@@ -656,21 +1538,6 @@ class FFYaff(ForceField):
 
         log._active = False
 
-    def poll(self):
-        """ Polls the forcefield checking if there are requests that should
-        be answered, and if necessary evaluates the associated forces and energy. """
-
-        # we have to be thread-safe, as in multi-system mode this might get called by many threads at once
-        self._threadlock.acquire()
-        try:
-            for r in self.requests:
-                if r["status"] == "Queued":
-                    r["status"] = "Running"
-
-                    self.evaluate(r)
-        finally:
-            self._threadlock.release()
-
     def evaluate(self, r):
         """ Evaluate the energy and forces with the Yaff force field. """
 
@@ -684,6 +1551,4 @@ class FFYaff(ForceField):
         vtens = np.zeros((3, 3))
         e = self.ff.compute(gpos, vtens)
 
-        r["result"] = [e, -gpos.ravel(), -vtens, ""]
-        r["status"] = "Done"
-        r["t_finished"] = time.time()
+        return [e, -gpos.ravel(), -vtens, ""]
@@ -16,6 +16,7 @@ import time
 import sys
 import threading
 from copy import deepcopy
+from collections import deque
 
 import numpy as np
 
@@ -32,6 +33,29 @@ __all__ = ['Forces', 'ForceComponent']
 fbuid = 0
 
 
+def request_priority(mts_weights, nbeads, nfull):
+    """Computes the priority of the requests of a force component.
+
+    The forces of the inner levels of a multiple time step integrator are
+    needed first, as they are used several times per step, so the priority
+    grows with the innermost level the component contributes to. Within a
+    level, components evaluated on a contracted ring polymer, which are
+    usually the most expensive ones, are started first.
+
+    Args:
+       mts_weights: The weights of the component at each MTS level.
+       nbeads: The number of beads the component is evaluated on.
+       nfull: The number of beads of the full ring polymer.
+
+    Returns:
+       A number, larger for the requests that should be served first.
+    """
+
+    levels = np.flatnonzero(np.asarray(mts_weights))
+    level = levels[-1] if len(levels) > 0 else 0
+    return level + (1.0 - float(nbeads) / nfull)
+
+
 class ForceBead(dobject):
 
     """Base force helper class.
@@ -49,10 +73,19 @@ class ForceBead(dobject):
           forcefields.
        request: A dictionary containing information about the currently
           running job.
+       priority: The priority of the requests sent to the forcefield.
+       history: The positions of the last configurations sent to the
+          forcefield, the most recent first, or None if the forcefield does
+          not use them.
+       nsent: The number of configurations sent to the forcefield.
        _threadlock: Python handle used to lock the thread used to run the
           communication with the client code.
+       _getallcond: Condition built on _threadlock, used to wait until all
+          the concurrent calls to get_all have returned.
        _getallcount: An integer giving how many times the getall function has
           been called.
+       _output: The storage of the force and virial, which is handed to the
+          forcefield so that results can be written straight into it.
 
     Depend objects:
        ufvx: A list of the form [pot, f, vir]. These quantities are calculated
@@ -77,10 +110,11 @@ class ForceBead(dobject):
         # ufvx is a list [ u, f, vir, extra ]  which stores the results of the force calculation
         dself.ufvx = depend_value(name="ufvx", func=self.get_all)
         self._threadlock = threading.Lock()
+        self._getallcond = threading.Condition(self._threadlock)
         self.request = None
         self._getallcount = 0
 
-    def bind(self, atoms, cell, ff):
+    def bind(self, atoms, cell, ff, fbase=None, priority=0):
         """Binds atoms, cell and a forcefield template to the ForceBead object.
 
         Args:
@@ -89,6 +123,10 @@ class ForceBead(dobject):
            ff: A forcefield object which can calculate the potential, virial
               and forces given an unit cell and atom positions of one replica
               of the system.
+           fbase: An optional array of size 3*natoms to store the force,
+              typically a row of the force array of a ForceComponent.
+           priority: The priority of the requests sent to the forcefield.
+              Requests with a higher priority are evaluated first.
         """
 
         global fbuid  # assign a unique identifier to each forcebead object
@@ -100,6 +138,9 @@ class ForceBead(dobject):
         self.atoms = atoms
         self.cell = cell
         self.ff = ff
+        self.priority = priority
+        self.history = deque(maxlen=ff.nhints) if ff.nhints > 0 else None
+        self.nsent = 0
         dself = dd(self)
 
         # ufv depends on the atomic positions and on the cell
@@ -110,13 +151,16 @@ class ForceBead(dobject):
         dself.pot = depend_value(name="pot", func=self.get_pot,
                                  dependencies=[dself.ufvx])
 
-        dself.vir = depend_array(name="vir", value=np.zeros((3, 3), float),
+        vbase = np.zeros((3, 3), float)
+        dself.vir = depend_array(name="vir", value=vbase,
                                  func=self.get_vir,
                                  dependencies=[dself.ufvx])
 
         # NB: the force requires a bit more work, to define shortcuts to xyz
         # slices without calculating the force at this point.
-        fbase = np.zeros(atoms.natoms * 3, float)
+        if fbase is None:
+            fbase = np.zeros(atoms.natoms * 3, float)
+        self._output = (fbase, vbase)
         dself.f = depend_array(name="f", value=fbase, func=self.get_f,
                                dependencies=[dself.ufvx])
 
@@ -140,7 +184,15 @@ class ForceBead(dobject):
 
         with self._threadlock:
             if self.request is None and dd(self).ufvx.tainted():
-                self.request = self.ff.queue(self.atoms, self.cell, reqid=self.uid)
+                hints = None
+                if self.history is not None:
+                    # the client gets the previous configurations of this replica, to extrapolate a starting guess
+                    q = dstrip(self.atoms.q).copy()
+                    hints = (self.nsent, q, list(self.history))
+                    self.history.appendleft(q)
+                self.nsent += 1
+                self.request = self.ff.queue(self.atoms, self.cell, reqid=self.uid, output=self._output,
+                                              priority=self.priority, hints=hints)
 
     def get_all(self):
         """Driver routine.
@@ -162,20 +214,20 @@ class ForceBead(dobject):
 
         # this is converting the distribution library requests into [ u, f, v ]  lists
         if self.request is None:
-            self.request = self.queue()
-
-        # sleeps until the request has been evaluated
-        while self.request["status"] != "Done":
-            if self.request["status"] == "Exit" or softexit.triggered:
-                # now, this is tricky. we are stuck here and we cannot return meaningful results.
-                # if we return, we may as well output wrong numbers, or mess up things.
-                # so we can only call soft-exit and wait until that is done. then kill the thread
-                # we are in.
-                softexit.trigger(" @ FORCES : cannot return so will die off here")
-                while softexit.exiting:
-                    time.sleep(self.ff.latencyt)
-                sys.exit()
-            time.sleep(self.ff.latency)
+            self.queue()
+
+        # waits until the request has been evaluated. the forcefield wakes us
+        # up as soon as it is done, or if it is stopped
+        self.ff.wait(self.request)
+        if self.request["status"] != "Done":
+            # now, this is tricky. we are stuck here and we cannot return meaningful results.
+            # if we return, we may as well output wrong numbers, or mess up things.
+            # so we can only call soft-exit and wait until that is done. then kill the thread
+            # we are in.
+            softexit.trigger(" @ FORCES : cannot return so will die off here")
+            while softexit.exiting:
+                time.sleep(self.ff.latency)
+            sys.exit()
 
         # print diagnostics about the elapsed time
         info("# forcefield %s evaluated in %f (queue) and %f (dispatched) sec." % (self.ff.name, self.request["t_finished"] - self.request["t_queued"], self.request["t_finished"] - self.request["t_dispatched"]), verbosity.debug)
@@ -184,17 +236,18 @@ class ForceBead(dobject):
         # freed up for new calculations
         result = self.request["result"]
 
-        # reduce the reservation count (and wait for all calls to return)
-        with self._threadlock:
+        # reduce the reservation count, releases just once, but wait for all
+        # calls to return
+        with self._getallcond:
             self._getallcount -= 1
-
-        # releases just once, but wait for all requests to be complete
-        if self._getallcount == 0:
-            self.ff.release(self.request)
-            self.request = None
-        else:
-            while self._getallcount > 0:
-                time.sleep(self.ff.latency)
+            if self._getallcount == 0:
+                self.ff.release(self.request)
+                self.request = None
+                self._getallcond.notify_all()
+            else:
+                # with a timeout, so that the signal handlers can run in the meanwhile
+                while self._getallcount > 0 and not softexit.triggered:
+                    self._getallcond.wait(self.ff.latency)
 
         return result
 
@@ -257,6 +310,8 @@ class ForceComponent(dobject):
           contribution of this forcefield at each level of a MTS scheme
        ffield: A model to be used to create the forcefield objects for all
           the replicas of the system.
+       priority: The priority of the requests for this component, so that
+          the forcefields evaluate the most urgent components first.
 
     Depend objects:
        f: An array containing the components of the force. Depends on each
@@ -271,7 +326,7 @@ class ForceComponent(dobject):
           Depends on each replica's ufvx list.
     """
 
-    def __init__(self, ffield, nbeads=0, weight=1.0, name="", mts_weights=None, epsilon=-0.001):
+    def __init__(self, ffield, nbeads=0, weight=1.0, name="", mts_weights=None, epsilon=-0.001, priority=0.0):
         """Initializes ForceComponent
 
         Args:
@@ -284,6 +339,7 @@ class ForceComponent(dobject):
               will be weighted by this factor.
            name: The name of the forcefield.
            mts_weights: Weight of forcefield at each mts level.
+           priority: The priority of the requests for this component.
         """
 
         self.ffield = ffield
@@ -295,6 +351,7 @@ class ForceComponent(dobject):
         else:
             self.mts_weights = np.asarray(mts_weights)
         self.epsilon = epsilon
+        self.priority = priority
 
     def bind(self, beads, cell, fflist):
         """Binds beads, cell and force to the forcefield.
@@ -325,15 +382,18 @@ class ForceComponent(dobject):
 
         self.ff = fflist[self.ffield]
 
+        # the forces on individual beads are stored in the rows of a big array,
+        # so they do not have to be gathered
+        fbase = np.zeros((self.nbeads, 3 * self.natoms))
         self._forces = [];
         for b in range(self.nbeads):
             new_force = ForceBead()
-            new_force.bind(beads[b], cell, self.ff)
+            new_force.bind(beads[b], cell, self.ff, fbase=fbase[b], priority=self.priority)
             self._forces.append(new_force)
 
         # f is a big array which assembles the forces on individual beads
         dself.f = depend_array(name="f",
-                               value=np.zeros((self.nbeads, 3 * self.natoms)),
+                               value=fbase,
                                func=self.f_gather,
                                dependencies=[dd(self._forces[b]).f for b in
                                              range(self.nbeads)])
@@ -405,12 +465,12 @@ class ForceComponent(dobject):
            array for replica i of the system.
         """
 
-        newf = np.zeros((self.nbeads, 3 * self.natoms), float)
         self.queue()
         for b in range(self.nbeads):
-            newf[b] = dstrip(self._forces[b].f)
+            # the force of each bead is updated in place, in a row of f
+            self._forces[b].f
 
-        return newf
+        return dstrip(dd(self).f)
 
     def get_vir(self):
         """Sums the virial of each replica.
@@ -575,7 +635,8 @@ class Forces(dobject):
             # if the number of beads for this force component is unspecified,
             # assume full force evaluation
             if newb == 0 or newb > beads.nbeads: newb = beads.nbeads
-            newforce = ForceComponent(ffield=fc.ffield, name=fc.name, nbeads=newb, weight=fc.weight, mts_weights=fc.mts_weights, epsilon=fc.epsilon)
+            newforce = ForceComponent(ffield=fc.ffield, name=fc.name, nbeads=newb, weight=fc.weight, mts_weights=fc.mts_weights,
+                                      epsilon=fc.epsilon, priority=request_priority(fc.mts_weights, newb, beads.nbeads))
             newbeads = Beads(beads.natoms, newb)
             newrpc = nm_rescale(beads.nbeads, newb)
 
@@ -597,20 +658,24 @@ class Forces(dobject):
             self.mforces.append(newforce)
             self.mrpc.append(newrpc)
 
-        # now must expose an interface that gives overall forces
+        # now must expose an interface that gives overall forces. the components
+        # are independent, so they are gathered concurrently
         dself.f = depend_array(name="f", value=np.zeros((self.nbeads, 3 * self.natoms)),
                                func=self.f_combine,
-                               dependencies=[dd(ff).f for ff in self.mforces])
+                               dependencies=[dd(ff).f for ff in self.mforces],
+                               prefetch=(lambda: [dd(ff).f for ff in self.prefetched()]))
 
         # collection of pots and virs from individual ff objects
         dself.pots = depend_array(name="pots", value=np.zeros(self.nbeads, float),
                                   func=self.pot_combine,
-                                  dependencies=[dd(ff).pots for ff in self.mforces])
+                                  dependencies=[dd(ff).pots for ff in self.mforces],
+                                  prefetch=(lambda: [dd(ff).pots for ff in self.prefetched()]))
 
         # must take care of the virials!
         dself.virs = depend_array(name="virs", value=np.zeros((self.nbeads, 3, 3), float),
                                   func=self.vir_combine,
-                                  dependencies=[dd(ff).virs for ff in self.mforces])
+                                  dependencies=[dd(ff).virs for ff in self.mforces],
+                                  prefetch=(lambda: [dd(ff).virs for ff in self.prefetched()]))
 
         dself.extras = depend_value(name="extras", value=np.zeros(self.nbeads, float),
                                     func=self.extra_combine,
@@ -761,6 +826,15 @@ class Forces(dobject):
         for ff in self.mforces:
             ff.stop()
 
+    def prefetched(self):
+        """Returns the components that are gathered concurrently.
+
+        Components with a zero weight are not computed at all, and neither
+        are the ones that do not contribute to any MTS level.
+        """
+
+        return [ff for ff in self.mforces if ff.weight != 0 and (len(ff.mts_weights) == 0 or np.any(ff.mts_weights != 0))]
+
     def queue(self):
         """Submits all the required force calculations to the forcefields."""
 
@@ -999,9 +1073,10 @@ class Forces(dobject):
         for index in range(len(self.mforces)):
             if len(self.mforces[index].mts_weights) > level and self.mforces[index].mts_weights[level] != 0 and self.mforces[index].weight > 0:
                 dv = np.zeros((self.beads.nbeads, 3, 3), float)
+                virs = dview(self.mforces[index].virs)
                 for i in range(3):
                     for j in range(3):
-                        dv[:, i, j] += self.mrpc[index].b2tob1(self.mforces[index].virs[:, i, j])
+                        dv[:, i, j] += self.mrpc[index].b2tob1(virs[:, i, j])
                 rp += self.mforces[index].weight * self.mforces[index].mts_weights[level] * dv
         return rp
 
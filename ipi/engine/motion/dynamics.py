@@ -296,6 +296,7 @@ class NVEIntegrator(DummyIntegrator):
             potential energy, and the spring potential energy.
     """
 
+    @dhot
     def pconstraints(self):
         """This removes the centre of mass contribution to the kinetic energy.
 
@@ -326,7 +327,7 @@ class NVEIntegrator(DummyIntegrator):
             # subtracts COM velocity
             pcom *= 1.0 / (nb * M)
             for i in range(3):
-                self.beads.p[:, i:na3:3] -= m * pcom[i]
+                self.beads.p[:, i:na3:3] = dview(self.beads.p)[:, i:na3:3] - m * pcom[i]
 
         if len(self.fixatoms) > 0:
             for bp in self.beads.p:
@@ -338,18 +339,21 @@ class NVEIntegrator(DummyIntegrator):
                 bp[self.fixatoms * 3 + 1] = 0.0
                 bp[self.fixatoms * 3 + 2] = 0.0
 
+    @dhot
     def pstep(self, level=0):
         """Velocity Verlet monemtum propagator."""
 
         # halfdt/alpha
-        self.beads.p += self.forces.forces_mts(level) * self.pdt[level]
+        pdt = dview(self.pdt)[level]
+        self.beads.p = dview(self.beads.p) + self.forces.forces_mts(level) * pdt
         if level == 0:  # adds bias in the outer loop
-            self.beads.p += dstrip(self.bias.f) * self.pdt[level]
+            self.beads.p = dview(self.beads.p) + dview(self.bias.f) * pdt
 
+    @dhot
     def qcstep(self):
         """Velocity Verlet centroid position propagator."""
         # dt/inmts
-        self.nm.qnm[0, :] += dstrip(self.nm.pnm)[0, :] / dstrip(self.beads.m3)[0] * self.qdt
+        self.nm.qnm[0] = dview(self.nm.qnm)[0] + dview(self.nm.pnm)[0] / dview(self.beads.m3)[0] * self.qdt
 
     # now the idea is that for BAOAB the MTS should work as follows:
     # take the BAB MTS, and insert the O in the very middle. This might imply breaking a A step in two, e.g. one could have
@@ -360,8 +364,9 @@ class NVEIntegrator(DummyIntegrator):
         mk = int(self.nmts[index] / 2)
 
         for i in range(mk):  # do nmts/2 full sub-steps
-            self.pstep(index)
-            self.pconstraints()
+            with dbatch():
+                self.pstep(index)
+                self.pconstraints()
             if index == self.nmtslevels - 1:
                 # call Q propagation for dt/alpha at the inner step
                 self.qcstep()
@@ -371,13 +376,15 @@ class NVEIntegrator(DummyIntegrator):
             else:
                 self.mtsprop(index + 1)
 
-            self.pstep(index)
-            self.pconstraints()
+            with dbatch():
+                self.pstep(index)
+                self.pconstraints()
 
         if self.nmts[index] % 2 == 1:
             # propagate p for dt/2alpha with force at level index
-            self.pstep(index)
-            self.pconstraints()
+            with dbatch():
+                self.pstep(index)
+                self.pconstraints()
             if index == self.nmtslevels - 1:
                 # call Q propagation for dt/alpha at the inner step
                 self.qcstep()
@@ -397,12 +404,14 @@ class NVEIntegrator(DummyIntegrator):
                 self.mtsprop_ab(index + 1)
 
             # propagate p for dt/2alpha with force at level index
-            self.pstep(index)
-            self.pconstraints()
+            with dbatch():
+                self.pstep(index)
+                self.pconstraints()
 
         for i in range(int(self.nmts[index] / 2)):  # do nmts/2 full sub-steps
-            self.pstep(index)
-            self.pconstraints()
+            with dbatch():
+                self.pstep(index)
+                self.pconstraints()
             if index == self.nmtslevels - 1:
                 # call Q propagation for dt/alpha at the inner step
                 self.qcstep()
@@ -412,8 +421,9 @@ class NVEIntegrator(DummyIntegrator):
             else:
                 self.mtsprop(index + 1)
 
-            self.pstep(index)
-            self.pconstraints()
+            with dbatch():
+                self.pstep(index)
+                self.pconstraints()
 
     def mtsprop(self, index):
         # just calls the two pieces together
@@ -438,6 +448,7 @@ class NVTIntegrator(NVEIntegrator):
         thermostat: A thermostat object to keep the temperature constant.
     """
 
+    @dhot
     def tstep(self):
         """Velocity Verlet thermostat step"""
 
@@ -478,6 +489,7 @@ class NPTIntegrator(NVTIntegrator):
     """
 
     # should be enough to redefine these functions, and the step() from NVTIntegrator should do the trick
+    @dhot
     def pstep(self, level=0):
         """Velocity Verlet monemtum propagator."""
 
@@ -485,6 +497,7 @@ class NPTIntegrator(NVTIntegrator):
         super(NPTIntegrator, self).pstep(level)
         #self.pconstraints()
 
+    @dhot
     def qcstep(self):
         """Velocity Verlet centroid position propagator."""
 
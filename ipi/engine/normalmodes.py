@@ -469,6 +469,7 @@ class NormalModes(dobject):
                     dm3[k, a] = self.beads.m3[k, a] * self.o_nm_factor[k]
         return dm3
 
+    @dhot
     def free_qstep(self):
         """Exact normal mode propagator for the free ring polymer.
 
@@ -11,6 +11,7 @@ and the restart files.
 
 import os
 import time
+import json
 
 import numpy as np
 
@@ -25,7 +26,7 @@ from ipi.engine.properties import getkey
 from ipi.engine.atoms import *
 from ipi.engine.cell import *
 
-__all__ = ['PropertyOutput', 'TrajectoryOutput', 'CheckpointOutput']
+__all__ = ['PropertyOutput', 'TrajectoryOutput', 'CheckpointOutput', 'StatsOutput']
 
 
 class PropertyOutput(dobject):
@@ -475,3 +476,59 @@ class CheckpointOutput(dobject):
 
         # Do not use backed up file open on subsequent writes.
         self._continued = True
+
+
+class StatsOutput(dobject):
+
+    """Class dealing with outputting statistics about the forcefields.
+
+    Periodically writes a JSON file with the timings of the requests of each
+    forcefield and the activity of their clients, overwriting the previous one.
+
+    Attributes:
+       filename: The name of the file to output to.
+       stride: The number of steps that should be taken between outputting the
+          data to file.
+       simul: The simulation object to get the forcefields from.
+    """
+
+    def __init__(self, filename="stats", stride=100):
+        """Initializes a statistics output proxy.
+
+        Args:
+           filename: A string giving the name of the file to be output to.
+           stride: An integer giving how many steps should be taken between
+              outputting the data to file.
+        """
+
+        self.filename = filename
+        self.stride = stride
+
+    def bind(self, simul):
+        """Binds output proxy to simulation object.
+
+        Args:
+           simul: A simulation object to be bound.
+        """
+
+        self.simul = simul
+
+    def write(self):
+        """Writes out the statistics of all the forcefields.
+
+        The file is written under a temporary name and then moved in place,
+        so that it can be read at any time while the simulation is running.
+        """
+
+        if softexit.triggered: return  # don't write if we are about to exit!
+
+        if not (self.simul.step + 1) % self.stride == 0:
+            return
+
+        stats = {"step": self.simul.step + 1, "walltime": time.time(), "forcefields": {}}
+        for name, ff in self.simul.fflist.iteritems():
+            stats["forcefields"][name] = ff.get_stats()
+
+        with open(self.filename + ".tmp", "w") as stats_file:
+            json.dump(stats, stats_file, indent=1, sort_keys=True)
+        os.rename(self.filename + ".tmp", self.filename)
@@ -264,6 +264,54 @@ class Properties(dobject):
                          argument index (zero-based) that indicates for which component of the hamiltonian the weight must be returned. """,
                                    'func': (lambda index: self.ensemble.bweights[int(index)])},
 
+            "ff_wait_time": {"dimension": "undefined",
+                             "help": "The wall-clock time in seconds the requests of a forcefield wait before being dispatched.",
+                             "longhelp": """The wall-clock time in seconds the requests of a forcefield wait before being
+                         dispatched to a client, averaged over the last requests. Takes one mandatory argument, the name
+                         of the forcefield.""",
+                             'func': (lambda ff: self.get_ffstat(ff, "wait"))},
+            "ff_dispatch_time": {"dimension": "undefined",
+                                 "help": "The wall-clock time in seconds spent sending and receiving the data of the requests of a forcefield.",
+                                 "longhelp": """The wall-clock time in seconds i-PI spends sending the positions and
+                         receiving the forces of the requests of a forcefield, averaged over the last requests. Takes one
+                         mandatory argument, the name of the forcefield.""",
+                                 'func': (lambda ff: self.get_ffstat(ff, "dispatch"))},
+            "ff_compute_time": {"dimension": "undefined",
+                                "help": "The wall-clock time in seconds the requests of a forcefield take to be computed.",
+                                "longhelp": """The wall-clock time in seconds between the dispatch and the completion of
+                         the requests of a forcefield, excluding the time spent sending and receiving their data, averaged
+                         over the last requests. Takes one mandatory argument, the name of the forcefield.""",
+                                'func': (lambda ff: self.get_ffstat(ff, "compute"))},
+            "ff_bytes": {"dimension": "number",
+                         "help": "The number of bytes moved for each request of a forcefield.",
+                         "longhelp": """The number of bytes exchanged with the clients for each request of a
+                         forcefield, averaged over the last requests. Takes one mandatory argument, the name of the forcefield.""",
+                         'func': (lambda ff: self.get_ffstat(ff, "bytes"))},
+            "ff_utilisation": {"dimension": "number",
+                               "help": "The fraction of time the clients of a socket forcefield are busy.",
+                               "longhelp": """The fraction of the time since they connected that the clients of a
+                         socket forcefield have spent computing forces. Takes one mandatory argument, the name of the
+                         forcefield, and an optional argument 'client', the (zero-based) index of a client. If not
+                         specified, the average over all the connected clients is returned.""",
+                               'func': self.get_ffutilisation},
+            "ff_reconnects": {"dimension": "number",
+                              "help": "The number of clients that connected to a socket forcefield to replace one that had been dropped.",
+                              "longhelp": """The number of clients that connected to a socket forcefield to replace one
+                         that disconnected or became unresponsive. Takes one mandatory argument, the name of the forcefield.""",
+                              'func': (lambda ff: self.get_ffstat(ff, "reconnected"))},
+            "ff_cache_hits": {"dimension": "number",
+                              "help": "The number of requests of a forcefield whose result was found in its cache.",
+                              "longhelp": """The number of force evaluations that have not been dispatched because the
+                         result for the same configuration was in the cache of the forcefield. Takes one mandatory argument,
+                         the name of the forcefield.""",
+                              'func': (lambda ff: self.get_ffstat(ff, "cache_hits"))},
+            "ff_cache_misses": {"dimension": "number",
+                                "help": "The number of requests of a forcefield whose result was not found in its cache.",
+                                "longhelp": """The number of force evaluations that had to be dispatched because the
+                         result for the same configuration was not in the cache of the forcefield. Takes one mandatory
+                         argument, the name of the forcefield.""",
+                                'func': (lambda ff: self.get_ffstat(ff, "cache_misses"))},
+
             #      "ensemble_logweight":  {  "dimension": "",
             #                       "help" : "The (log) weight of the configuration in the biassed ensemble",
             #                       "func": (lambda: self.ensemble.bias/(Constants.kb*self.ensemble.temp)) },
@@ -761,6 +809,39 @@ class Properties(dobject):
         else:
             return prop_vec[bead, 3 * atom:3 * (atom + 1)]
 
+    def get_ffstat(self, ff, key):
+        """Gives one of the statistics about the requests of a forcefield.
+
+        Args:
+           ff: The name of the forcefield.
+           key: The name of the statistic, as in ForceField.get_stats.
+              Statistics that the forcefield does not keep are zero.
+        """
+
+        if not ff in self.simul.fflist:
+            raise KeyError("Cannot output statistics for forcefield " + ff + ", that does not exist")
+        return self.simul.fflist[ff].get_stats().get(key, 0)
+
+    def get_ffutilisation(self, ff, client=""):
+        """Gives the fraction of time the clients of a forcefield are busy.
+
+        Args:
+           ff: The name of the forcefield.
+           client: The index of the client. If not given, the average over
+              all the connected clients is returned.
+        """
+
+        clients = self.get_ffstat(ff, "clients") or []
+        if client != "":
+            client = int(client)
+            if client >= len(clients):
+                return 0.0
+            return clients[client]["utilisation"]
+        if len(clients) == 0:
+            return 0.0
+        return np.mean([c["utilisation"] for c in clients])
+
+    @dhot
     def get_temp(self, atom="", bead="", nm=""):
         """Calculates the MD kinetic temperature.
 
@@ -778,24 +859,24 @@ class Properties(dobject):
 
         if len(self.motion.fixatoms) > 0:
             for i in self.motion.fixatoms:
-                pi = np.tile(np.sqrt(self.beads.m[i] * Constants.kb * self.ensemble.temp), 3)
-                self.beads.p[:, 3 * i:3 * i + 3] += pi
+                pi = np.tile(np.sqrt(dview(self.beads.m)[i] * Constants.kb * self.ensemble.temp), 3)
+                self.beads.p[:, 3 * i:3 * i + 3] = dview(self.beads.p)[:, 3 * i:3 * i + 3] + pi
 
         if self.motion.fixcom:
             # Adds a fake momentum to the centre of mass. This is the easiest way
             # of getting meaningful temperatures for subsets of the system when there
             # are fixed components
-            M = np.sum(self.beads.m3) / 3.0 / self.beads.nbeads
+            M = np.sum(dview(self.beads.m3)) / 3.0 / self.beads.nbeads
             pcm = np.tile(np.sqrt(M * Constants.kb * self.ensemble.temp), 3)
             vcm = np.tile(pcm / M, self.beads.natoms)
 
-            self.beads.p += self.beads.m3 * vcm
+            self.beads.p = dview(self.beads.p) + dview(self.beads.m3) * vcm
 
         kemd, ncount = self.get_kinmd(atom, bead, nm, return_count=True)
 
         if self.motion.fixcom:
             # Removes the fake momentum from the centre of mass.
-            self.beads.p -= self.beads.m3 * vcm
+            self.beads.p = dview(self.beads.p) - dview(self.beads.m3) * vcm
 
         if len(self.motion.fixatoms) > 0:
             # re-fixes the fix atoms
@@ -804,6 +885,7 @@ class Properties(dobject):
 
         return 2.0 * kemd / (Constants.kb * 3.0 * float(ncount) * self.beads.nbeads)
 
+    @dhot
     def get_kincv(self, atom=""):
         """Calculates the quantum centroid virial kinetic energy estimator.
 
@@ -978,6 +1060,7 @@ class Properties(dobject):
 
         return acv
 
+    @dhot
     def get_kintd(self, atom=""):
         """Calculates the quantum centroid virial kinetic energy estimator.
 
@@ -1133,6 +1216,7 @@ class Properties(dobject):
         else:
             return kmd / nbeads
 
+    @dhot
     def get_ktens(self, atom=""):
         """Calculates the quantum centroid virial kinetic energy
         TENSOR estimator.
@@ -1229,6 +1313,7 @@ class Properties(dobject):
 
         return kcv
 
+    @dhot
     def get_rg(self, atom=""):
         """Calculates the radius of gyration of the ring polymers.
 
@@ -1300,6 +1385,7 @@ class Properties(dobject):
 
         return kst
 
+    @dhot
     def kstress_cv(self):
         """Calculates the quantum centroid virial kinetic stress tensor
         estimator.
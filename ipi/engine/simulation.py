@@ -16,7 +16,7 @@ import threading
 import time
 from copy import deepcopy
 
-from ipi.utils.depend import depend_value, dobject, dd
+from ipi.utils.depend import depend_value, dobject, dd, depend_graph, depend_profiler
 from ipi.utils.io.inputs.io_xml import xml_parse_file
 from ipi.utils.messages import verbosity, info, warning, banner
 from ipi.utils.softexit import softexit
@@ -51,6 +51,12 @@ class Simulation(dobject):
             the current state of the simulation. This is because we cannot
             restart from half way through a step, only from the beginning of a
             step, so this is necessary for the trajectory to be continuous.
+        frozen_graph: A boolean giving whether the network of depend objects
+            is frozen once everything has been bound.
+        graph: The frozen depend_graph, or None.
+        depend_profile: The name of the file the profile of the depend
+            objects is written to, or an empty string if they are not profiled.
+        profiler: The depend_profiler, or None.
 
     Depend objects:
         step: The current simulation step.
@@ -106,7 +112,7 @@ class Simulation(dobject):
 
         return simulation
 
-    def __init__(self, mode, syslist, fflist, outputs, prng, smotion=None, step=0, tsteps=1000, ttime=0, threads=False):
+    def __init__(self, mode, syslist, fflist, outputs, prng, smotion=None, step=0, tsteps=1000, ttime=0, threads=False, frozen_graph=False, depend_profile=""):
         """Initialises Simulation class.
 
         Args:
@@ -122,12 +128,22 @@ class Simulation(dobject):
                 to 1000.
             ttime: The simulation running time. Used on restart, to keep a
                 cumulative total.
+            threads: Whether the systems are evolved in parallel threads.
+            frozen_graph: Whether the network of depend objects is frozen
+                after binding, making the invalidation of cached values cheaper.
+            depend_profile: The name of the file the profile of the depend
+                objects is written to, at exit or when SIGUSR1 is received.
+                The depend objects are only profiled if it is given.
         """
 
         info(" # Initializing simulation object ", verbosity.low)
         self.prng = prng
         self.mode = mode
         self.threading = threads
+        self.frozen_graph = frozen_graph
+        self.graph = None
+        self.depend_profile = depend_profile
+        self.profiler = None
         dself = dd(self)
 
         self.syslist = syslist
@@ -171,7 +187,7 @@ class Simulation(dobject):
 
         self.outputs = []
         for o in self.outtemplate:
-            if type(o) is eoutputs.CheckpointOutput:    # checkpoints are output per simulation
+            if type(o) is eoutputs.CheckpointOutput or type(o) is eoutputs.StatsOutput:    # checkpoints and statistics are output per simulation
                 o.bind(self)
                 self.outputs.append(o)
             else:   # properties and trajectories are output per system
@@ -190,6 +206,15 @@ class Simulation(dobject):
         if not self.smotion is None:
             self.smotion.bind(self.syslist, self.prng)
 
+        if self.frozen_graph:
+            # nothing else will be wired up, so the dependencies can be compiled
+            self.graph = depend_graph()
+
+        if self.depend_profile != "":
+            # only the evaluations done while running are of interest
+            self.profiler = depend_profiler(self.depend_profile)
+            self.profiler.start()
+
     def softexit(self):
         """Deals with a soft exit request.
 
@@ -215,6 +240,8 @@ class Simulation(dobject):
 
         # registers the softexit routine
         softexit.register_function(self.softexit)
+        if self.profiler is not None:
+            softexit.register_function(self.profiler.write)
         softexit.start(self.ttime)
 
         for k, f in self.fflist.iteritems():
@@ -178,6 +178,7 @@ class ThermoLangevin(Thermostat):
         dself.S = depend_value(name="S", func=self.get_S,
                                dependencies=[dself.temp, dself.T])
 
+    @dhot
     def step(self):
         """Updates the bound momentum vector with a langevin thermostat."""
 
@@ -8,14 +8,15 @@
 from copy import copy
 import numpy as np
 
-from ipi.engine.forcefields import ForceField, FFSocket, FFLennardJones, FFDebye, FFPlumed, FFYaff
+from ipi.engine.forcefields import ForceField, ForceCache, ForceDatabase, FFSocket, FFLennardJones, FFQTIP4PF, FFDebye, FFProcessPool, FFPlumed, FFYaff
 from ipi.interfaces.sockets import InterfaceSocket
+from ipi.interfaces.drivers import DriverPool
 import ipi.engine.initializer
 from ipi.inputs.initializer import *
 from ipi.utils.inputvalue import *
 
 
-__all__ = ["InputFFSocket", 'InputFFLennardJones', 'InputFFDebye', 'InputFFPlumed', 'InputFFYaff']
+__all__ = ["InputFFSocket", 'InputFFLennardJones', 'InputFFQTIP4PF', 'InputFFDebye', 'InputFFProcessPool', 'InputFFPlumed', 'InputFFYaff']
 
 
 class InputForceField(Input):
@@ -31,31 +32,52 @@ class InputForceField(Input):
        pbc: A boolean describing whether periodic boundary conditions will
           be applied to the atom positions before they are sent to the driver
           code.
+       threaded: A boolean describing whether the forces are computed by a
+          separate polling thread. Socket forcefields are always threaded.
 
     Fields:
-       latency: The number of seconds to sleep between looping over the requests.
+       latency: The maximum number of seconds to sleep between looping over the requests.
        parameters: A dictionary containing the forcefield parameters.
        activelist: A list of indexes (starting at 0) of the atoms that will be active in this force field.
+       cache_size: The number of results of recent requests that are kept, so
+          that configurations that have already been computed are not dispatched
+          again. If 0, results are not cached.
+       cache_tolerance: The largest difference in the coordinates for which two
+          configurations are considered identical by the cache and the database.
+       database: The prefix of the files of a database where the results are
+          stored, to be reused by later runs. If empty, results are not stored.
     """
 
     attribs = {"name": (InputAttribute, {"dtype": str,
                                          "help": "Mandatory. The name by which the forcefield will be identified in the System forces section."}),
                "pbc": (InputAttribute, {"dtype": bool,
                                         "default": True,
-                                        "help": "Applies periodic boundary conditions to the atoms coordinates before passing them on to the driver code."})
-
+                                        "help": "Applies periodic boundary conditions to the atoms coordinates before passing them on to the driver code."}),
+               "threaded": (InputAttribute, {"dtype": bool,
+                                             "default": False,
+                                             "help": "Computes the forces in a separate polling thread. Otherwise, in-process forcefields compute them in the thread that needs them, as soon as they are needed. Socket forcefields are always threaded."})
                }
     fields = {
         "latency": (InputValue, {"dtype": float,
                                  "default": 0.01,
-                                 "help": "The number of seconds the polling thread will wait between exhamining the list of requests."}),
+                                 "help": "The maximum number of seconds the polling thread will sleep when there is nothing to do. The thread is woken up as soon as a new request is queued or a client replies, so this only sets how often i-PI checks for unresponsive clients."}),
              "parameters": (InputValue, {"dtype": dict,
                                          "default": {},
                                          "help": "The parameters of the force field"}),
              "activelist": (InputArray, {"dtype": int,
                                          "default": np.array([-1]),
                                          #                                     "default" : input_default(factory=np.array, args =[-1]),
-                                         "help": "List with indexes of the atoms that this socket is taking care of.    Default: all (corresponding to -1)"})
+                                         "help": "List with indexes of the atoms that this socket is taking care of.    Default: all (corresponding to -1)"}),
+             "cache_size": (InputValue, {"dtype": int,
+                                         "default": 0,
+                                         "help": "The number of results of recent force evaluations that are kept in memory. A configuration that has already been computed is then not computed again. If 0, results are not kept."}),
+             "cache_tolerance": (InputValue, {"dtype": float,
+                                              "default": 0.0,
+                                              "dimension": "length",
+                                              "help": "The largest difference in the atomic coordinates and cell for which two configurations are considered the same by the cache and the database."}),
+             "database": (InputValue, {"dtype": str,
+                                       "default": "",
+                                       "help": "The prefix of the files of a database where the results of all the force evaluations are stored. Configurations that are found in the database, e.g. because they were computed in a previous run, are not computed again. If empty, results are not stored."})
     }
 
     default_help = "Base forcefield class that deals with the assigning of force calculation jobs and collecting the data."
@@ -73,7 +95,14 @@ class InputForceField(Input):
         self.latency.store(ff.latency)
         self.parameters.store(ff.pars)
         self.pbc.store(ff.dopbc)
+        self.threaded.store(ff.threaded)
         self.activelist.store(ff.active)
+        if ff.cache is not None:
+            self.cache_size.store(ff.cache.size)
+            self.cache_tolerance.store(ff.cache.tolerance)
+        if ff.database is not None:
+            self.database.store(ff.database.path)
+            self.cache_tolerance.store(ff.database.tolerance)
 
     def fetch(self):
         """Creates a ForceField object.
@@ -84,7 +113,28 @@ class InputForceField(Input):
 
         super(InputForceField, self).fetch()
 
-        return ForceField(pars=self.parameters.fetch(), name=self.name.fetch(), latency=self.latency.fetch(), dopbc=self.pbc.fetch(), active=self.activelist.fetch())
+        return ForceField(pars=self.parameters.fetch(), name=self.name.fetch(), latency=self.latency.fetch(), dopbc=self.pbc.fetch(), active=self.activelist.fetch(),
+                          threaded=self.threaded.fetch())
+
+
+    def fetch_cache(self, ff):
+        """Sets up the cache and the database of the results of a forcefield,
+        if they are requested.
+
+        Args:
+           ff: A ForceField object.
+
+        Returns:
+           The same ForceField object.
+        """
+
+        if self.cache_size.fetch() < 0 or self.cache_tolerance.fetch() < 0.0:
+            raise ValueError("Negative cache size or tolerance specified.")
+        if self.cache_size.fetch() > 0:
+            ff.cache = ForceCache(self.cache_size.fetch(), self.cache_tolerance.fetch())
+        if self.database.fetch() != "":
+            ff.database = ForceDatabase(self.database.fetch(), self.cache_tolerance.fetch())
+        return ff
 
 
 class InputFFSocket(InputForceField):
@@ -94,7 +144,8 @@ class InputFFSocket(InputForceField):
     Handles generating one instance of a socket interface forcefield class.
 
     Attributes:
-       mode: Describes whether the socket will be a unix or an internet socket.
+       mode: Describes whether the socket will be a unix or an internet socket,
+          or a unix socket with a shared-memory data transport.
 
     Fields:
        address: The server socket binding address.
@@ -103,6 +154,14 @@ class InputFFSocket(InputForceField):
           time.
        timeout: The number of seconds that the socket will wait before assuming
           that the client code has died. If 0 there is no timeout.
+       hedge: The percentile of recent latencies above which a straggling
+          calculation is also sent to an idle client. If 0 there is no hedging.
+       command: The command template used to start local drivers. If empty,
+          the drivers must be started by hand.
+       pool_min: The number of local drivers that are always kept running.
+       pool_max: The maximum number of local drivers.
+       hints: The number of previous configurations of each replica used to
+          compute the extrapolation hints sent to the clients that accept them.
     """
 
     fields = {"address": (InputValue, {"dtype": str,
@@ -116,16 +175,31 @@ class InputFFSocket(InputForceField):
                                      "help": "This gives the number of client codes that can queue at any one time."}),
               "timeout": (InputValue, {"dtype": float,
                                        "default": 0.0,
-                                       "help": "This gives the number of seconds before assuming a calculation has died. If 0 there is no timeout."})}
+                                       "help": "This gives the number of seconds before assuming a calculation has died. If 0 there is no timeout."}),
+              "hedge": (InputValue, {"dtype": float,
+                                     "default": 0.0,
+                                     "help": "If larger than zero, when no calculations are waiting for a client, the ones that have been running for longer than this percentile of the recent calculation times are also sent to an idle client, and the first result to come back is used. If 0 there is no hedging."}),
+              "command": (InputValue, {"dtype": str,
+                                       "default": "",
+                                       "help": "The command used to start local drivers, that i-PI will launch, restart if they die and scale between pool_min and pool_max depending on how many calculations are waiting. {address}, {port} and {mode} are replaced by those of the socket, {index} by a progressive number. If empty, the drivers must be started by hand."}),
+              "pool_min": (InputValue, {"dtype": int,
+                                        "default": 1,
+                                        "help": "The number of local drivers that are always kept running."}),
+              "pool_max": (InputValue, {"dtype": int,
+                                        "default": 1,
+                                        "help": "The maximum number of local drivers that are run when many calculations are waiting."}),
+              "hints": (InputValue, {"dtype": int,
+                                     "default": 0,
+                                     "help": "The number of previous configurations of each replica that are kept to help the clients start their calculation. Clients that support it get, before the positions, the coefficients that express the new configuration as a combination of the previous ones, which they can use to combine e.g. the electron densities they computed for those configurations into a starting guess. If 0 no history is kept."})}
     attribs = {
         "mode": (InputAttribute, {"dtype": str,
-                                  "options": ["unix", "inet"],
+                                  "options": ["unix", "inet", "shm"],
                                   "default": "inet",
-                                  "help": "Specifies whether the driver interface will listen onto a internet socket [inet] or onto a unix socket [unix]."}),
+                                  "help": "Specifies whether the driver interface will listen onto a internet socket [inet], onto a unix socket [unix], or onto a unix socket that only carries control messages, with positions and forces exchanged through shared memory [shm]."}),
                 "matching": (InputAttribute, {"dtype": str,
-                                              "options": ["auto", "any"],
+                                              "options": ["auto", "any", "throughput"],
                                               "default": "auto",
-                                              "help": "Specifies whether requests should be dispatched to any client, or automatically matched to the same client when possible [auto]."})
+                                              "help": "Specifies whether requests should be dispatched to any client, automatically matched to the same client when possible [auto], or assigned taking into account how fast each client is, so that slow clients do not hold back the whole step [throughput]."})
     }
 
     attribs.update(InputForceField.attribs)
@@ -150,8 +224,14 @@ class InputFFSocket(InputForceField):
         self.port.store(ff.socket.port)
         self.timeout.store(ff.socket.timeout)
         self.slots.store(ff.socket.slots)
+        self.hedge.store(ff.socket.hedge)
         self.mode.store(ff.socket.mode)
         self.matching.store(ff.socket.match_mode)
+        self.hints.store(ff.nhints)
+        if ff.socket.drivers is not None:
+            self.command.store(ff.socket.drivers.command)
+            self.pool_min.store(ff.socket.drivers.nmin)
+            self.pool_max.store(ff.socket.drivers.nmax)
 
     def fetch(self):
         """Creates a ForceSocket object.
@@ -160,9 +240,16 @@ class InputFFSocket(InputForceField):
            A ForceSocket object with the correct socket parameters.
         """
 
-        return FFSocket(pars=self.parameters.fetch(), name=self.name.fetch(), latency=self.latency.fetch(), dopbc=self.pbc.fetch(),
-                        active=self.activelist.fetch(), interface=InterfaceSocket(address=self.address.fetch(), port=self.port.fetch(),
-                                                                                  slots=self.slots.fetch(), mode=self.mode.fetch(), timeout=self.timeout.fetch()))
+        drivers = None
+        if self.command.fetch().strip() != "":
+            drivers = DriverPool(self.command.fetch().strip(), self.pool_min.fetch(), self.pool_max.fetch())
+
+        return self.fetch_cache(FFSocket(pars=self.parameters.fetch(), name=self.name.fetch(), latency=self.latency.fetch(), dopbc=self.pbc.fetch(),
+                                         active=self.activelist.fetch(), interface=InterfaceSocket(address=self.address.fetch(), port=self.port.fetch(),
+                                                                                                   slots=self.slots.fetch(), mode=self.mode.fetch(), timeout=self.timeout.fetch(),
+                                                                                                   match_mode=self.matching.fetch(), hedge=self.hedge.fetch(),
+                                                                                                   drivers=drivers),
+                                         hints=self.hints.fetch()))
 
     def check(self):
         """Deals with optional parameters."""
@@ -179,6 +266,12 @@ class InputFFSocket(InputForceField):
             raise ValueError("Negative latency parameter specified.")
         if self.timeout.fetch() < 0.0:
             raise ValueError("Negative timeout parameter specified.")
+        if self.hedge.fetch() < 0.0 or self.hedge.fetch() > 100.0:
+            raise ValueError("Hedging percentile " + str(self.hedge.fetch()) + " out of acceptable range.")
+        if self.hints.fetch() < 0:
+            raise ValueError("Negative number of hints specified.")
+        if self.command.fetch().strip() != "" and (self.pool_min.fetch() < 0 or self.pool_max.fetch() < max(self.pool_min.fetch(), 1)):
+            raise ValueError("Inconsistent driver pool sizes: min " + str(self.pool_min.fetch()) + ", max " + str(self.pool_max.fetch()))
 
 
 class InputFFLennardJones(InputForceField):
@@ -186,8 +279,11 @@ class InputFFLennardJones(InputForceField):
     attribs = {}
     attribs.update(InputForceField.attribs)
 
-    default_help = """Simple, internal LJ evaluator without cutoff, neighbour lists or minimal image convention.
-                   Expects standard LJ parameters, e.g. { eps: 0.1, sigma: 1.0 }. """
+    default_help = """Simple, internal LJ evaluator using neighbour lists, with an optional sharp cutoff.
+                   Expects standard LJ parameters, e.g. { eps: 0.1, sigma: 1.0 }, and optionally a cutoff and
+                   the skin of the neighbour lists, e.g. { eps: 0.1, sigma: 1.0, cutoff: 8.0, skin: 1.0 }.
+                   The skin defaults to one tenth of the cutoff. Periodic boundary conditions, in a general
+                   triclinic cell, require a cutoff. Without a cutoff, all the atoms interact with each other. """
     default_label = "FFLJ"
 
     def store(self, ff):
@@ -196,8 +292,8 @@ class InputFFLennardJones(InputForceField):
     def fetch(self):
         super(InputFFLennardJones, self).fetch()
 
-        return FFLennardJones(pars=self.parameters.fetch(), name=self.name.fetch(),
-                              latency=self.latency.fetch(), dopbc=self.pbc.fetch())
+        return self.fetch_cache(FFLennardJones(pars=self.parameters.fetch(), name=self.name.fetch(),
+                                               latency=self.latency.fetch(), dopbc=self.pbc.fetch(), threaded=self.threaded.fetch()))
 
         if self.slots.fetch() < 1 or self.slots.fetch() > 5:
             raise ValueError("Slot number " + str(self.slots.fetch()) + " out of acceptable range.")
@@ -207,12 +303,78 @@ class InputFFLennardJones(InputForceField):
             raise ValueError("Negative timeout parameter specified.")
 
 
+class InputFFQTIP4PF(InputForceField):
+
+    attribs = {}
+    attribs.update(InputForceField.attribs)
+
+    default_help = """Internal, vectorised implementation of the q-TIP4P/F water model, with the same parameters
+                   as the qtip4pf potential of the Fortran driver. Expects the atoms to be ordered as O H H O H H ...
+                   The electrostatics are computed with an Ewald sum in a general triclinic cell, and all the beads
+                   are evaluated together. The only parameter is the skin of the neighbour lists, in atomic
+                   units, e.g. { skin: 1.0 }. """
+    default_label = "FFQTIP4PF"
+
+    def store(self, ff):
+        super(InputFFQTIP4PF, self).store(ff)
+
+    def fetch(self):
+        super(InputFFQTIP4PF, self).fetch()
+
+        return self.fetch_cache(FFQTIP4PF(pars=self.parameters.fetch(), name=self.name.fetch(),
+                                          latency=self.latency.fetch(), dopbc=self.pbc.fetch(), threaded=self.threaded.fetch()))
+
+
+def read_hessian(filename):
+    """Reads a Hessian from a numpy .npz file.
+
+    Args:
+       filename: The name of the file.
+
+    Returns:
+       A dictionary with the arguments of FFDebye that specify the Hessian.
+    """
+
+    data = np.load(filename)
+    if "hessian" in data:
+        return {"H": data["hessian"]}
+    elif "diagonal" in data:
+        return {"Hdiag": data["diagonal"], "Hvecs": data["vectors"] if "vectors" in data else None,
+                "Hvals": data["values"] if "values" in data else None}
+    elif "format" in data:
+        # written by scipy.sparse.save_npz, which labels the layout of the arrays
+        fmt = data["format"].item()
+        if not isinstance(fmt, str):
+            fmt = fmt.decode()
+        if fmt not in ["csr", "csc", "coo"]:
+            raise ValueError("The sparse Hessian in " + filename + " is in the " + fmt + " format. Only the csr, csc and coo formats are supported.")
+        try:
+            import scipy.sparse
+        except ImportError:
+            raise ImportError("Reading a sparse Hessian requires scipy.")
+        shape = tuple(data["shape"])
+        if fmt == "csr":
+            H = scipy.sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=shape)
+        elif fmt == "csc":
+            H = scipy.sparse.csc_matrix((data["data"], data["indices"], data["indptr"]), shape=shape)
+        else:
+            H = scipy.sparse.coo_matrix((data["data"], (data["row"], data["col"])), shape=shape)
+        return {"H": H.tocsr()}
+    else:
+        raise ValueError("The file " + filename + " does not contain a Hessian.")
+
+
 class InputFFDebye(InputForceField):
 
     fields = {
         "hessian": (InputArray, {"dtype": float, "default": input_default(factory=np.zeros, args=(0,)), "help": "Specifies the Hessian of the harmonic potential (atomic units!)"}),
         "x_reference": (InputArray, {"dtype": float, "default": input_default(factory=np.zeros, args=(0,)), "help": "Minimum-energy configuration for the harmonic potential", "dimension": "length"}),
-        "v_reference": (InputValue, {"dtype": float, "default": 0.0, "help": "Zero-value of energy for the harmonic potential", "dimension": "energy"})
+        "v_reference": (InputValue, {"dtype": float, "default": 0.0, "help": "Zero-value of energy for the harmonic potential", "dimension": "energy"}),
+        "hessian_file": (InputValue, {"dtype": str, "default": "", "help": """A numpy .npz file to read the Hessian from (atomic units!), instead of giving it in the input.
+                                  It can contain a dense 'hessian' array, a CSR, CSC or COO sparse matrix as written by scipy.sparse.save_npz (reading it requires scipy),
+                                  or a 'diagonal' array and an array of 'vectors' (3*natoms, k), with optional 'values' (k), for a Hessian of the form
+                                  diag(diagonal) + vectors diag(values) vectors^T."""}),
+        "diagonalise": (InputValue, {"dtype": bool, "default": False, "help": "Computes and prints the eigenvalues of the Hessian. Requires a dense copy of the Hessian."})
     }
 
     fields.update(InputForceField.fields)
@@ -225,15 +387,60 @@ class InputFFDebye(InputForceField):
 
     def store(self, ff):
         super(InputFFDebye, self).store(ff)
-        self.hessian.store(ff.H)
+        if ff.hessian_file != "":
+            self.hessian_file.store(ff.hessian_file)
+        else:
+            self.hessian.store(ff.dense_hessian())
         self.x_reference.store(ff.xref)
         self.v_reference.store(ff.vref)
 
     def fetch(self):
         super(InputFFDebye, self).fetch()
 
-        return FFDebye(H=self.hessian.fetch(), xref=self.x_reference.fetch(), vref=self.v_reference.fetch(), name=self.name.fetch(),
-                       latency=self.latency.fetch(), dopbc=self.pbc.fetch())
+        hessian = {"H": self.hessian.fetch()}
+        if self.hessian_file.fetch() != "":
+            hessian = read_hessian(self.hessian_file.fetch())
+
+        return self.fetch_cache(FFDebye(xref=self.x_reference.fetch(), vref=self.v_reference.fetch(), name=self.name.fetch(),
+                                        latency=self.latency.fetch(), dopbc=self.pbc.fetch(), threaded=self.threaded.fetch(),
+                                        diagonalise=self.diagonalise.fetch(), hessian_file=self.hessian_file.fetch(), **hessian))
+
+
+class InputFFProcessPool(InputForceField):
+
+    fields = {
+        "module": (InputValue, {"dtype": str, "default": "",
+                                "help": "The name of the Python module, or the path of the Python file, that contains the potential."}),
+        "function": (InputValue, {"dtype": str, "default": "potential",
+                                  "help": "The name of the function computing the potential. It is called as function(pos, cell, **parameters), with the (natoms, 3) array of positions and the cell matrix, and returns the potential, the forces and optionally the virial and a string of extra output, all in atomic units."}),
+        "nprocs": (InputValue, {"dtype": int, "default": 1,
+                                "help": "The number of worker processes evaluating the potential in parallel."})
+    }
+
+    fields.update(InputForceField.fields)
+
+    attribs = {}
+    attribs.update(InputForceField.attribs)
+
+    default_help = """Evaluates a Python potential in a pool of worker processes, computing the beads in parallel. The
+                   parameters are passed to the function as keyword arguments. """
+    default_label = "FFPROCESSPOOL"
+
+    def store(self, ff):
+        super(InputFFProcessPool, self).store(ff)
+        self.module.store(ff.pool.module)
+        self.function.store(ff.pool.function)
+        self.nprocs.store(ff.pool.nprocs)
+
+    def fetch(self):
+        super(InputFFProcessPool, self).fetch()
+
+        if self.nprocs.fetch() < 1:
+            raise ValueError("The number of worker processes must be positive.")
+
+        return self.fetch_cache(FFProcessPool(module=self.module.fetch(), function=self.function.fetch(), nprocs=self.nprocs.fetch(),
+                                              pars=self.parameters.fetch(), name=self.name.fetch(), latency=self.latency.fetch(),
+                                              dopbc=self.pbc.fetch(), active=self.activelist.fetch(), threaded=self.threaded.fetch()))
 
 
 class InputFFPlumed(InputForceField):
@@ -268,9 +475,14 @@ class InputFFPlumed(InputForceField):
     def fetch(self):
         super(InputFFPlumed, self).fetch()
 
-        return FFPlumed(name=self.name.fetch(), latency=self.latency.fetch(), dopbc=self.pbc.fetch(),
-                        precision=self.precision.fetch(), plumeddat=self.plumeddat.fetch(),
-                        plumedstep=self.plumedstep.fetch(), init_file=self.init_file.fetch())
+        # PLUMED keeps a history of the collective variables (e.g. the hills of metadynamics),
+        # so the bias on a configuration that was seen before cannot be reused
+        if self.cache_size.fetch() != 0 or self.database.fetch() != "":
+            raise ValueError("The results of a PLUMED forcefield depend on its history, and cannot be cached or stored in a database.")
+
+        return self.fetch_cache(FFPlumed(name=self.name.fetch(), latency=self.latency.fetch(), dopbc=self.pbc.fetch(), threaded=self.threaded.fetch(),
+                                         precision=self.precision.fetch(), plumeddat=self.plumeddat.fetch(),
+                                         plumedstep=self.plumedstep.fetch(), init_file=self.init_file.fetch()))
 
 
 class InputFFYaff(InputForceField):
@@ -327,4 +539,4 @@ class InputFFYaff(InputForceField):
     def fetch(self):
         super(InputFFYaff, self).fetch()
 
-        return FFYaff(yaffpara=self.yaffpara.fetch(), yaffsys=self.yaffsys.fetch(), yafflog=self.yafflog.fetch(), rcut=self.rcut.fetch(), alpha_scale=self.alpha_scale.fetch(), gcut_scale=self.gcut_scale.fetch(), skin=self.skin.fetch(), smooth_ei=self.smooth_ei.fetch(), reci_ei=self.reci_ei.fetch(), name=self.name.fetch(), latency=self.latency.fetch(), dopbc=self.pbc.fetch())
+        return self.fetch_cache(FFYaff(yaffpara=self.yaffpara.fetch(), yaffsys=self.yaffsys.fetch(), yafflog=self.yafflog.fetch(), rcut=self.rcut.fetch(), alpha_scale=self.alpha_scale.fetch(), gcut_scale=self.gcut_scale.fetch(), skin=self.skin.fetch(), smooth_ei=self.smooth_ei.fetch(), reci_ei=self.reci_ei.fetch(), name=self.name.fetch(), latency=self.latency.fetch(), dopbc=self.pbc.fetch(), threaded=self.threaded.fetch()))
@@ -16,7 +16,7 @@ import ipi.engine.outputs as eoutputs
 
 
 __all__ = ['InputOutputs', 'InputProperties', 'InputTrajectory',
-           'InputCheckpoint']
+           'InputCheckpoint', 'InputStats']
 
 
 class InputProperties(InputArray):
@@ -221,6 +221,48 @@ class InputCheckpoint(InputValue):
             raise ValueError("The stride length for the checkpoint file output must be positive.")
 
 
+class InputStats(Input):
+
+    """Simple input class to describe output for forcefield statistics.
+
+    Storage class for StatsOutput.
+
+    Attributes:
+       filename: The name of the file to output to.
+       stride: The number of steps that should be taken between outputting the
+          data to file.
+    """
+
+    default_help = """This class defines how a file with statistics about the forcefields should be output. The file is in JSON format, and contains the time the requests of each forcefield spend waiting, being sent and received and being computed, the bytes they move, and the utilisation of the clients and the number of reconnections of socket forcefields. It is overwritten at each output."""
+    default_label = "STATS"
+
+    attribs = {}
+    attribs["filename"] = (InputAttribute, {"dtype": str, "default": "stats.json",
+                                            "help": "A string to specify the name of the file that is output. The file name is given by 'prefix'.'filename'."})
+    attribs["stride"] = (InputAttribute, {"dtype": int, "default": 100,
+                                          "help": "The number of steps between successive writes."})
+
+    def fetch(self):
+        """Returns a StatsOutput object."""
+
+        super(InputStats, self).fetch()
+        return eoutputs.StatsOutput(self.filename.fetch(), self.stride.fetch())
+
+    def store(self, stats):
+        """Stores a StatsOutput object."""
+
+        super(InputStats, self).store()
+        self.stride.store(stats.stride)
+        self.filename.store(stats.filename)
+
+    def check(self):
+        """Checks for optional parameters."""
+
+        super(InputStats, self).check()
+        if self.stride.fetch() < 1:
+            raise ValueError("The stride length for the statistics file output must be positive.")
+
+
 class InputOutputs(Input):
 
     """ List of outputs input class.
@@ -238,6 +280,7 @@ class InputOutputs(Input):
        trajectory: Specifies a trajectory to be output
        properties: Specifies some properties to be output.
        checkpoint: Specifies a checkpoint file to be output.
+       stats: Specifies a file with statistics about the forcefields to be output.
     """
 
     attribs = {"prefix": (InputAttribute, {"dtype": str,
@@ -248,6 +291,7 @@ class InputOutputs(Input):
     dynamic = {"properties": (InputProperties, {"help": "Each of the properties tags specify how to create a file in which one or more properties are written, one line per frame. "}),
                "trajectory": (InputTrajectory, {"help": "Each of the trajectory tags specify how to create a trajectory file, containing a list of per-atom coordinate properties. "}),
                "checkpoint": (InputCheckpoint, {"help": "Each of the checkpoint tags specify how to create a checkpoint file, which can be used to restart a simulation. "}),
+               "stats": (InputStats, {"help": "Each of the stats tags specify how to create a JSON file with statistics about the forcefields, such as where the time of the force requests goes. "}),
                }
 
     default_help = """This class defines how properties, trajectories and checkpoints should be output during the simulation. May contain zero, one or many instances of properties, trajectory or checkpoint tags, each giving instructions on how one output file should be created and managed."""
@@ -313,3 +357,7 @@ class InputOutputs(Input):
                 ip = InputCheckpoint()
                 ip.store(el)
                 self.extra.append(("checkpoint", ip))
+            elif (isinstance(el, eoutputs.StatsOutput)):
+                ip = InputStats()
+                ip.store(el)
+                self.extra.append(("stats", ip))
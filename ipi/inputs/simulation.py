@@ -57,6 +57,10 @@ class InputSimulation(Input):
           communicate with the driver code.
        fflj: Gives a forcefield which uses the internal Python Lennard-Jones
           script to calculate the potential and forces.
+       ffqtip4pf: Gives a forcefield which computes the q-TIP4P/F water
+          model in Python.
+       ffprocesspool: Gives a forcefield which evaluates a Python potential
+          in a pool of worker processes.
     """
 
     fields = {
@@ -86,6 +90,14 @@ class InputSimulation(Input):
                                               "default": True,
                                               "help": "Whether multiple-systems execution should be parallel. Makes execution non-reproducible due to the random number generator being used from concurrent threads."
                                               }),
+               "frozen_graph": (InputAttribute, {"dtype": bool,
+                                                 "default": False,
+                                                 "help": "Whether the network of dependencies between the quantities of the simulation should be compiled once everything has been set up, so that invalidating the quantities that depend on a changed one is done at once rather than by following the dependencies one by one."
+                                                 }),
+               "depend_profile": (InputAttribute, {"dtype": str,
+                                                   "default": "",
+                                                   "help": "The name of a file where a profile of the automatically-computed quantities is written, giving how many times each of them was invalidated and recomputed, the time spent recomputing it and where it was requested from. The profile is written at exit, and whenever the SIGUSR1 signal is received. Profiling is disabled if no name is given, as it slows down the simulation."
+                                                   }),
                "mode": (InputAttribute, {"dtype": str,
                                          "default": "md",
                                          "help": "What kind of simulation should be run.",
@@ -97,7 +109,9 @@ class InputSimulation(Input):
               "system_template": (InputSysTemplate, {"help": InputSysTemplate.default_help}),
               "ffsocket": (iforcefields.InputFFSocket, {"help": iforcefields.InputFFSocket.default_help}),
               "fflj": (iforcefields.InputFFLennardJones, {"help": iforcefields.InputFFLennardJones.default_help}),
+              "ffqtip4pf": (iforcefields.InputFFQTIP4PF, {"help": iforcefields.InputFFQTIP4PF.default_help}),
               "ffdebye": (iforcefields.InputFFDebye, {"help": iforcefields.InputFFDebye.default_help}),
+              "ffprocesspool": (iforcefields.InputFFProcessPool, {"help": iforcefields.InputFFProcessPool.default_help}),
               "ffplumed": (iforcefields.InputFFPlumed, {"help": iforcefields.InputFFPlumed.default_help}),
               "ffyaff": (iforcefields.InputFFYaff, {"help": iforcefields.InputFFYaff.default_help})
     }
@@ -121,6 +135,8 @@ class InputSimulation(Input):
         self.total_time.store(simul.ttime)
         self.smotion.store(simul.smotion)
         self.threading.store(simul.threading)
+        self.frozen_graph.store(simul.frozen_graph)
+        self.depend_profile.store(simul.depend_profile)
 
         # this we pick from the messages class. kind of a "global" but it seems to
         # be the best way to pass around the (global) information on the level of output.
@@ -153,10 +169,18 @@ class InputSimulation(Input):
                     _iobj = iforcefields.InputFFLennardJones()
                     _iobj.store(_obj)
                     self.extra[_ii] = ("fflj", _iobj)
+                elif isinstance(_obj, eforcefields.FFQTIP4PF):
+                    _iobj = iforcefields.InputFFQTIP4PF()
+                    _iobj.store(_obj)
+                    self.extra[_ii] = ("ffqtip4pf", _iobj)
                 elif isinstance(_obj, eforcefields.FFDebye):
                     _iobj = iforcefields.InputFFDebye()
                     _iobj.store(_obj)
                     self.extra[_ii] = ("ffdebye", _iobj)
+                elif isinstance(_obj, eforcefields.FFProcessPool):
+                    _iobj = iforcefields.InputFFProcessPool()
+                    _iobj.store(_obj)
+                    self.extra[_ii] = ("ffprocesspool", _iobj)
                 elif isinstance(_obj, eforcefields.FFPlumed):
                     _iobj = iforcefields.InputFFPlumed()
                     _iobj.store(_obj)
@@ -198,7 +222,7 @@ class InputSimulation(Input):
                 syslist.append(v.fetch())
             elif k == "system_template":
                 syslist += v.fetch()  # this will actually generate automatically a bunch of system objects with the desired properties set automatically to many values
-            elif k == "ffsocket" or k == "fflj" or k == "ffdebye" or k == "ffplumed":
+            elif k == "ffsocket" or k == "fflj" or k == "ffqtip4pf" or k == "ffdebye" or k == "ffprocesspool" or k == "ffplumed":
                 print "fetching", k
                 fflist.append(v.fetch())
             elif k == "ffyaff":
@@ -216,6 +240,8 @@ class InputSimulation(Input):
             step=self.step.fetch(),
             tsteps=self.total_steps.fetch(),
             ttime=self.total_time.fetch(),
-            threads=self.threading.fetch())
+            threads=self.threading.fetch(),
+            frozen_graph=self.frozen_graph.fetch(),
+            depend_profile=self.depend_profile.fetch())
 
         return rsim
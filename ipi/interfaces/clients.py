@@ -12,14 +12,46 @@ programs and serve them back to i-PI.
 import sys
 import os
 import socket
+import select
+import threading
 import time
+import copy
+import Queue
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 
-from .sockets import DriverSocket, Message
+from .sockets import DriverSocket, Message, shm_layout, SHMHDR
 from ..utils import units
 
 
+def connect(address="localhost", port=31415, mode="unix"):
+    """Opens a client socket connected to an i-PI server.
+
+    Args:
+        address: A string giving the name of the host network.
+        port: An integer giving the port the socket will be using.
+        mode: A string giving the type of socket used - 'inet', 'unix' or 'shm'.
+
+    Returns:
+        The connected socket.
+    """
+
+    if mode == "inet":
+        _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _socket.connect((address, int(port)))
+    elif mode == "unix" or mode == "shm":
+        try:
+            _socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            _socket.connect("/tmp/ipi_" + address)
+        except socket.error:
+            print 'Could not connect to UNIX socket: %s' % ("/tmp/ipi_" + address)
+            sys.exit(1)
+    else:
+        raise NameError("Interface mode " + mode + " is not implemented (should be unix/inet/shm)")
+    return _socket
+
+
 class Client(DriverSocket):
 
     """Base class for the implementation of a client in Python.
@@ -28,33 +60,37 @@ class Client(DriverSocket):
 
     Attributes:
         havedata: Boolean giving whether the client calculated the forces.
+        batch: The maximum number of configurations the client accepts in a
+            single message. If larger than one, it is advertised to the server.
+        hints: The number of previous configurations of a replica the client
+            can combine to build a starting guess. If larger than zero, it is
+            advertised to the server.
+        _hints: A tuple (rid, step, coefficients) with the last hints sent by
+            the server, or None. The coefficients refer to the configurations
+            of replica rid with indices step-1, step-2, ..., and give the
+            combination of their results that best guesses the result of
+            configuration step.
+        _shm: The shared-memory segment set up by the server, if any.
+        _nbatch: The number of configurations received with the last batch,
+            or None if the last configuration came on its own.
     """
 
-    def __init__(self, address="localhost", port=31415, mode="unix", _socket=True):
+    def __init__(self, address="localhost", port=31415, mode="unix", _socket=True, batch=1, hints=0):
         """Initialise Client.
 
         Args:
             - address: A string giving the name of the host network.
             - port: An integer giving the port the socket will be using.
-            - mode: A string giving the type of socket used - 'inet' or 'unix'.
+            - mode: A string giving the type of socket used - 'inet', 'unix' or 'shm'.
+              'shm' connects to a unix socket and exchanges the data through shared memory.
             - _socket: If a socket should be opened. Can be False for testing purposes.
+            - batch: The number of configurations the client accepts in one message.
+            - hints: The number of previous configurations the client can use
+              to extrapolate a starting guess.
         """
 
         if _socket:
-            # open client socket
-            if mode == "inet":
-                _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                _socket.connect((address, int(port)))
-            elif mode == "unix":
-                try:
-                    _socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                    _socket.connect("/tmp/ipi_" + address)
-                except socket.error:
-                    print 'Could not connect to UNIX socket: %s' % ("/tmp/ipi_" + address)
-                    sys.exit(1)
-            else:
-                raise NameError("Interface mode " + mode + " is not implemented (should be unix/inet)")
-            super(Client, self).__init__(socket=_socket)
+            super(Client, self).__init__(socket=connect(address, port, mode))
         else:
             super(Client, self).__init__(socket=None)
 
@@ -65,6 +101,13 @@ class Client(DriverSocket):
         self._cellih = np.zeros((3, 3), np.float64)
         self._nat = np.int32()
         self._callback = None
+        self._batch_callback = None
+        self._shm = None
+        self.batch = batch
+        self._nbatch = None
+        self.hints = hints
+        self._hints = None
+        self._sentcaps = False
 
     def _getforce(self):
         """Dummy _getforce routine.
@@ -79,6 +122,33 @@ class Client(DriverSocket):
         else:
             raise NotImplementedError("_getforce must be implemented by providing a self.callback function or overwritten.")
 
+    def _getforce_batch(self):
+        """Dummy _getforce_batch routine.
+
+        Evaluates all the configurations of a batch. Can be implemented by
+        subclassing or providing a self._batch_callback function, which gets
+        the positions stacked in an array of shape (nbatch,) + positions.shape
+        and returns the stacked forces and potentials. Otherwise falls back to
+        calling _getforce once per configuration.
+        This function is assumed to calculate the following:
+            - self._force_batch: The forces of the configurations at self._positions_batch.
+            - self._potential_batch: The potentials of the configurations at self._positions_batch.
+            - self._vir_batch: The virials of the configurations at self._positions_batch.
+        """
+        if self._batch_callback is not None:
+            self._force_batch, self._potential_batch = self._batch_callback(np.asarray(self._positions_batch))
+            self._vir_batch = [self._vir] * len(self._positions_batch)
+        else:
+            self._force_batch, self._potential_batch, self._vir_batch = [], [], []
+            for i in range(len(self._positions_batch)):
+                self._cellh = self._cellh_batch[i]
+                self._cellih = self._cellih_batch[i]
+                self._positions = self._positions_batch[i]
+                self._getforce()
+                self._force_batch.append(np.array(self._force))
+                self._potential_batch.append(np.array(self._potential))
+                self._vir_batch.append(np.array(self._vir))
+
     def run(self, verbose=True, t_max=None, fn_exit='EXIT'):
         """Serve forces until asked to finish or socket disconnects.
 
@@ -124,17 +194,55 @@ class Client(DriverSocket):
                     print "Server shut down."
                     break
                 elif msg == Message("status"):
+                    if (self.batch > 1 or self.hints > 0) and not self._sentcaps:
+                        # advertises the protocol extensions once, before the first status reply
+                        caps = ",".join([c for c in ["batch=%d" % self.batch if self.batch > 1 else "",
+                                                     "hints=%d" % self.hints if self.hints > 0 else ""] if c != ""])
+                        self.send_msg("caps")
+                        self.sendall(np.int32(len(caps)), 4)
+                        self.sendall(caps)
+                        self._sentcaps = True
                     if self.havedata:
                         self.send_msg("havedata")
                     else:
                         self.send_msg("ready")
-                elif msg == Message("posdata"):
-                    self._cellh = self.recvall(self._cellh)
-                    self._cellih = self.recvall(self._cellih)
+                elif msg == Message("shmopen"):
                     self._nat = self.recvall(self._nat)
-                    self._positions = self.recvall(self._positions)
+                    plen = self.recvall(np.int32())
+                    path = "".join(self.recvall(np.zeros(plen, np.character)))
+                    self._shm = np.memmap(path, dtype=np.float64, mode="r+", shape=(SHMHDR + 6 * self._nat,))
+                elif msg == Message("hints"):
+                    # comes right before the positions it refers to
+                    rid = self.recvall(np.int32())
+                    step = self.recvall(np.int32())
+                    nhints = self.recvall(np.int32())
+                    self._hints = (int(rid), int(step), self.recvall(np.zeros(nhints, np.float64)))
+                elif msg == Message("posdata") or msg == Message("shmposdata") or msg == Message("posbatch"):
+                    self._nbatch = None
+                    if msg == Message("posbatch"):
+                        self._nbatch = self.recvall(np.int32())
+                        self._cellh_batch, self._cellih_batch, self._positions_batch = [], [], []
+                        for i in range(self._nbatch):
+                            self._cellh_batch.append(self.recvall(np.zeros_like(self._cellh)))
+                            self._cellih_batch.append(self.recvall(np.zeros_like(self._cellih)))
+                            self._nat = self.recvall(self._nat)
+                            self._positions_batch.append(self.recvall(np.zeros_like(self._positions)))
+                    elif msg == Message("shmposdata"):
+                        # positions are read in place from the segment
+                        h, ih, pot, vir, pos, f = shm_layout(self._shm, self._nat)
+                        self._cellh = h.copy()
+                        self._cellih = ih.copy()
+                        self._positions = pos.reshape(self._positions.shape)
+                    else:
+                        self._cellh = self.recvall(self._cellh)
+                        self._cellih = self.recvall(self._cellih)
+                        self._nat = self.recvall(self._nat)
+                        self._positions = self.recvall(self._positions)
                     t0_step = time.time()
-                    self._getforce()
+                    if self._nbatch is not None:
+                        self._getforce_batch()
+                    else:
+                        self._getforce()
                     if verbose:
                         t_now = time.time()
                         t_step = t_now - t0_step
@@ -146,12 +254,31 @@ class Client(DriverSocket):
                     self.havedata = True
                     i_step += 1
                 elif msg == Message("getforce"):
-                    self.sendall(Message("forceready"))
-                    self.sendall(self._potential, 8)
-                    self.sendall(self._nat, 4)
-                    self.sendall(self._force, 8 * self._force.size)
-                    self.sendall(self._vir, 9 * 8)
-                    self.sendall(np.int32(0), 4)
+                    if self._nbatch is not None:
+                        # results for the whole batch, in the order the configurations were received
+                        self.sendall(Message("forceready"))
+                        for i in range(self._nbatch):
+                            force = np.asarray(self._force_batch[i], np.float64)
+                            self.sendall(np.asarray(self._potential_batch[i], np.float64).reshape(-1)[:1], 8)
+                            self.sendall(self._nat, 4)
+                            self.sendall(force, 8 * force.size)
+                            self.sendall(np.asarray(self._vir_batch[i], np.float64), 9 * 8)
+                            self.sendall(np.int32(0), 4)
+                    elif self._shm is not None:
+                        # results go in the segment, the socket only carries the (empty) extra string
+                        h, ih, pot, vir, pos, f = shm_layout(self._shm, self._nat)
+                        pot[:] = self._potential
+                        f[:] = np.asarray(self._force).flat
+                        vir[:] = self._vir
+                        self.sendall(Message("forceready"))
+                        self.sendall(np.int32(0), 4)
+                    else:
+                        self.sendall(Message("forceready"))
+                        self.sendall(self._potential, 8)
+                        self.sendall(self._nat, 4)
+                        self.sendall(self._force, 8 * self._force.size)
+                        self.sendall(self._vir, 9 * 8)
+                        self.sendall(np.int32(0), 4)
                     self.havedata = False
                 else:
                     print >> sys.stderr, "Client could not understand command:", msg
@@ -175,62 +302,402 @@ class Client(DriverSocket):
         print
 
 
-class ClientASE(Client):
+class Connection(DriverSocket):
+
+    """A connection of a MultiClient to an i-PI server.
+
+    Reads the messages of the server and keeps track of the configurations
+    that are being evaluated on its behalf.
+
+    Attributes:
+        batch: The maximum number of configurations the connection accepts in
+            a single message. If larger than one, it is advertised to the server.
+        busy: The number of configurations of the last message that are still
+            being evaluated.
+        waiting: Boolean giving whether the server is waiting for a status
+            reply that is deferred until the evaluation is finished.
+        results: A list with a (force, potential, virial, extra) tuple for each
+            configuration of the last message.
+        nbatch: The number of configurations received with the last batch,
+            or None if the last configuration came on its own.
+        t_start: The time at which the last message was received.
+        _shm: The shared-memory segment set up by the server, if any.
+    """
+
+    def __init__(self, socket, batch=1):
+        """Initialises Connection.
+
+        Args:
+            socket: A socket connected to the server.
+            batch: The number of configurations accepted in one message.
+        """
+
+        super(Connection, self).__init__(socket=socket)
+        self.batch = batch
+        self.busy = 0
+        self.waiting = False
+        self.results = []
+        self.nbatch = None
+        self.t_start = 0.0
+        self._nat = np.int32()
+        self._shm = None
+        self._sentcaps = False
+
+    def reply_status(self):
+        """Answers a status request of the server.
+
+        The reply is deferred while the configurations of the last message
+        are being evaluated, as a blocking driver would do.
+        """
+
+        if self.batch > 1 and not self._sentcaps:
+            caps = "batch=%d" % self.batch
+            self.send_msg("caps")
+            self.sendall(np.int32(len(caps)), 4)
+            self.sendall(caps)
+            self._sentcaps = True
+        if self.busy > 0:
+            self.waiting = True
+        elif len(self.results) > 0:
+            self.waiting = False
+            self.send_msg("havedata")
+        else:
+            self.waiting = False
+            self.send_msg("ready")
+
+    def open_shm(self):
+        """Maps the shared-memory segment announced by the server."""
+
+        self._nat = self.recvall(self._nat)
+        plen = self.recvall(np.int32())
+        path = "".join(self.recvall(np.zeros(plen, np.character)))
+        self._shm = np.memmap(path, dtype=np.float64, mode="r+", shape=(SHMHDR + 6 * self._nat,))
+
+    def recvpos(self, msg):
+        """Reads the configurations sent with a POSDATA, SHMPOSDATA or POSBATCH message.
+
+        Args:
+            msg: The header of the message.
+
+        Returns:
+            A list of (positions, cell, inverse cell) tuples. The positions
+            have shape (nat, 3), and all the arrays are owned by the caller.
+        """
+
+        self.nbatch = None
+        if msg == Message("shmposdata"):
+            h, ih, pot, vir, pos, f = shm_layout(self._shm, self._nat)
+            return [(pos.reshape((-1, 3)).copy(), h.copy(), ih.copy())]
+
+        nconf = 1
+        if msg == Message("posbatch"):
+            self.nbatch = self.recvall(np.int32())
+            nconf = self.nbatch
+        configs = []
+        for i in range(nconf):
+            h = self.recvall(np.zeros((3, 3), np.float64))
+            ih = self.recvall(np.zeros((3, 3), np.float64))
+            self._nat = self.recvall(self._nat)
+            pos = self.recvall(np.zeros((self._nat, 3), np.float64))
+            configs.append((pos, h, ih))
+        return configs
+
+    def sendforce(self):
+        """Sends the results of the last message back to the server."""
+
+        if self._shm is not None and self.nbatch is None:
+            # results go in the segment, and must be there before the server is told
+            # they are ready. the socket only carries the extra string
+            force, potential, vir, extra = self.results[0]
+            h, ih, pot, svir, pos, f = shm_layout(self._shm, self._nat)
+            pot[:] = np.asarray(potential, np.float64).reshape(-1)[:1]
+            f[:] = np.asarray(force, np.float64).reshape(-1)
+            svir[:] = np.asarray(vir, np.float64).reshape((3, 3))
+            self.sendall(Message("forceready"))
+            self.sendall(np.int32(len(extra)), 4)
+            if len(extra) > 0:
+                self.sendall(extra)
+            self.results = []
+            return
+
+        self.sendall(Message("forceready"))
+        for force, potential, vir, extra in self.results:
+            force = np.asarray(force, np.float64).reshape(-1)
+            potential = np.asarray(potential, np.float64).reshape(-1)[:1]
+            vir = np.asarray(vir, np.float64).reshape((3, 3))
+            self.sendall(potential, 8)
+            self.sendall(np.int32(len(force) / 3), 4)
+            self.sendall(force, 8 * force.size)
+            self.sendall(vir, 9 * 8)
+            self.sendall(np.int32(len(extra)), 4)
+            if len(extra) > 0:
+                self.sendall(extra)
+        self.results = []
+
+
+class MultiClient(object):
+
+    """Serves forces to several connections to one or more i-PI servers.
+
+    A single event loop waits on all the connections, and the configurations
+    the servers send are evaluated concurrently by a pool of worker threads,
+    so that one process can keep several beads in flight. This pays off when
+    the evaluation releases the GIL, e.g. in numpy, compiled code or when
+    waiting for an external program.
+
+    Attributes:
+        connections: The list of the open Connection objects.
+        nworkers: The number of threads evaluating the forces.
+        _callback: An optional function returning the forces and potential of
+            a (nat, 3) array of positions.
+        _done: A queue of the evaluations finished by the workers.
+        _wake: A pipe used by the workers to wake up the event loop.
+    """
+
+    def __init__(self, nworkers=1):
+        """Initialises MultiClient.
+
+        Args:
+            nworkers: The number of configurations that are evaluated at the same time.
+        """
+
+        self.connections = []
+        self.nworkers = nworkers
+        self._callback = None
+        self._done = Queue.Queue()
+        self._wake = os.pipe()
+
+    def connect(self, address="localhost", port=31415, mode="unix", batch=1):
+        """Opens a new connection to a server.
+
+        Args:
+            address: A string giving the name of the host network.
+            port: An integer giving the port the socket will be using.
+            mode: A string giving the type of socket used - 'inet', 'unix' or 'shm'.
+            batch: The number of configurations the connection accepts in one message.
+
+        Returns:
+            The new Connection object.
+        """
+
+        conn = Connection(connect(address, port, mode), batch)
+        self.connections.append(conn)
+        return conn
+
+    def evaluate(self, pos, cellh, cellih):
+        """Dummy evaluate routine.
+
+        This function must be implemented by subclassing or providing a
+        callback function, and must be thread safe if nworkers is larger than one.
+
+        Args:
+            pos: The (nat, 3) array of positions.
+            cellh: The cell vector matrix.
+            cellih: The inverse of the cell vector matrix.
+
+        Returns:
+            A tuple with the forces, the potential, the virial and a string of
+            extra data.
+        """
+
+        if self._callback is not None:
+            force, potential = self._callback(pos)
+            return force, potential, np.zeros((3, 3), np.float64), ""
+        else:
+            raise NotImplementedError("evaluate must be implemented by providing a self.callback function or overwritten.")
+
+    def _evaluate(self, conn, i, pos, cellh, cellih):
+        """Evaluates a configuration in a worker and wakes up the event loop."""
+
+        try:
+            result = self.evaluate(pos, cellh, cellih)
+        except Exception as e:
+            result = e
+        self._done.put((conn, i, result))
+        os.write(self._wake[1], "x")
+
+    def _drop(self, conn):
+        """Closes a connection and removes it from the list of the open ones."""
+
+        if conn in self.connections:
+            self.connections.remove(conn)
+            conn.close()
+
+    def run(self, verbose=True, t_max=None, fn_exit='EXIT'):
+        """Serve forces until asked to finish or all the sockets disconnect.
+
+        Arguments:
+            - verbose: enable priting of step timing information
+            - t_max: optional maximum wall clock run time in seconds
+            - fn_exit: name of an exit file - will terminate if found
+        """
+
+        t0 = time.time()
+
+        fmt_header = '{0:>6s} {1:>10s} {2:>10s}'
+        fmt_step = '{0:6d} {1:10.3f} {2:10.3f}'
+
+        if t_max is None:
+            print 'Starting communication loop with no maximum run time.'
+        else:
+            print 'Starting communication loop with a maximum run time of {0:d} seconds.'.format(t_max)
+            fmt_header += ' {3:>10s}'
+            fmt_step += ' {3:10.1f}'
+
+        if verbose:
+            header = fmt_header.format('step', 'time', 'avg time', 'remaining')
+            print
+            print header
+            print len(header) * '-'
+
+        i_step = 0
+        t_step_tot = 0.0
+        t_remain = None
+
+        pool = ThreadPool(self.nworkers)
+        try:
+            while len(self.connections) > 0:
+
+                # wakes up periodically to check the exit conditions
+                readable = select.select(self.connections + [self._wake[0]], [], [], 1.0)[0]
+
+                if self._wake[0] in readable:
+                    os.read(self._wake[0], 4096)
+                    readable.remove(self._wake[0])
+
+                # collects the finished evaluations
+                while True:
+                    try:
+                        conn, i, result = self._done.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if conn not in self.connections:
+                        continue
+                    if isinstance(result, Exception):
+                        print >> sys.stderr, "Error evaluating forces:", result
+                        self._drop(conn)
+                        continue
+                    conn.results[i] = result
+                    conn.busy -= 1
+                    if conn.busy == 0:
+                        if verbose:
+                            t_now = time.time()
+                            t_step = t_now - conn.t_start
+                            t_step_tot += t_step
+                            t_step_avg = t_step_tot / (i_step + 1)
+                            if t_max is not None:
+                                t_remain = t_max - (t_now - t0)
+                            print fmt_step.format(i_step, t_step, t_step_avg, t_remain)
+                        i_step += 1
+                        if conn.waiting:
+                            conn.reply_status()
+
+                # serves the connections that have a message waiting
+                for conn in readable:
+                    try:
+                        msg = conn.recv_msg()
+                        if msg == "":
+                            print "Server shut down."
+                            self._drop(conn)
+                        elif msg == Message("status"):
+                            conn.reply_status()
+                        elif msg == Message("shmopen"):
+                            conn.open_shm()
+                        elif msg == Message("posdata") or msg == Message("shmposdata") or msg == Message("posbatch"):
+                            configs = conn.recvpos(msg)
+                            conn.results = [None] * len(configs)
+                            conn.busy = len(configs)
+                            conn.t_start = time.time()
+                            for i, (pos, h, ih) in enumerate(configs):
+                                pool.apply_async(self._evaluate, (conn, i, pos, h, ih))
+                        elif msg == Message("getforce"):
+                            conn.sendforce()
+                        else:
+                            print >> sys.stderr, "Client could not understand command:", msg
+                            self._drop(conn)
+                    except socket.error as e:
+                        print 'Error communicating through socket: [{0}] {1}'.format(e.errno, e.strerror)
+                        self._drop(conn)
+
+                # check exit conditions - run time or exit file
+                if t_max is not None and time.time() - t0 > t_max:
+                    print 'Maximum run time of {0:d} seconds exceeded.'.format(t_max)
+                    break
+                if fn_exit is not None and os.path.exists(fn_exit):
+                    print 'Exit file "{0:s}" found. Removing file.'.format(fn_exit)
+                    os.remove(fn_exit)
+                    break
+
+        except KeyboardInterrupt:
+            print ' Keyboard interrupt.'
+        finally:
+            pool.terminate()
+
+        print 'Communication loop finished.'
+        print
+
+
+class ClientASE(MultiClient):
 
     """Socket client that calls an ASE calculator to get interactions.
 
     Atomic Simulation Environment:
     https://wiki.fysik.dtu.dk/ase/
+
+    Several connections can be opened to keep more beads in flight. With more
+    than one worker, each thread evaluates the forces on its own deep copy of
+    the atoms and of their calculator.
     """
 
-    def __init__(self, atoms, address='localhost', port=31415, mode='unix', _socket=True):
+    def __init__(self, atoms, address='localhost', port=31415, mode='unix', _socket=True, batch=1,
+                 nconnections=1, nworkers=None):
         """Store provided data and initialize the base class.
 
         Arguments:
             - `atoms`: an ASE `Atoms` object
-            - the rest gets passed to the `Client` base class
+            - `nconnections`: the number of connections opened to the server
+            - `nworkers`: the number of threads evaluating forces, by default
+              enough to serve all the connections at once
+            - the rest gets passed to the `MultiClient.connect` method
         """
 
         # store the provided data
         self.atoms = atoms
+        self._local = threading.local()
 
         # prepare unit conversions
         # (ASE uses Angstrom and eV)
         self.eV = units.unit_to_internal('energy', 'electronvolt', 1.0)
         self.Angstrom = units.unit_to_internal('length', 'angstrom', 1.0)
 
-        # prepare arrays
-        self._positions = np.zeros_like(atoms.get_positions())
-        self._force = np.zeros_like(atoms.get_positions())
-        self._potential = np.zeros(1)
-
         # call base class constructor
-        super(ClientASE, self).__init__(address, port, mode, _socket)
+        if nworkers is None:
+            nworkers = nconnections * batch
+        super(ClientASE, self).__init__(nworkers)
+        if _socket:
+            for i in range(nconnections):
+                self.connect(address, port, mode, batch)
 
-    def _getforce(self):
-        """Update stored potential energy and forces using ASE."""
+    def _atoms(self):
+        """Returns the atoms the current thread should evaluate the forces on."""
 
-        # for convenience
-        atoms = self.atoms
+        if self.nworkers == 1:
+            return self.atoms
+        if not hasattr(self._local, "atoms"):
+            self._local.atoms = copy.deepcopy(self.atoms)
+        return self._local.atoms
+
+    def evaluate(self, pos, cellh, cellih):
+        """Return the potential energy and forces computed by ASE."""
+
+        atoms = self._atoms()
 
         # update current coordinates and cell
-        atoms.set_positions(self._positions / self.Angstrom)
-        atoms.set_cell(self._cellh / self.Angstrom)
+        atoms.set_positions(pos / self.Angstrom)
+        atoms.set_cell(cellh / self.Angstrom)
 
         # get data out, trigger calculation in the process
-        self._force[:] = atoms.get_forces() * self.eV / self.Angstrom
-        self._potential[:] = np.array([atoms.get_potential_energy() * self.eV])
-
-        # DEBUG
-        # print 'positions for ASE:'
-        # print self._positions / self.Angstrom
-        # print
-        # print 'cell for ASE:'
-        # print self._cellh / self.Angstrom
-        # print
-        # print 'potential energy [Ha]:'
-        # print self._potential
-        # print
-        # print 'forces [atomic units]:'
-        # print self._force
-        # print
+        force = atoms.get_forces() * self.eV / self.Angstrom
+        potential = np.array([atoms.get_potential_energy() * self.eV])
+
+        return force, potential, np.zeros((3, 3), np.float64), ""
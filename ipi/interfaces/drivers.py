@@ -0,0 +1,270 @@
+"""Deals with launching and managing local driver processes.
+
+Spawns driver codes that connect to an i-PI socket, restarts them if they
+die and adjusts their number to the number of force requests that are
+waiting to be computed.
+"""
+
+# This file is part of i-PI.
+# i-PI Copyright (C) 2014-2015 i-PI developers
+# See the "licenses" directory for full license information.
+
+
+import os
+import sys
+import shlex
+import socket
+import struct
+import subprocess
+import time
+from collections import deque
+
+from ipi.utils.messages import verbosity, warning, info
+
+
+__all__ = ['DriverPool']
+
+
+POOLCOOLDOWN = 30.0  # seconds the demand must stay low before drivers are stopped
+POOLMINLIFE = 5.0    # drivers dying sooner than this after being started count as failures
+POOLMAXFAIL = 5      # number of consecutive failures after which drivers are not restarted any more
+POOLRETIRE = 5.0     # seconds a retired driver is given to exit before it is terminated
+POOLKILL = 1.0       # seconds the drivers are given to exit on stop before they are killed
+SO_PEERCRED = getattr(socket, "SO_PEERCRED", 17)  # not exposed by the socket module of python 2
+
+
+def peer_pid(client):
+    """Returns the process id of the driver at the other end of a socket.
+
+    Only works on Linux. For UNIX sockets the id is asked to the kernel,
+    while for local TCP sockets it is looked up in the table of the
+    connections and in the file descriptors of the processes.
+
+    Args:
+       client: The socket connected to the driver.
+
+    Returns:
+       The process id, or None if it cannot be found.
+    """
+
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        if client.family == socket.AF_UNIX:
+            return struct.unpack("3i", client.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, struct.calcsize("3i")))[0]
+        port = client.getpeername()[1]
+        inode = None
+        for table in ["/proc/net/tcp", "/proc/net/tcp6"]:
+            if not os.path.exists(table):
+                continue
+            with open(table) as ftable:
+                for line in ftable.readlines()[1:]:
+                    fields = line.split()
+                    if int(fields[1].split(":")[1], 16) == port:
+                        inode = fields[9]
+        if inode is None:
+            return None
+        link = "socket:[" + inode + "]"
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                for fd in os.listdir("/proc/" + pid + "/fd"):
+                    if os.readlink("/proc/" + pid + "/fd/" + fd) == link:
+                        return int(pid)
+            except OSError:
+                # the process has gone, or belongs to somebody else
+                pass
+    except (socket.error, IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class DriverPool(object):
+
+    """A pool of driver processes started and monitored by i-PI.
+
+    The command template is formatted with the address, port and mode of the
+    socket interface and with a progressive index, e.g.
+    'driver.x -u -h {address} -m lj'. The pool keeps at least nmin drivers
+    running, and up to nmax if there are enough requests to keep them busy.
+    Drivers that are not needed any more are retired only when they are idle,
+    by closing their connection, and are left to exit on their own.
+
+    Attributes:
+       command: The command template used to start a driver.
+       nmin: The number of drivers that are always kept running.
+       nmax: The maximum number of drivers that can be running.
+       procs: The list of the running driver processes.
+       retired: The list of the driver processes that have been retired and
+          have not exited yet.
+       nstarted: The number of drivers started so far.
+       nfailed: The number of consecutive drivers that died soon after being
+          started. Once it reaches POOLMAXFAIL, drivers are not restarted.
+       _interface: The socket interface the drivers connect to.
+       _t_start: The time at which the pool was started.
+       _demand: A deque of the (time, demand) pairs of the last POOLCOOLDOWN
+          seconds that are larger than all the following ones, so that the
+          first one is the maximum demand over that time.
+       _pids: A dictionary of the process ids of the clients, indexed by
+          their socket.
+    """
+
+    def __init__(self, command, nmin=1, nmax=1):
+        """Initialises DriverPool.
+
+        Args:
+           command: The command template used to start a driver.
+           nmin: The number of drivers that are always kept running.
+           nmax: The maximum number of drivers that can be running.
+
+        Raises:
+           ValueError: Raised if the pool sizes are not consistent.
+        """
+
+        if nmin < 0 or nmax < max(nmin, 1):
+            raise ValueError("Inconsistent driver pool sizes: min " + str(nmin) + ", max " + str(nmax))
+
+        self.command = command
+        self.nmin = nmin
+        self.nmax = nmax
+        self.procs = []
+        self.retired = []
+        self.nstarted = 0
+        self.nfailed = 0
+        self._interface = None
+        self._t_start = 0.0
+        self._demand = deque()
+        self._pids = {}
+
+    def start(self, interface):
+        """Starts the minimum number of drivers.
+
+        Must be called once the socket of the interface is listening.
+
+        Args:
+           interface: The InterfaceSocket object the drivers connect to.
+        """
+
+        self._interface = interface
+        self.nfailed = 0
+        self._t_start = time.time()
+        self._demand = deque()
+        while len(self.procs) < self.nmin:
+            self.spawn()
+
+    def spawn(self):
+        """Starts a new driver process."""
+
+        cmd = self.command.format(address=self._interface.address, port=self._interface.port,
+                                  mode=self._interface.mode, index=self.nstarted)
+        info(" @DRIVERS: Starting driver: " + cmd, verbosity.medium)
+        proc = subprocess.Popen(shlex.split(cmd))
+        proc.t_start = time.time()
+        self.procs.append(proc)
+        self.nstarted += 1
+
+    def update(self, demand):
+        """Restarts the drivers that died and scales the pool.
+
+        The pool grows as soon as there are more requests than drivers, and
+        shrinks only when the demand has stayed below the pool size for
+        POOLCOOLDOWN seconds, so it does not shrink between steps. Called
+        at every poll of the interface, so it never blocks.
+
+        Args:
+           demand: The number of clients that would be needed to compute at
+              once all the requests that are running or waiting.
+        """
+
+        now = time.time()
+
+        for proc in self.procs[:]:
+            if proc.poll() is not None:
+                self.procs.remove(proc)
+                if now - proc.t_start < POOLMINLIFE:
+                    self.nfailed += 1
+                else:
+                    self.nfailed = 0
+                warning(" @DRIVERS: Driver " + str(proc.pid) + " exited with status " + str(proc.returncode) + ".", verbosity.low)
+                if self.nfailed == POOLMAXFAIL:
+                    warning(" @DRIVERS: " + str(POOLMAXFAIL) + " drivers in a row exited soon after starting. Will not restart them.", verbosity.low)
+
+        # reaps the retired drivers, terminating the ones that do not exit by themselves
+        for proc in self.retired[:]:
+            if proc.poll() is not None:
+                self.retired.remove(proc)
+            elif now - proc.t_retired > POOLRETIRE and not proc.terminated:
+                warning(" @DRIVERS: Retired driver " + str(proc.pid) + " did not exit. Terminating it.", verbosity.low)
+                proc.terminate()
+                proc.terminated = True
+
+        # keeps the running maximum of the demand over the cool-down time
+        while len(self._demand) > 0 and self._demand[-1][1] <= demand:
+            self._demand.pop()
+        self._demand.append((now, demand))
+        while self._demand[0][0] < now - POOLCOOLDOWN:
+            self._demand.popleft()
+
+        target = min(self.nmax, max(self.nmin, demand))
+        if self.nfailed < POOLMAXFAIL:
+            while len(self.procs) < target:
+                self.spawn()
+
+        # retires the most recent drivers if they have not been needed for a while
+        if now - self._t_start >= POOLCOOLDOWN:
+            target = min(self.nmax, max(self.nmin, self._demand[0][1]))
+            if len(self.procs) > target:
+                self.retire(len(self.procs) - target)
+
+    def retire(self, n):
+        """Retires up to n of the drivers whose client is idle.
+
+        The newest drivers are retired first. Drivers whose client cannot be
+        identified, or that are working on a request, are kept.
+
+        Args:
+           n: The number of drivers to retire.
+        """
+
+        idle = self._interface.idle_clients()
+        for c in self._pids.keys():
+            if not c in self._interface.clients:
+                del self._pids[c]
+        byproc = {}
+        for c in idle:
+            if not c in self._pids:
+                self._pids[c] = peer_pid(c)
+            byproc[self._pids[c]] = c
+
+        for proc in reversed(self.procs[:]):
+            if n == 0:
+                break
+            c = byproc.get(proc.pid)
+            if c is None:
+                continue
+            info(" @DRIVERS: Retiring driver " + str(proc.pid) + ".", verbosity.medium)
+            self._interface.retire(c)
+            self.procs.remove(proc)
+            proc.t_retired = time.time()
+            proc.terminated = False
+            self.retired.append(proc)
+            n -= 1
+
+    def stop(self):
+        """Terminates all the drivers."""
+
+        for proc in self.procs + self.retired:
+            if proc.poll() is None:
+                proc.terminate()
+        # drivers that ignore the termination signal are killed, so they cannot hang i-PI on exit
+        tmax = time.time() + POOLKILL
+        for proc in self.procs + self.retired:
+            while proc.poll() is None and time.time() < tmax:
+                time.sleep(0.01)
+            if proc.poll() is None:
+                warning(" @DRIVERS: Driver " + str(proc.pid) + " did not exit after being terminated, killing it.", verbosity.low)
+                proc.kill()
+                proc.wait()
+        self.procs = []
+        self.retired = []
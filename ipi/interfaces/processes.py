@@ -0,0 +1,241 @@
+"""Deals with evaluating a Python potential in a pool of worker processes.
+
+Loads a user-provided Python function in several worker processes, so that
+configurations can be evaluated in parallel without being serialised by the
+global interpreter lock. Positions, cell, forces and virial are exchanged
+through a shared-memory segment for each worker, with the same layout used by
+the 'shm' socket mode, and a pipe is only used to signal that a configuration
+is ready or has been evaluated.
+"""
+
+# This file is part of i-PI.
+# i-PI Copyright (C) 2014-2015 i-PI developers
+# See the "licenses" directory for full license information.
+
+
+import os
+import imp
+import select
+import tempfile
+import importlib
+import traceback
+import multiprocessing
+
+import numpy as np
+
+from ipi.interfaces.sockets import SHMHDR, shm_layout
+from ipi.utils.messages import verbosity, info
+
+
+__all__ = ['ProcessPool', 'load_function']
+
+
+def load_function(module, function):
+    """Imports a function from a module.
+
+    Args:
+       module: The name of an importable module, or the path of a Python file.
+       function: The name of the function.
+
+    Returns:
+       The function object.
+    """
+
+    if module.endswith(".py"):
+        name = os.path.splitext(os.path.basename(module))[0]
+        mod = imp.load_source(name, module)
+    else:
+        mod = importlib.import_module(module)
+    return getattr(mod, function)
+
+
+def _worker(conn, module, function, pars):
+    """Main loop of a worker process.
+
+    Waits on the pipe for instructions: a ("map", path, nat) tuple to map a new
+    shared-memory segment, a "calc" string to evaluate the configuration held
+    in the segment, or None to exit. Replies "ok" to a map, and ("done", extra)
+    or ("error", message) to a calc.
+
+    Args:
+       conn: The worker end of the pipe.
+       module: The module containing the potential.
+       function: The name of the function computing the potential.
+       pars: A dictionary of keyword arguments for the function.
+    """
+
+    try:
+        potential = load_function(module, function)
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+        return
+    conn.send("ok")
+
+    segment = None
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        elif msg[0] == "map":
+            segment = shm_layout(np.memmap(msg[1], dtype=np.float64, mode="r+", shape=(SHMHDR + 6 * msg[2],)), msg[2])
+            conn.send("ok")
+        elif msg == "calc":
+            h, ih, pot, vir, pos, f = segment
+            try:
+                result = potential(pos.reshape((-1, 3)), h, **pars)
+                pot[0] = result[0]
+                f[:] = np.asarray(result[1]).flatten()
+                vir[:] = result[2] if len(result) > 2 else 0.0
+                conn.send(("done", result[3] if len(result) > 3 else ""))
+            except Exception:
+                conn.send(("error", traceback.format_exc()))
+    conn.close()
+
+
+class ProcessPool(object):
+
+    """A pool of worker processes evaluating a Python potential.
+
+    The potential is a function f(pos, cell, **pars) that takes an array
+    (natoms, 3) of positions and the (3, 3) cell matrix, and returns the
+    potential energy, the forces and optionally the virial and a string of
+    extra output, all in atomic units.
+
+    Attributes:
+       module: The module containing the potential, either a module name or
+          the path of a Python file.
+       function: The name of the function computing the potential.
+       nprocs: The number of worker processes.
+       pars: A dictionary of keyword arguments for the function.
+       workers: The list of the worker processes.
+       _conns: The pipes to the workers.
+       _segments: The shared-memory segments of the workers, split in views.
+    """
+
+    def __init__(self, module, function="potential", nprocs=1, pars=None):
+        """Initialises ProcessPool.
+
+        Args:
+           module: The module containing the potential.
+           function: The name of the function computing the potential.
+           nprocs: The number of worker processes.
+           pars: A dictionary of keyword arguments for the function.
+
+        Raises:
+           ValueError: Raised if the number of processes is not positive.
+        """
+
+        if nprocs < 1:
+            raise ValueError("The number of worker processes must be positive.")
+
+        self.module = module
+        self.function = function
+        self.nprocs = nprocs
+        self.pars = {} if pars is None else pars
+        self.workers = []
+        self._conns = []
+        self._segments = []
+
+    def start(self):
+        """Starts the worker processes and waits until they have loaded the potential.
+
+        Raises:
+           RuntimeError: Raised if a worker cannot load the potential.
+        """
+
+        for i in range(self.nprocs):
+            conn, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_worker, args=(child, self.module, self.function, self.pars),
+                                           name="ffworker_%d" % i)
+            proc.daemon = True
+            proc.start()
+            child.close()
+            self.workers.append(proc)
+            self._conns.append(conn)
+            self._segments.append(None)
+        for conn in self._conns:
+            self._reply(conn)
+        info(" @PROCESSPOOL: Started %d workers evaluating %s from %s." % (self.nprocs, self.function, self.module), verbosity.low)
+
+    def _reply(self, conn):
+        """Receives the reply of a worker, raising an error if it failed."""
+
+        try:
+            msg = conn.recv()
+        except EOFError:
+            raise RuntimeError("A worker process of the pool has died.")
+        if msg[0] == "error":
+            raise RuntimeError("Error in the potential evaluated by a worker process:\n" + msg[1])
+        return msg
+
+    def _map(self, k, nat):
+        """Creates a shared-memory segment for worker k, for nat atoms."""
+
+        shmdir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        fd, path = tempfile.mkstemp(prefix="ipi_pool_", dir=shmdir)
+        try:
+            os.ftruncate(fd, 8 * (SHMHDR + 6 * nat))
+            self._segments[k] = shm_layout(np.memmap(path, dtype=np.float64, mode="r+", shape=(SHMHDR + 6 * nat,)), nat)
+            self._conns[k].send(("map", path, nat))
+            self._reply(self._conns[k])
+        finally:
+            # the segment lives as long as it is mapped by the two processes
+            os.close(fd)
+            os.unlink(path)
+
+    def evaluate(self, configs):
+        """Evaluates a list of configurations, in parallel over the workers.
+
+        Args:
+           configs: A list of (pos, h, ih) tuples, with the flat array of the
+              positions, the cell matrix and its inverse.
+
+        Returns:
+           A list of [pot, f, vir, extra] results, one for each configuration.
+        """
+
+        results = [None] * len(configs)
+        pending = range(len(configs))
+        busy = {}
+        while pending or busy:
+            for k in range(self.nprocs):
+                if k in busy or not pending:
+                    continue
+                i = pending.pop(0)
+                pos, h, ih = configs[i]
+                nat = len(pos) / 3
+                if self._segments[k] is None or len(self._segments[k][4]) != 3 * nat:
+                    self._map(k, nat)
+                sh, sih, spot, svir, spos, sf = self._segments[k]
+                sh[:] = h
+                sih[:] = ih
+                spos[:] = pos
+                self._conns[k].send("calc")
+                busy[k] = i
+
+            ready = select.select([self._conns[k] for k in busy], [], [])[0]
+            for k in busy.keys():
+                if self._conns[k] in ready:
+                    extra = self._reply(self._conns[k])[1]
+                    sh, sih, spot, svir, spos, sf = self._segments[k]
+                    results[busy.pop(k)] = [spot[0], np.array(sf), np.array(svir), extra]
+        return results
+
+    def stop(self):
+        """Terminates the worker processes."""
+
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except IOError:
+                pass
+        for proc in self.workers:
+            proc.join(1.0)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+        for conn in self._conns:
+            conn.close()
+        self.workers = []
+        self._conns = []
+        self._segments = []
@@ -12,14 +12,19 @@ calculation.
 
 import sys
 import os
+import errno
+import fcntl
 import socket
 import select
 import string
+import tempfile
 import time
+from collections import deque
 
 import numpy as np
 
 from ipi.utils.depend import dstrip
+from ipi.utils.mathtools import extrapolation_coefficients
 from ipi.utils.messages import verbosity, warning, info
 
 
@@ -31,6 +36,11 @@ UPDATEFREQ = 10
 TIMEOUT = 0.05
 SERVERTIMEOUT = 5.0 * TIMEOUT
 NTIMEOUT = 20
+SHMHDR = 28   # h(9), ih(9), pot(1), vir(9) precede positions and forces in a shm segment
+SERVICEDECAY = 0.3   # weight of the last measurement in the moving average of the service time
+AFFINITYSLACK = 0.1  # relative delay that is accepted to send a replica to the client that computed it last
+HEDGEHISTORY = 100   # number of recent request latencies used to spot stragglers
+HEDGEMINSAMPLES = 10  # number of latencies that must be known before hedging
 
 
 def Message(mystr):
@@ -39,6 +49,25 @@ def Message(mystr):
     return string.ljust(string.upper(mystr), HDRLEN)
 
 
+def shm_layout(segment, nat):
+    """Splits a shared-memory segment into the arrays that are exchanged.
+
+    The segment is a flat array of 8-byte floats that holds, in order, the
+    cell matrix, its inverse, the potential, the virial, the positions and the
+    forces, with the same row-major storage used on the socket.
+
+    Args:
+       segment: A float64 array of size SHMHDR + 6*nat, typically a memmap.
+       nat: The number of atoms.
+
+    Returns:
+       A tuple of views (h, ih, pot, vir, pos, f) on the segment.
+    """
+
+    return (segment[0:9].reshape((3, 3)), segment[9:18].reshape((3, 3)), segment[18:19],
+            segment[19:28].reshape((3, 3)), segment[SHMHDR:SHMHDR + 3 * nat], segment[SHMHDR + 3 * nat:SHMHDR + 6 * nat])
+
+
 class Disconnected(Exception):
 
     """Disconnected: Raised if client has been disconnected."""
@@ -100,7 +129,8 @@ class DriverSocket(socket.socket):
     but can also be used to directly implement a python client.
 
     Attributes:
-       _buf: A string buffer to hold the reply from the other connection.
+       nbytes: The number of bytes sent and received so far.
+       _buf: A byte buffer to hold scalars read from the other connection.
     """
 
     def __init__(self, socket):
@@ -111,6 +141,7 @@ class DriverSocket(socket.socket):
         """
 
         super(DriverSocket, self).__init__(_sock=socket)
+        self.nbytes = 0
         self._buf = np.zeros(0, np.byte)
         if socket:
             self.peername = self.getpeername()
@@ -133,65 +164,65 @@ class DriverSocket(socket.socket):
         """
         return self.recv(l)
 
+    def sendall(self, data, flags=0):
+        """Sends all the data through the socket, keeping count of the bytes.
+
+        Args:
+           data: A string or an array with the data to send.
+           flags: The flags passed on to the socket.
+        """
+
+        super(DriverSocket, self).sendall(data, flags)
+        self.nbytes += data.nbytes if hasattr(data, "nbytes") else len(data)
+
     def recvall(self, dest):
         """Gets the potential energy, force and virial from the driver.
 
+        Array destinations are filled in place with recv_into, so that data
+        goes straight from the socket to their memory without intermediate
+        copies. Scalars are read through a small internal buffer.
+
         Args:
-           dest: Object to be read into.
+           dest: Object to be read into. Arrays must be contiguous.
 
         Raises:
            Disconnected: Raised if client is disconnected.
 
         Returns:
-           The data read from the socket to be read into dest.
+           The data read from the socket: dest itself if it is an array, or
+           a new scalar of the same type.
         """
 
         blen = dest.itemsize * dest.size
-        if (blen > len(self._buf)):
-            self._buf.resize(blen)
+        if np.isscalar(dest):
+            if (blen > len(self._buf)):
+                self._buf = np.zeros(blen, np.byte)
+            target = self._buf[0:blen]
+        else:
+            target = dest
+        bview = memoryview(target.reshape(-1).view(np.byte))
         bpos = 0
         ntimeout = 0
 
         while bpos < blen:
-            timeout = False
-
-            # pre-2.5 version.
             try:
-                bpart = ""
-                bpart = self.recv(blen - bpos)
-                if len(bpart) == 0:
-                    raise socket.timeoout    # if this keeps returning no data, we are in trouble....
-                self._buf[bpos:bpos + len(bpart)] = np.fromstring(bpart, np.byte)
+                bpart = self.recv_into(bview[bpos:], blen - bpos)
             except socket.timeout:
                 warning(" @SOCKET:   Timeout in recvall, trying again!", verbosity.low)
-                timeout = True
                 ntimeout += 1
                 if ntimeout > NTIMEOUT:
                     warning(" @SOCKET:  Couldn't receive within %5d attempts. Time to give up!" % (NTIMEOUT), verbosity.low)
                     raise Disconnected()
-                pass
-            if not timeout and len(bpart) == 0:
+                continue
+            if bpart == 0:
                 raise Disconnected()
-            bpos += len(bpart)
-
-            # post-2.5 version: slightly more compact for modern python versions
-            # try:
-            #   bpart = 1
-            #   bpart = self.recv_into(self._buf[bpos:], blen-bpos)
-            # except socket.timeout:
-            #   print " @SOCKET:   Timeout in status recvall, trying again!"
-            #   timeout = True
-            #   pass
-            # if (not timeout and bpart == 0):
-            #   raise Disconnected()
-            # bpos += bpart
-            # TODO this Disconnected() exception currently just causes the program to hang.
-            # This should do something more graceful
+            bpos += bpart
+        self.nbytes += blen
 
         if np.isscalar(dest):
-            return np.fromstring(self._buf[0:blen], dest.dtype)[0]
+            return target.view(dest.dtype)[0]
         else:
-            return np.fromstring(self._buf[0:blen], dest.dtype).reshape(dest.shape)
+            return dest
 
 
 class Driver(DriverSocket):
@@ -207,13 +238,45 @@ class Driver(DriverSocket):
        status: Keeps track of the status of the driver.
        lastreq: The ID of the last request processed by the client.
        locked: Flag to mark if the client has been working consistently on one image.
+       shmprefix: The prefix of the shared-memory segment file, or None if
+          the data should travel through the socket.
+       caps: A dictionary of the protocol extensions advertised by the
+          driver, e.g. {"batch": "8"}.
+       maxbatch: The number of configurations the driver accepts in a single
+          POSBATCH message.
+       maxhints: The number of previous configurations of a replica the
+          driver can combine to build a starting guess, or 0 if it does not
+          accept HINTS messages.
+       results: The results of a batch that have been received but not yet
+          collected with getforce.
+       _shm: The shared-memory segment, created on the first sendpos.
+       _shmpath: The file backing the segment, until the driver has mapped it
+          and it can be unlinked.
+       servicetime: A moving average of the time the driver takes to serve a
+          single configuration, or None before the first one is completed.
+       _nbatch: The number of configurations sent with the last message.
+       t_connected: The time at which the driver connected.
+       t_sent: The time at which the last message with positions was sent.
+       busytime: The total time the driver has spent serving configurations.
+       nserved: The number of configurations served by the driver.
+       sendcost: The time spent and the bytes moved to send each of the
+          configurations of the last message with positions.
+       recvcost: The time spent and the bytes moved to receive each of the
+          results of the last message.
+       _fbuf: Buffer the forces are received into, one row per configuration
+          of a batch. Reused as long as the size of the messages does not change.
+       _vbuf: Buffer the virials are received into.
+       _xbuf: Buffer the extra strings are received into.
     """
 
-    def __init__(self, socket):
+    def __init__(self, socket, shmprefix=None):
         """Initialises Driver.
 
         Args:
            socket: A socket through which the communication should be done.
+           shmprefix: If given, positions, cell and forces are exchanged
+              through a shared-memory segment whose file name starts with
+              this prefix, and the socket only carries control messages.
         """
 
         super(Driver, self).__init__(socket=socket)
@@ -221,6 +284,24 @@ class Driver(DriverSocket):
         self.status = Status.Up
         self.lastreq = None
         self.locked = False
+        self.shmprefix = shmprefix
+        self._shm = None
+        self._shmpath = None
+        self.caps = {}
+        self.maxbatch = 1
+        self.maxhints = 0
+        self.results = []
+        self.servicetime = None
+        self._nbatch = 1
+        self.t_connected = time.time()
+        self.t_sent = 0.0
+        self.busytime = 0.0
+        self.nserved = 0
+        self.sendcost = (0.0, 0)
+        self.recvcost = (0.0, 0)
+        self._fbuf = np.zeros((1, 0), np.float64)
+        self._vbuf = np.zeros((1, 3, 3), np.float64)
+        self._xbuf = np.zeros(0, np.character)
 
     def shutdown(self, how=socket.SHUT_RDWR):
         """Tries to send an exit message to clients to let them exit gracefully."""
@@ -229,18 +310,55 @@ class Driver(DriverSocket):
         self.status = Status.Disconnected
         super(DriverSocket, self).shutdown(how)
 
+    def close(self):
+        """Closes the socket and releases the shared-memory segment."""
+
+        self._shm_release()
+        super(Driver, self).close()
+
+    def _shm_release(self):
+        """Unmaps the shared-memory segment and removes its file, if any."""
+
+        self._shm = None
+        if self._shmpath is not None:
+            try:
+                os.unlink(self._shmpath)
+            except OSError:
+                pass
+            self._shmpath = None
+
+    def _shm_open(self, nat):
+        """Creates a shared-memory segment for nat atoms and sends it to the driver.
+
+        Args:
+           nat: The number of atoms whose data should fit in the segment.
+        """
+
+        self._shm_release()
+        shmdir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        fd, path = tempfile.mkstemp(prefix=self.shmprefix, dir=shmdir)
+        os.close(fd)
+        self._shmpath = path
+        self._shm = np.memmap(path, dtype=np.float64, mode="w+", shape=(SHMHDR + 6 * nat,))
+        self.sendall(Message("shmopen"))
+        self.sendall(np.int32(nat))
+        self.sendall(np.int32(len(path)))
+        self.sendall(path)
+
     def poll(self):
         """Waits for driver status."""
 
         self.status = Status.Disconnected  # sets disconnected as failsafe status, in case _getstatus fails and exceptions are ignored upstream
         self.status = self._getstatus()
 
-    def _getstatus(self):
-        """Gets driver status.
+    def querystatus(self):
+        """Asks the driver for its status, unless a query is already pending.
+
+        The reply is not read here, so this never blocks waiting for a busy
+        driver: the socket becomes readable once the driver has answered.
 
         Returns:
-           An integer labelling the status via bitwise or of the relevant members
-           of Status.
+           False if the query could not be sent, True otherwise.
         """
 
         if not self.waitstatus:
@@ -252,10 +370,26 @@ class Driver(DriverSocket):
                     self.sendall(Message("status"))
                     self.waitstatus = True
             except socket.error:
-                return Status.Disconnected
+                return False
+        return True
+
+    def _getstatus(self):
+        """Gets driver status.
+
+        Returns:
+           An integer labelling the status via bitwise or of the relevant members
+           of Status.
+        """
+
+        if not self.querystatus():
+            return Status.Disconnected
 
         try:
             reply = self.recv(HDRLEN)
+            if reply == Message("caps"):
+                # the driver advertises its protocol extensions, then gives its status
+                self.readcaps()
+                reply = self.recv_msg()
             self.waitstatus = False  # got some kind of reply
         except socket.timeout:
             warning(" @SOCKET:   Timeout in status recv!", verbosity.trace)
@@ -275,6 +409,59 @@ class Driver(DriverSocket):
             warning(" @SOCKET:    Unrecognized reply: " + str(reply), verbosity.low)
             return Status.Up
 
+    def update_servicetime(self, dt):
+        """Updates the estimate of the time the driver takes to serve a configuration.
+
+        Args:
+           dt: The time elapsed between sending the last message with
+              positions and getting the results back. It is split evenly
+              between the configurations of a batch.
+        """
+
+        dt /= self._nbatch
+        if self.servicetime is None:
+            self.servicetime = dt
+        else:
+            self.servicetime = SERVICEDECAY * dt + (1.0 - SERVICEDECAY) * self.servicetime
+
+    def utilisation(self):
+        """Returns the fraction of the time since it connected the driver spent serving configurations."""
+
+        elapsed = time.time() - self.t_connected
+        if elapsed <= 0.0:
+            return 0.0
+        return min(1.0, self.busytime / elapsed)
+
+    def readcaps(self):
+        """Reads the list of protocol extensions supported by the driver.
+
+        The capabilities come as a comma-separated string of key=value
+        pairs, e.g. "batch=8", that follows a CAPS reply to a status query.
+        Drivers that never send CAPS just use the standard protocol.
+        """
+
+        clen = self.recvall(np.int32())
+        caps = "".join(self.recvall(np.zeros(clen, np.character)))
+        for c in caps.split(","):
+            if "=" in c:
+                k, v = c.split("=", 1)
+                self.caps[k.strip()] = v.strip()
+            elif c.strip() != "":
+                self.caps[c.strip()] = "1"
+        info(" @SOCKET:   Client " + str(self.peername) + " supports protocol extensions: " + caps, verbosity.medium)
+
+        # positions in shared memory are only laid out for one configuration at a time
+        if "batch" in self.caps and self.shmprefix is None:
+            try:
+                self.maxbatch = max(1, int(self.caps["batch"]))
+            except ValueError:
+                warning(" @SOCKET:   Invalid batch size " + self.caps["batch"] + ", will send one configuration at a time.", verbosity.low)
+        if "hints" in self.caps:
+            try:
+                self.maxhints = max(0, int(self.caps["hints"]))
+            except ValueError:
+                warning(" @SOCKET:   Invalid history length " + self.caps["hints"] + ", will not send hints.", verbosity.low)
+
     def initialize(self, rid, pars):
         """Sends the initialisation string to the driver.
 
@@ -299,12 +486,20 @@ class Driver(DriverSocket):
         else:
             raise InvalidStatus("Status in init was " + self.status)
 
-    def sendpos(self, pos, h_ih):
+    def sendpos(self, pos, h_ih, rid=None, hints=None):
         """Sends the position and cell data to the driver.
 
+        Drivers that accept hints first get a HINTS message, with the
+        coefficients that express the new configuration as a combination of
+        the previous ones of the same replica.
+
         Args:
            pos: An array containing the atom positions.
            cell: A cell object giving the system box.
+           rid: The id of the replica the configuration belongs to.
+           hints: An optional (step, q, history) tuple, with the index of the
+              configuration in the trajectory of the replica, its positions
+              and the list of the previous positions, the most recent first.
 
         Raises:
            InvalidStatus: Raised if the status is not Ready.
@@ -312,17 +507,73 @@ class Driver(DriverSocket):
 
         if (self.status & Status.Ready):
             try:
-                self.sendall(Message("posdata"))
-                self.sendall(h_ih[0])
-                self.sendall(h_ih[1])
-                self.sendall(np.int32(len(pos) / 3))
-                self.sendall(pos)
+                t0, nb0 = time.time(), self.nbytes
+                if hints is not None and self.maxhints > 0:
+                    step, q, history = hints
+                    coeffs = extrapolation_coefficients(q, history[:self.maxhints])
+                    self.sendall(Message("hints"))
+                    self.sendall(np.int32(rid))
+                    self.sendall(np.int32(step))
+                    self.sendall(np.int32(len(coeffs)))
+                    self.sendall(coeffs)
+                if self.shmprefix is not None:
+                    nat = len(pos) / 3
+                    if self._shm is None or len(self._shm) != SHMHDR + 6 * nat:
+                        self._shm_open(nat)
+                    h, ih, pot, vir, spos, f = shm_layout(self._shm, nat)
+                    h[:] = h_ih[0]
+                    ih[:] = h_ih[1]
+                    spos[:] = pos
+                    self.nbytes += h.nbytes + ih.nbytes + spos.nbytes
+                    self.sendall(Message("shmposdata"))
+                else:
+                    self.sendall(Message("posdata"))
+                    self.sendall(h_ih[0])
+                    self.sendall(h_ih[1])
+                    self.sendall(np.int32(len(pos) / 3))
+                    self.sendall(pos)
+                self._nbatch = 1
+                self.t_sent = time.time()
+                self.sendcost = (self.t_sent - t0, self.nbytes - nb0)
             except:
                 self.poll()
                 return
         else:
             raise InvalidStatus("Status in sendpos was " + self.status)
 
+    def sendposbatch(self, batch):
+        """Sends several configurations to the driver in a single message.
+
+        Only to be used with drivers that have advertised batch support, and
+        with no more configurations than maxbatch.
+
+        Args:
+           batch: A list of (pos, h_ih) tuples, with the same meaning as the
+              arguments of sendpos.
+
+        Raises:
+           InvalidStatus: Raised if the status is not Ready.
+        """
+
+        if (self.status & Status.Ready):
+            try:
+                t0, nb0 = time.time(), self.nbytes
+                self.sendall(Message("posbatch"))
+                self.sendall(np.int32(len(batch)))
+                for pos, h_ih in batch:
+                    self.sendall(h_ih[0])
+                    self.sendall(h_ih[1])
+                    self.sendall(np.int32(len(pos) / 3))
+                    self.sendall(pos)
+                self._nbatch = len(batch)
+                self.t_sent = time.time()
+                self.sendcost = ((self.t_sent - t0) / self._nbatch, (self.nbytes - nb0) / self._nbatch)
+            except:
+                self.poll()
+                return
+        else:
+            raise InvalidStatus("Status in sendposbatch was " + self.status)
+
     def getforce(self):
         """Gets the potential energy, force and virial from the driver.
 
@@ -330,11 +581,21 @@ class Driver(DriverSocket):
            InvalidStatus: Raised if the status is not HasData.
            Disconnected: Raised if the driver has disconnected.
 
+        After a batch has been sent, all the results are read at the first
+        call, and the following calls return them in the order in which the
+        configurations were sent.
+
         Returns:
-           A list of the form [potential, force, virial, extra].
+           A list of the form [potential, force, virial, extra]. Force and
+           virial are views on the receive buffers of the driver, so they must
+           be copied before the driver is asked for forces again.
         """
 
+        if len(self.results) > 0:
+            return self.results.pop(0)
+
         if (self.status & Status.HasData):
+            t0, nb0 = time.time(), self.nbytes
             self.sendall(Message("getforce"));
             reply = ""
             while True:
@@ -352,24 +613,56 @@ class Driver(DriverSocket):
         else:
             raise InvalidStatus("Status in getforce was " + self.status)
 
-        mu = np.float64()
-        mu = self.recvall(mu)
+        if len(self._vbuf) != self._nbatch:
+            self._vbuf = np.zeros((self._nbatch, 3, 3), np.float64)
+        self.results = [self._recvforce(i) for i in range(self._nbatch)]
+        now = time.time()
+        self.recvcost = ((now - t0) / self._nbatch, (self.nbytes - nb0) / self._nbatch)
+        self.busytime += now - self.t_sent
+        self.nserved += self._nbatch
+        return self.results.pop(0)
+
+    def _recvforce(self, i):
+        """Reads the potential energy, force, virial and extra string of one configuration.
+
+        Args:
+           i: The index of the configuration within the last batch.
+
+        Returns:
+           A list of the form [potential, force, virial, extra].
+        """
+
+        if self._shm is not None:
+            # the driver has written its results in the segment before replying
+            nat = (len(self._shm) - SHMHDR) / 6
+            h, ih, pot, vir, pos, f = shm_layout(self._shm, nat)
+            mu = np.float64(pot[0])
+            mf = f
+            mvir = vir
+            self.nbytes += pot.nbytes + f.nbytes + vir.nbytes
+            # the driver has mapped the segment by now, so the file can go
+            if self._shmpath is not None:
+                try:
+                    os.unlink(self._shmpath)
+                except OSError:
+                    pass
+                self._shmpath = None
+        else:
+            mu = self.recvall(np.float64())
 
-        mlen = np.int32()
-        mlen = self.recvall(mlen)
-        mf = np.zeros(3 * mlen, np.float64)
-        mf = self.recvall(mf)
+            mlen = self.recvall(np.int32())
+            if self._fbuf.shape != (self._nbatch, 3 * mlen):
+                self._fbuf = np.zeros((self._nbatch, 3 * mlen), np.float64)
+            mf = self.recvall(self._fbuf[i])
 
-        mvir = np.zeros((3, 3), np.float64)
-        mvir = self.recvall(mvir)
+            mvir = self.recvall(self._vbuf[i])
 
         #! Machinery to return a string as an "extra" field. Comment if you are using a old patched driver that does not return anything!
-        mlen = np.int32()
-        mlen = self.recvall(mlen)
+        mlen = self.recvall(np.int32())
         if mlen > 0:
-            mxtra = np.zeros(mlen, np.character)
-            mxtra = self.recvall(mxtra)
-            mxtra = "".join(mxtra)
+            if len(self._xbuf) < mlen:
+                self._xbuf = np.zeros(mlen, np.character)
+            mxtra = self.recvall(self._xbuf[0:mlen]).tostring()
         else:
             mxtra = ""
 
@@ -397,6 +690,7 @@ class InterfaceSocket(object):
        server: The socket used for data transmition.
        clients: A list of the driver clients connected to the server.
        requests: A list of all the jobs required in the current PIMD step.
+       prlist: The requests waiting for a client, sorted by decreasing priority.
        jobs: A list of all the jobs currently running.
        _poll_thread: The thread the poll loop is running on.
        _prev_kill: Holds the signals to be sent to clean up the main thread
@@ -406,9 +700,25 @@ class InterfaceSocket(object):
           client connections. It is used as a counter, once it becomes higher
           than the pre-defined number of steps between checks the socket will
           update the list of clients and then be reset to zero.
+       _wake: A pair of file descriptors for a pipe that is used to wake up
+          a thread blocked in wait(), e.g. when a new request is queued.
+       hedge: The percentile of recent request latencies above which a
+          straggling request is sent also to an idle client. 0 disables hedging.
+       _held: The free clients that the throughput scheduler decided to leave
+          idle at the last dispatch, as faster ones will be done sooner.
+       _latencies: The latencies of the last HEDGEHISTORY requests.
+       _hedged: The requests that have been sent to more than one client.
+       _hedge_deadline: The time at which the oldest running request will
+          become a straggler, or None.
+       drivers: The DriverPool of the local drivers started by i-PI, or None.
+       nconnected: The number of clients that have connected so far.
+       ndropped: The number of clients that have been dropped because they
+          disconnected or became unresponsive.
+       nreconnected: The number of clients that connected to replace one
+          that had been dropped.
     """
 
-    def __init__(self, address="localhost", port=31415, slots=4, mode="unix", timeout=1.0, match_mode="auto"):
+    def __init__(self, address="localhost", port=31415, slots=4, mode="unix", timeout=1.0, match_mode="auto", hedge=0.0, drivers=None):
         """Initialises interface.
 
         Args:
@@ -418,13 +728,26 @@ class InterfaceSocket(object):
            slots: An optional integer giving the maximum allowed backlog of
               queueing clients. Defaults to 4.
            mode: An optional string giving the type of socket. Defaults to 'unix'.
+              'shm' listens on a unix socket, but exchanges positions, cell and
+              forces through shared-memory segments, one per client.
            latency: An optional float giving the time in seconds the socket will
               wait before updating the client list. Defaults to 1e-3.
            timeout: Length of time waiting for data from a client before we assume
               the connection is dead and disconnect the client.
+           match_mode: How requests are assigned to clients. 'auto' tries to
+              send each replica to the client that computed it last, 'any'
+              sends it to any free client, and 'throughput' also takes into
+              account how fast each client is, to finish all the requests as
+              early as possible.
+           hedge: If larger than zero, once no requests are waiting for a
+              client, the ones that have been running for longer than this
+              percentile of the recent latencies are also sent to an idle
+              client, and the first result that comes back is used.
+           drivers: An optional DriverPool, that is started once the socket
+              is open and scaled with the number of pending requests.
 
         Raises:
-           NameError: Raised if mode is not 'unix' or 'inet'.
+           NameError: Raised if mode is not 'unix', 'inet' or 'shm'.
         """
 
         self.address = address
@@ -435,6 +758,17 @@ class InterfaceSocket(object):
         self.poll_iter = UPDATEFREQ  # triggers pool_update at first poll
         self.prlist = []
         self.match_mode = match_mode
+        self._wake = None
+        self._held = []
+        self.hedge = hedge
+        self._latencies = deque(maxlen=HEDGEHISTORY)
+        self._hedged = []
+        self._hedge_deadline = None
+        self.drivers = drivers
+        self.clients = []
+        self.nconnected = 0
+        self.ndropped = 0
+        self.nreconnected = 0
 
     def open(self):
         """Creates a new socket.
@@ -443,7 +777,7 @@ class InterfaceSocket(object):
         create the associated socket object.
         """
 
-        if self.mode == "unix":
+        if self.mode == "unix" or self.mode == "shm":
             self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             try:
                 self.server.bind("/tmp/ipi_" + self.address)
@@ -457,13 +791,21 @@ class InterfaceSocket(object):
             self.server.bind((self.address, self.port))
             info("Created inet socket with address " + self.address + " and port number " + str(self.port), verbosity.medium)
         else:
-            raise NameError("InterfaceSocket mode " + self.mode + " is not implemented (should be unix/inet)")
+            raise NameError("InterfaceSocket mode " + self.mode + " is not implemented (should be unix/inet/shm)")
 
         self.server.listen(self.slots)
         self.server.settimeout(SERVERTIMEOUT)
         self.clients = []
         self.jobs = []
 
+        # self-pipe used to interrupt wait() from other threads
+        self._wake = os.pipe()
+        for fd in self._wake:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        if self.drivers is not None:
+            self.drivers.start(self)
+
     def close(self):
         """Closes down the socket."""
 
@@ -480,14 +822,79 @@ class InterfaceSocket(object):
         self.clients = []
         self.jobs = []
 
+        if self.drivers is not None:
+            self.drivers.stop()
+
         try:
             self.server.shutdown(socket.SHUT_RDWR)
             self.server.close()
         except:
             info(" @SOCKET: Problem shutting down the server socket. Will just continue and hope for the best.", verbosity.low)
-        if self.mode == "unix":
+        if self.mode == "unix" or self.mode == "shm":
             os.unlink("/tmp/ipi_" + self.address)
 
+        if self._wake is not None:
+            for fd in self._wake:
+                os.close(fd)
+            self._wake = None
+
+    def wake(self):
+        """Interrupts a wait() call running in another thread.
+
+        Can be called safely from any thread, and before the socket has been
+        opened, in which case it does nothing.
+        """
+
+        if self._wake is None:
+            return
+        try:
+            os.write(self._wake[1], "w")
+        except OSError as e:
+            # a full pipe means there is already a wake-up pending
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def wait(self, timeout):
+        """Blocks until there is something for the dispatcher to do.
+
+        Returns as soon as a driver that has been asked for its status sends
+        a reply, a new client tries to connect, or wake() is called. The
+        timeout is only a fallback, used to check periodically for hung
+        clients.
+
+        Args:
+           timeout: The maximum number of seconds to wait.
+        """
+
+        # no point in going to sleep if a request could be dispatched straight away
+        if len(self.prlist) > 0:
+            busyc = [c for [r, c] in self.jobs]
+            for c in self.clients:
+                if c.status & (Status.Ready | Status.NeedsInit) and not c in busyc and not c in self._held:
+                    return
+
+        # wakes up in time to hedge a request that is about to become a straggler
+        if self._hedge_deadline is not None:
+            timeout = max(0.0, min(timeout, self._hedge_deadline - time.time()))
+
+        # clients that have been disconnected stay in the list until the next pool_update
+        rlist = [self.server, self._wake[0]] + [c for c in self.clients if c.waitstatus and c.status & Status.Up]
+        try:
+            readable, writable, errored = select.select(rlist, [], [], timeout)
+        except select.error:
+            # typically interrupted by a signal: just get back to the loop
+            return
+
+        if self._wake[0] in readable:
+            try:
+                while os.read(self._wake[0], 4096):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        if self.server in readable:
+            self.poll_iter = UPDATEFREQ   # a client is knocking, look for it at the next poll
+
     def pool_update(self):
         """Deals with keeping the pool of client drivers up-to-date during a
         force calculation step.
@@ -508,13 +915,17 @@ class InterfaceSocket(object):
                     pass
                 c.status = Status.Disconnected
                 self.clients.remove(c)
-                # requeue jobs that have been left hanging
+                self.ndropped += 1
+                # requeue jobs that have been left hanging, unless another client is working on them
                 for [k, j] in self.jobs[:]:
                     if j is c:
                         self.jobs = [w for w in self.jobs if not (w[0] is k and w[1] is j)]  # removes pair in a robust way
 
-                        k["status"] = "Queued"
-                        k["start"] = -1
+                        if not [w for w in self.jobs if w[0] is k]:
+                            self._hedged = [h for h in self._hedged if not h is k]
+                            if k["status"] == "Running":
+                                k["status"] = "Queued"
+                                k["start"] = -1
 
         if len(self.clients) == 0:
             searchtimeout = SERVERTIMEOUT
@@ -527,11 +938,17 @@ class InterfaceSocket(object):
             if self.server in readable:
                 client, address = self.server.accept()
                 client.settimeout(TIMEOUT)
-                driver = Driver(client)
+                if self.mode == "shm":
+                    driver = Driver(client, shmprefix="ipi_" + self.address + "_")
+                else:
+                    driver = Driver(client)
                 info(" @SOCKET:   Client asked for connection from " + str(address) + ". Now hand-shaking.", verbosity.low)
                 driver.poll()
                 if (driver.status | Status.Up):
                     self.clients.append(driver)
+                    self.nconnected += 1
+                    if self.nreconnected < self.ndropped:
+                        self.nreconnected += 1
                     info(" @SOCKET:   Handshaking was successful. Added to the client list.", verbosity.low)
                     self.poll_iter = UPDATEFREQ   # if a new client was found, will try again harder next time
                     searchtimeout = SERVERTIMEOUT
@@ -542,6 +959,111 @@ class InterfaceSocket(object):
             else:
                 keepsearch = False
 
+    def schedule(self, freec):
+        """Decides how many of the pending requests each free client should get.
+
+        Simulates the assignment of the pending requests, in order, to the
+        client that would finish each of them first, based on the estimated
+        service time of the clients and on the time left to the busy ones to
+        complete their jobs. Requests go to the client that computed the same
+        replica at the previous step if that delays them by less than
+        AFFINITYSLACK. Slow clients are left idle if faster ones would be
+        done sooner, even if they are busy right now.
+
+        Args:
+           freec: The list of clients that have no job running.
+
+        Returns:
+           A dictionary giving the number of requests for each free client,
+           or None if the service time of the clients is not known yet.
+        """
+
+        known = [c.servicetime for c in self.clients if c.servicetime is not None]
+        if len(known) == 0:
+            return None
+        # clients that have never been timed are assumed to be fast, so that they get some work
+        fastest = min(known)
+
+        now = time.time()
+        avail = {}
+        for c in self.clients:
+            if not (c.status & Status.Up):
+                continue
+            st = fastest if c.servicetime is None else c.servicetime
+            cjobs = [r for [r, c2] in self.jobs if c2 is c]
+            if len(cjobs) > 0:
+                remaining = cjobs[0]["t_dispatched"] + st * len(cjobs) - now
+                # a client that is late is assumed to need as much again as it is overdue
+                avail[c] = abs(remaining)
+            elif c in freec:
+                avail[c] = 0.0
+
+        quota = dict((c, 0) for c in freec)
+        for r in self.prlist:
+            best = None
+            affinity = None
+            for c, t in avail.items():
+                st = fastest if c.servicetime is None else c.servicetime
+                if best is None or t + st < best[1]:
+                    best = (c, t + st)
+                if c.lastreq is r["id"]:
+                    affinity = (c, t + st)
+            if best is None:
+                break
+            if affinity is not None and affinity[1] <= best[1] * (1.0 + AFFINITYSLACK):
+                best = affinity
+            avail[best[0]] = best[1]
+            if best[0] in quota:
+                quota[best[0]] += 1
+
+        return quota
+
+    def hedge_stragglers(self, freec):
+        """Sends a copy of the straggling requests to idle clients.
+
+        Only acts when no request is waiting for a client, so that hedging
+        never delays regular work. A request is straggling when it has been
+        running for longer than the hedge percentile of the latencies of
+        the recent requests. Each request is only duplicated once, on the
+        idle client that is expected to be fastest.
+
+        Args:
+           freec: The list of clients that have no job running.
+        """
+
+        self._hedge_deadline = None
+        if len(self._latencies) < HEDGEMINSAMPLES or [r for r in self.requests if r["status"] == "Queued"]:
+            return
+
+        threshold = np.percentile(self._latencies, self.hedge)
+        idle = [c for c in freec if c.status & Status.Up and c.status & (Status.Ready | Status.NeedsInit)]
+        for [r, c] in self.jobs[:]:
+            if r["status"] != "Running" or [h for h in self._hedged if h is r]:
+                continue
+            deadline = r["t_dispatched"] + threshold
+            if time.time() < deadline:
+                if self._hedge_deadline is None or deadline < self._hedge_deadline:
+                    self._hedge_deadline = deadline
+                continue
+            if len(idle) == 0:
+                continue
+
+            # clients that have never been timed go last
+            fc = min(idle, key=lambda k: np.inf if k.servicetime is None else k.servicetime)
+            info(" @SOCKET: %s Request id %4s has been running for %f sec. Sending a copy to client %s" % (time.strftime("%y/%m/%d-%H:%M:%S"), str(r["id"]), time.time() - r["t_dispatched"], str(fc.peername)), verbosity.medium)
+            if fc.status & Status.NeedsInit:
+                fc.initialize(r["id"], r["pars"])
+                fc.poll()
+                while fc.status & Status.Busy:
+                    fc.poll()
+            if fc.status & Status.Ready:
+                fc.sendpos(r["pos"][r["active"]], r["cell"], r["id"], r.get("hints"))
+                fc.status = Status.Up | Status.Busy
+                self.jobs.append([r, fc])
+                self._hedged.append(r)
+            idle.remove(fc)
+            freec.remove(fc)
+
     def pool_distribute(self):
         """Deals with keeping the list of jobs up-to-date during a force
         calculation step.
@@ -549,25 +1071,34 @@ class InterfaceSocket(object):
         Deals with maintaining the jobs list. Gets data from drivers that have
         finished their calculation and removes that job from the list of running
         jobs, adds jobs to free clients and initialises the forcefields of new
-        clients.
+        clients. Requests with a higher priority are sent first.
+
+        Returns:
+           The number of requests that have been completed.
         """
 
+        ndone = 0
+
         # get clients that are still free
-        freec = self.clients[:]
-        for [r2, c] in self.jobs:
-            freec.remove(c)
+        busyc = [c for [r2, c] in self.jobs]
+        freec = [c for c in self.clients if not c in busyc]
 
-        # fills up list of pending requests if empty
-        if len(self.prlist) == 0:
-            self.prlist = [r for r in self.requests if r["status"] == "Queued"]
+        # the pending requests, with the most urgent first and otherwise in the order they were queued.
+        # the list is rebuilt every time, so that urgent requests do not wait for the older ones to be sent
+        self.prlist = sorted([r for r in self.requests if r["status"] == "Queued"], key=lambda r: -r.get("priority", 0))
 
         npend = len(self.prlist)
         ncli = len(self.clients)
-        if self.match_mode == "auto":
+        if self.match_mode == "auto" or self.match_mode == "throughput":
             match_seq = ["match", "none", "free", "any"]
         elif self.match_mode == "any":
             match_seq = ["any"]
 
+        quota = None
+        self._held = []
+        if self.match_mode == "throughput" and len(freec) > 0 and len(self.prlist) > 0:
+            quota = self.schedule(freec)
+
         # first: dispatches jobs to free clients (if any!)
         # tries first to match previous replica<>driver association, then to get new clients, and only finally send the a new replica to old drivers
         if len(freec) > 0 and len(self.prlist) > 0:
@@ -582,9 +1113,12 @@ class InterfaceSocket(object):
                     if not (fc.status & (Status.Ready | Status.NeedsInit | Status.Busy)):
                         warning(" @SOCKET: Client " + str(fc.peername) + " is in an unexpected status " + str(fc.status) + " at (1). Will try to keep calm and carry on.", verbosity.low)
                         continue
+                    if quota is not None and quota.get(fc, 0) == 0:
+                        continue
 
                     for r in self.prlist[:]:
-                        if match_ids == "match" and not fc.lastreq is r["id"]:
+                        # a client only gets back its previous replica if nothing more urgent is pending
+                        if match_ids == "match" and (not fc.lastreq is r["id"] or r.get("priority", 0) < self.prlist[0].get("priority", 0)):
                             continue
                         elif match_ids == "none" and not fc.lastreq is None:
                             continue
@@ -600,43 +1134,70 @@ class InterfaceSocket(object):
                             while fc.status & Status.Busy:  # waits for initialization to finish. hopefully this is fast
                                 fc.poll()
                         if fc.status & Status.Ready:
-                            fc.sendpos(r["pos"][r["active"]], r["cell"])
-                            r["status"] = "Running"
-                            r["t_dispatched"] = time.time()
-                            r["start"] = time.time()  # sets start time for the request
+                            # clients that accept batches get a fair share of the pending requests
+                            batch = [r]
+                            if fc.maxbatch > 1:
+                                if quota is not None:
+                                    nbatch = min(fc.maxbatch, quota[fc])
+                                else:
+                                    nbatch = min(fc.maxbatch, (len(self.prlist) + len(freec) - 1) / len(freec))
+                                batch += [r2 for r2 in self.prlist if not r2 is r][:nbatch - 1]
+                            if len(batch) > 1:
+                                fc.sendposbatch([(b["pos"][b["active"]], b["cell"]) for b in batch])
+                            else:
+                                fc.sendpos(r["pos"][r["active"]], r["cell"], r["id"], r.get("hints"))
+                            for b in batch:
+                                b["status"] = "Running"
+                                b["t_io"], b["nbytes"] = fc.sendcost
+                                b["t_dispatched"] = time.time()
+                                b["start"] = time.time()  # sets start time for the request
+                                self.jobs.append([b, fc])
+                                # removes b from the list of pending jobs
+                                self.prlist.remove(b)
                             # fc.poll()
                             fc.status = Status.Up | Status.Busy   # we know that the client is busy at this stage!
-                            self.jobs.append([r, fc])
                             fc.locked = (fc.lastreq is r["id"])
                             freec.remove(fc)
-                            # removes r from the list of pending jobs
-                            self.prlist.remove(r)
                             break
                         else:
                             warning(" @SOCKET: Client " + str(fc.peername) + " is in an unexpected status " + str(fc.status) + " at (2). Will try to keep calm and carry on.", verbosity.low)
+            if quota is not None:
+                self._held = freec[:]
+
+        # then: if nothing is waiting, gets idle clients to duplicate straggling requests
+        if self.hedge > 0 and len(self.prlist) == 0:
+            self.hedge_stragglers(freec)
 
         # force a pool_update if there are requests pending
         # if len(pendr)>0:
         #   self.poll_iter = UPDATEFREQ
-        # now check for client status
+        # now check for client status. busy clients are only asked for their
+        # status, and read from once they have replied, so we never block here
+        pollc = []
         for c in self.clients:
             if c.status == Status.Disconnected:  # client disconnected. force a pool_update
                 self.poll_iter = UPDATEFREQ
-                return
+                return ndone
             if not c.status & (Status.Ready | Status.NeedsInit):
+                if c.querystatus():
+                    pollc.append(c)
+                else:
+                    c.status = Status.Disconnected
+        if len(pollc) > 0:
+            try:
+                readable, writable, errored = select.select(pollc, [], [], 0)
+            except select.error:
+                readable = []
+            for c in readable:
                 c.poll()
 
         # check for finished jobs
         for [r, c] in self.jobs[:]:
             if c.status & Status.HasData:
                 try:
-                    r["result"] = c.getforce()
-                    if len(r["result"][1]) != len(r["pos"][r["active"]]):
+                    result = c.getforce()
+                    if len(result[1]) != len(r["active"]):
                         raise InvalidSize
-                    # If only a piece of the system is active, resize forces and reassign
-                    rftemp = r["result"][1]
-                    r["result"][1] = np.zeros(len(r["pos"]), dtype=np.float64)
-                    r["result"][1][r["active"]] = rftemp
                 except Disconnected:
                     c.status = Status.Disconnected
                     continue
@@ -649,28 +1210,59 @@ class InterfaceSocket(object):
                     c.status = Status.Disconnected
                     continue
 
-                c.poll()
-                while c.status & Status.Busy:  # waits, but check if we got stuck.
-                    if self.timeout > 0 and r["start"] > 0 and time.time() - r["start"] > self.timeout:
-                        warning(" @SOCKET:  Timeout! HASDATA for bead " + str(r["id"]) + " has been running for " + str(time.time() - r["start"]) + " sec.", verbosity.low)
-                        warning(" @SOCKET:   Client " + str(c.peername) + " died or got unresponsive(A). Disconnecting.", verbosity.low)
-                        try:
-                            c.shutdown(socket.SHUT_RDWR)
-                        except socket.error:
-                            pass
-                        c.close()
-                        c.status = Status.Disconnected
-                        continue
+                if len(c.results) == 0:  # otherwise there are more results of a batch to collect
                     c.poll()
-                if not (c.status & Status.Up):
-                    warning(" @SOCKET:   Client died a horrible death while getting forces. Will try to cleanup.", verbosity.low)
+                    while c.status & Status.Busy:  # waits, but check if we got stuck.
+                        if self.timeout > 0 and r["start"] > 0 and time.time() - r["start"] > self.timeout:
+                            warning(" @SOCKET:  Timeout! HASDATA for bead " + str(r["id"]) + " has been running for " + str(time.time() - r["start"]) + " sec.", verbosity.low)
+                            warning(" @SOCKET:   Client " + str(c.peername) + " died or got unresponsive(A). Disconnecting.", verbosity.low)
+                            try:
+                                c.shutdown(socket.SHUT_RDWR)
+                            except socket.error:
+                                pass
+                            c.close()
+                            c.status = Status.Disconnected
+                            continue
+                        c.poll()
+                    if not (c.status & Status.Up):
+                        warning(" @SOCKET:   Client died a horrible death while getting forces. Will try to cleanup.", verbosity.low)
+                        continue
+                self.jobs = [w for w in self.jobs if not (w[0] is r and w[1] is c)]  # removes pair in a robust way
+                hedged = [h for h in self._hedged if h is r]
+                if hedged and not [w for w in self.jobs if w[0] is r]:
+                    self._hedged = [h for h in self._hedged if not h is r]
+                if r["status"] == "Done":
+                    # another copy of a hedged request got here first
+                    info(" @SOCKET: Discarding late result for request id %4s from client %s" % (str(r["id"]), str(c.peername)), verbosity.medium)
                     continue
+
+                # scatters the forces straight into the storage that comes with the request, if any.
+                # if only a piece of the system is active, the other atoms get zero forces
+                if r.get("output") is not None:
+                    rf, rvir = r["output"]
+                else:
+                    rf, rvir = np.zeros(len(r["pos"]), np.float64), np.zeros((3, 3), np.float64)
+                if len(r["active"]) == len(rf):
+                    rf[:] = result[1]
+                else:
+                    rf[:] = 0.0
+                    rf[r["active"]] = result[1]
+                rvir[:] = result[2]
+                r["result"] = [result[0], rf, rvir, result[3]]
+                r["t_io"] += c.recvcost[0]
+                r["nbytes"] += c.recvcost[1]
                 r["status"] = "Done"
                 r["t_finished"] = time.time()
+                # the latency of hedged requests does not tell how fast the client that won is
+                if not hedged:
+                    self._latencies.append(r["t_finished"] - r["t_dispatched"])
+                    if len(c.results) == 0:
+                        c.update_servicetime(r["t_finished"] - r["t_dispatched"])
+                ndone += 1
                 c.lastreq = r["id"]  # saves the ID of the request that the client has just processed
-                self.jobs = [w for w in self.jobs if not (w[0] is r and w[1] is c)]  # removes pair in a robust way
 
-            if self.timeout > 0 and c.status != Status.Disconnected and r["start"] > 0 and time.time() - r["start"] > self.timeout:
+            # the late copies of hedged requests are left to finish, rather than being timed out
+            if self.timeout > 0 and c.status != Status.Disconnected and r["status"] != "Done" and r["start"] > 0 and time.time() - r["start"] > self.timeout:
                 warning(" @SOCKET:  Timeout! Request for bead " + str(r["id"]) + " has been running for " + str(time.time() - r["start"]) + " sec.", verbosity.low)
                 warning(" @SOCKET:   Client " + str(c.peername) + " died or got unresponsive(B). Disconnecting.", verbosity.low)
                 try:
@@ -682,12 +1274,62 @@ class InterfaceSocket(object):
                 c.poll()
                 c.status = Status.Disconnected
 
+        return ndone
+
+    def idle_clients(self):
+        """Returns the connected clients that are not working on any request."""
+
+        busyc = [c for [r, c] in self.jobs]
+        return [c for c in self.clients if c.status & Status.Up and c.status & (Status.Ready | Status.NeedsInit) and not c in busyc]
+
+    def retire(self, client):
+        """Sends an exit message to an idle client and removes it from the list.
+
+        Unlike the clients that die, retired clients are not counted as
+        dropped.
+
+        Args:
+           client: The Driver object of the client, which must not be working
+              on any request.
+        """
+
+        info(" @SOCKET:   Retiring client " + str(client.peername) + ".", verbosity.low)
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+            client.close()
+        except socket.error:
+            pass
+        client.status = Status.Disconnected
+        self.clients.remove(client)
+        if client in self._held:
+            self._held.remove(client)
+
+    def get_stats(self):
+        """Returns a summary of the activity of the clients.
+
+        Returns:
+           A dictionary with the number of clients that have connected, been
+           dropped and reconnected, and a list with the number of
+           configurations served, the utilisation, the service time and the
+           bytes moved for each of the connected clients.
+        """
+
+        clients = []
+        for c in self.clients:
+            clients.append({"peer": str(c.peername), "served": c.nserved, "utilisation": c.utilisation(),
+                            "servicetime": c.servicetime, "bytes": c.nbytes})
+        return {"connected": self.nconnected, "dropped": self.ndropped,
+                "reconnected": self.nreconnected, "clients": clients}
+
     def poll(self):
         """The main thread loop.
 
         Runs until either the program finishes or a kill call is sent. Updates
         the pool of clients every UPDATEFREQ loops and loops every latency
         seconds until _poll_true becomes false.
+
+        Returns:
+           The number of requests that have been completed.
         """
 
         # makes sure to remove the last dead client as soon as possible -- and to get clients if we are dry
@@ -696,4 +1338,10 @@ class InterfaceSocket(object):
             self.pool_update()
 
         self.poll_iter += 1
-        self.pool_distribute()
+        ndone = self.pool_distribute()
+
+        if self.drivers is not None:
+            # one driver per request that is running or waiting for a client
+            self.drivers.update(len(self.prlist) + len(set(c for [r, c] in self.jobs)))
+
+        return ndone
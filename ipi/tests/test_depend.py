@@ -63,3 +63,207 @@ def test_readonly():
     """Depend: read-only flag"""
     atoms = ipi.engine.atoms.Atoms(2)
     atoms.q = np.zeros(2 * 3)
+
+
+def _network():
+    """Builds a pair of synchronized values, with a chain of values below them."""
+    sync = dp.synchronizer()
+    x = dp.depend_value(name="x", value=1.0, synchro=sync, func={"y": (lambda: y.get() * 2.0)})
+    y = dp.depend_value(name="y", value=0.5, synchro=sync, func={"x": (lambda: x.get() / 2.0)})
+    chain = [y]
+    for i in range(dp.MINCLOSURE + 2):
+        chain.append(dp.depend_value(name="c%d" % i, func=(lambda c=chain[-1]: c.get() + 1.0), dependencies=[chain[-1]]))
+    return x, y, chain
+
+
+def test_frozen_graph():
+    """Depend: a frozen graph gives the same values as the recursive tainting"""
+    values = []
+    for frozen in [False, True]:
+        x, y, chain = _network()
+        if frozen:
+            graph = dp.depend_graph([x])
+        y.set(4.0)
+        res = [x.get()] + [c.get() for c in chain]
+        x.set(2.0)
+        res += [x.get()] + [c.get() for c in chain]
+        chain[3].hold()
+        x.set(3.0)
+        chain[3].resume()
+        res += [x.get()] + [c.get() for c in chain]
+        values.append(res)
+    assert values[0] == values[1]
+    assert graph.nfast > 0
+
+
+def test_frozen_thaw():
+    """Depend: adding a dependency thaws a frozen graph"""
+    x, y, chain = _network()
+    graph = dp.depend_graph([x])
+    assert len(graph.flags) == len(chain) + 1
+    z = dp.depend_value(name="z", func=(lambda: y.get() * 3.0), dependencies=[y])
+    assert id(y._tainted) not in dp._frozen
+    z.get()
+    x.set(4.0)
+    assert z.get() == 6.0
+    assert chain[-1].get() == 2.0 + len(chain) - 1
+
+
+def test_profiler():
+    """Depend: the profiler counts the taints and the recalculations"""
+    x, y, chain = _network()
+    chain[-1].get()
+    prof = dp.depend_profiler()
+    prof.start()
+    try:
+        for i in range(3):
+            x.set(float(i))
+            chain[-1].get()
+        chain[-1].get()
+    finally:
+        prof.stop()
+    assert dp._profiler is None
+    label = prof._label(chain[-1])
+    assert prof.computes[label] == 3
+    assert prof.taints[label] == 3
+    assert label in prof.report()
+    assert "test_depend.py" in prof.callers[label].most_common(1)[0][0]
+
+
+def test_profiler_signal(tmpdir):
+    """Depend: SIGUSR1 during an update of the profiler defers the report"""
+    x, y, chain = _network()
+    chain[-1].get()
+    filename = str(tmpdir.join("depend.prof"))
+    prof = dp.depend_profiler(filename)
+    prof.start()
+    try:
+        with prof._lock:
+            prof._signal_handler(None, None)
+        assert not tmpdir.join("depend.prof").check()
+        x.set(1.0)
+    finally:
+        prof.stop()
+    assert not prof._pending
+    assert "self_time" in tmpdir.join("depend.prof").read()
+
+
+def test_dbatch():
+    """Depend: a dbatch defers the taints until it exits, or a dependant is read"""
+    x, y, chain = _network()
+    chain[-1].get()
+    with dp.dbatch():
+        x.set(2.0)
+        x.set(3.0)
+        assert not chain[-1]._tainted[0]
+        assert chain[-1].get() == 1.5 + len(chain) - 1
+        x.set(4.0)
+    assert chain[-1]._tainted[0]
+    assert chain[-1].get() == 2.0 + len(chain) - 1
+    assert dp._nbatch == 0
+
+
+def test_dfetch():
+    """Depend: the prefetchable dependencies are recomputed concurrently"""
+    import threading
+    root = dp.depend_value(name="root", value=1.0)
+    threads = []
+
+    running = []
+    overlap = threading.Event()
+
+    def slow(k):
+        threads.append(threading.currentThread())
+        running.append(k)
+        if len(running) > 1:
+            overlap.set()
+        # waits for another branch to start, which only happens if they run concurrently
+        overlap.wait(5.0)
+        running.remove(k)
+        return root.get() * k
+
+    branches = [dp.depend_value(name="b%d" % k, func=(lambda k=k: slow(k)), dependencies=[root]) for k in range(4)]
+    total = dp.depend_value(name="total", func=(lambda: sum(b.get() for b in branches)),
+                            dependencies=branches, prefetch=branches)
+    assert total.get() == 6.0
+    assert overlap.is_set()
+    assert len(set(threads)) > 1
+    assert threading.currentThread() not in threads
+    root.set(2.0)
+    assert total.get() == 12.0
+
+
+FETCHER = """
+import sys
+import signal
+import threading
+sys.path.insert(0, %r)
+import ipi.utils.depend as dp
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(3))
+never = threading.Event()
+branches = [dp.depend_value(name="b%%d" %% k, func=(lambda: never.wait() or 0.0)) for k in range(2)]
+total = dp.depend_value(name="total", func=(lambda: 0.0), dependencies=branches, prefetch=branches)
+print "waiting"
+sys.stdout.flush()
+total.get()
+"""
+
+
+def test_dfetch_signals():
+    """Depend: the signal handlers run while waiting for the prefetched dependencies"""
+    import os
+    import sys
+    import subprocess
+    import time
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    proc = subprocess.Popen([sys.executable, "-c", FETCHER % root], stdout=subprocess.PIPE)
+    try:
+        assert proc.stdout.readline().strip() == "waiting"
+        time.sleep(0.2)
+        proc.terminate()
+        tmax = time.time() + 10.0
+        while proc.poll() is None and time.time() < tmax:
+            time.sleep(0.05)
+        assert proc.returncode == 3
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def test_dfetch_function():
+    """Depend: the prefetchable dependencies can be chosen when self is recomputed"""
+    import threading
+    root = dp.depend_value(name="root", value=1.0)
+    threads = {}
+
+    def branch(k):
+        threads[k] = threading.currentThread()
+        return root.get() * k
+
+    branches = [dp.depend_value(name="b%d" % k, func=(lambda k=k: branch(k)), dependencies=[root]) for k in range(3)]
+    skip = [0]
+    total = dp.depend_value(name="total", func=(lambda: sum(b.get() for b in branches)),
+                            dependencies=branches, prefetch=(lambda: [b for k, b in enumerate(branches) if k != skip[0]]))
+    assert total.get() == 3.0
+    assert threads[0] is threading.currentThread()
+    assert threads[1] is not threading.currentThread() and threads[2] is not threading.currentThread()
+    skip[0] = 2
+    root.set(2.0)
+    assert total.get() == 6.0
+    assert threads[2] is threading.currentThread()
+
+
+def test_dview():
+    """Depend: dview gives an up-to-date, read-only plain array"""
+    x = dp.depend_array(name="x", value=np.ones(3, float))
+    y = dp.depend_array(name="y", value=np.zeros(3, float), func=(lambda: 2.0 * dp.dstrip(x)), dependencies=[x])
+    x[1] = 3.0
+    v = dp.dview(y)
+    assert type(v) is np.ndarray
+    assert (v == [2.0, 6.0, 2.0]).all()
+    try:
+        v[0] = 0.0
+        assert False
+    except ValueError:
+        pass
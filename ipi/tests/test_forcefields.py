@@ -0,0 +1,586 @@
+"""Deals with testing the in-process forcefields and the request machinery."""
+
+# This file is part of i-PI.
+# i-PI Copyright (C) 2014-2015 i-PI developers
+# See the "licenses" directory for full license information.
+
+
+import os
+import sys
+import shutil
+import subprocess
+import itertools
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from ipi.engine.atoms import Atoms
+from ipi.engine.cell import Cell
+from ipi.engine.forcefields import ForceField, ForceCache, ForceDatabase, FFLennardJones, FFQTIP4PF, FFDebye, FFProcessPool
+from ipi.engine.forcefields import sparse
+from ipi.engine.forces import ForceBead
+import ipi.engine.forcefields as forcefields
+import ipi.inputs.forcefields
+from ipi.inputs.forcefields import InputFFDebye, InputFFPlumed, read_hessian
+from ipi.utils.depend import dstrip
+from ipi.utils.io.inputs.io_xml import xml_parse_string
+
+
+def make_system(natoms=2):
+    """Returns an Atoms and a Cell object to build requests from."""
+
+    atoms = Atoms(natoms)
+    atoms.q = np.arange(3 * natoms, dtype=float)
+    cell = Cell(h=np.eye(3) * 10.0)
+    return atoms, cell
+
+
+def test_wait_request():
+    """ForceField: waiting for a request served by the polling thread."""
+
+    ff = ForceField(latency=100.0, name="dummy")
+    ff.run()
+    try:
+        atoms, cell = make_system()
+        r = ff.queue(atoms, cell)
+        # a long latency would make the test hang if we relied on sleeping
+        waiter = threading.Thread(target=ff.wait, args=(r,))
+        waiter.daemon = True
+        waiter.start()
+        waiter.join(10.0)
+        assert not waiter.isAlive()
+        assert r["status"] == "Done"
+        assert len(r["result"][1]) == 3 * atoms.natoms
+    finally:
+        ff.stop()
+
+
+def test_stop_wakes_waiters():
+    """ForceField: stopping the forcefield releases the waiting threads."""
+
+    ff = ForceField(latency=100.0, name="dummy")
+    atoms, cell = make_system()
+    # the polling thread is not running, so the request is never evaluated
+    r = ff.queue(atoms, cell)
+    waiter = threading.Thread(target=ff.wait, args=(r,))
+    waiter.daemon = True
+    waiter.start()
+    ff.stop()
+    waiter.join(10.0)
+    assert not waiter.isAlive()
+    assert r["status"] == "Exit"
+
+
+WAITER = """
+import sys
+import signal
+import numpy as np
+sys.path.insert(0, %r)
+from ipi.engine.atoms import Atoms
+from ipi.engine.cell import Cell
+from ipi.engine.forcefields import ForceField
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(3))
+atoms = Atoms(2)
+ff = ForceField(latency=0.1, name="dummy")
+r = ff.queue(atoms, Cell(h=np.eye(3) * 10.0))
+print "waiting"
+sys.stdout.flush()
+ff.wait(r)
+"""
+
+
+def test_wait_signals():
+    """ForceField: the signal handlers run while waiting for a request."""
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    proc = subprocess.Popen([sys.executable, "-c", WAITER % root], stdout=subprocess.PIPE)
+    try:
+        assert proc.stdout.readline().strip() == "waiting"
+        time.sleep(0.2)
+        proc.terminate()
+        tmax = time.time() + 10.0
+        while proc.poll() is None and time.time() < tmax:
+            time.sleep(0.05)
+        assert proc.returncode == 3
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def test_stats():
+    """ForceField: the timings of the released requests are recorded."""
+
+    ff = ForceField(latency=100.0, name="dummy")
+    ff.run()
+    try:
+        atoms, cell = make_system()
+        r = ff.queue(atoms, cell)
+        ff.wait(r)
+        assert ff.get_stats()["requests"] == 0
+        ff.release(r)
+        stats = ff.get_stats()
+    finally:
+        ff.stop()
+    assert stats["requests"] == 1
+    assert stats["wait"] >= 0.0 and stats["compute"] >= 0.0
+    assert stats["dispatch"] == 0.0 and stats["bytes"] == 0.0
+
+
+def lj_reference(q, h, eps, sigma, cutoff):
+    """Computes LJ energy, forces and virial summing explicitly over the periodic images."""
+
+    nat = len(q)
+    v, f, vir = 0.0, np.zeros((nat, 3)), np.zeros((3, 3))
+    for i in range(nat):
+        for j in range(nat):
+            for shift in itertools.product(range(-3, 4), repeat=3):
+                if i == j and not any(shift):
+                    continue
+                d = q[j] + np.dot(h, shift) - q[i]
+                r2 = (d**2).sum()
+                if r2 < cutoff**2:
+                    x6 = (sigma**2 / r2)**3
+                    v += 2.0 * eps * (x6**2 - x6)
+                    fij = d * 24.0 * eps * (2.0 * x6**2 - x6) / r2
+                    f[i] -= fij
+                    vir += 0.5 * np.outer(fij, d)
+    return v, f, vir
+
+
+def test_lj_pbc():
+    """ForceField: LJ forces with a cutoff in a triclinic periodic cell."""
+
+    h = np.array([[7.0, 1.0, 0.5], [0.0, 6.5, 1.2], [0.0, 0.0, 6.0]])
+    pars = {"eps": 0.1, "sigma": 2.0, "cutoff": 5.0, "skin": 0.5}
+    atoms = Atoms(10)
+    prng = np.random.RandomState(12345)
+    # a jittered lattice, so that no atoms are too close
+    grid = np.array(list(itertools.product(range(3), repeat=3)))[:10] / 3.0
+    atoms.q = np.dot(grid + prng.uniform(-0.03, 0.03, grid.shape), h.T).flatten()
+    cell = Cell(h=h)
+
+    ff = FFLennardJones(name="lj", pars=pars, dopbc=True)
+    ff.run()
+    try:
+        for step in range(3):
+            r = ff.queue(atoms, cell, reqid=0)
+            ff.wait(r)
+            v, f, vir = lj_reference(r["pos"].reshape((-1, 3)), h, 0.1, 2.0, 5.0)
+            assert np.allclose(r["result"][0], v)
+            assert np.allclose(r["result"][1], f.flatten())
+            assert np.allclose(r["result"][2], vir)
+            ff.release(r)
+            # small moves reuse the list, and atoms leaving the box are wrapped back
+            atoms.q += 0.05
+        assert ff.nlists[0].nbuild == 1
+    finally:
+        ff.stop()
+
+
+# four water molecules, two of which are split across the cell boundaries, and the
+# energy and forces computed for them by the qtip4pf potential of the Fortran driver
+WATER_POS = np.array([[1.00, 2.00, 3.00], [2.75, 2.20, 2.80], [0.50, 3.60, 3.30],
+                      [6.50, 1.00, 34.50], [7.10, -0.60, 35.20], [5.20, 0.60, 33.40],
+                      [3.00, 7.20, 1.50], [3.40, 8.60, 0.40], [4.10, 7.30, 2.90],
+                      [33.80, 4.50, 5.00], [35.20, 5.60, 5.40], [32.70, 5.50, 4.00]])
+WATER_POT = 2.6103625308342340e-02
+WATER_FORCES = np.array([[7.9598367759666999e-02, -8.7038826391785007e-02, -4.1278206101240514e-02],
+                         [4.3299551020245363e-03, -4.6816152945531667e-03, -5.7379575866742883e-03],
+                         [-3.4445305090755017e-02, 4.0020597927516673e-02, 8.4556480436688754e-03],
+                         [2.4603593592339379e-02, -2.4438412185914457e-02, 2.4494969966022070e-02],
+                         [-1.0060148247426770e-02, 2.7559404916790552e-02, -1.1868969680896983e-02],
+                         [-1.4928279470405086e-02, -2.8328189232369595e-03, -1.1144888576943230e-02],
+                         [1.9527561993584307e-03, 1.7466296131447252e-02, -6.5639990390771400e-03],
+                         [-4.0414725245965320e-03, -1.7300235515171576e-02, 1.1980086677018772e-02],
+                         [2.4284087070879689e-03, 1.2152815082056988e-03, -2.5980080065516687e-03],
+                         [-3.1724825581817440e-02, 6.7811638292048088e-02, 3.1021227067779475e-02],
+                         [-1.8759112778856606e-02, -1.1484294408502084e-02, 1.6739438423167071e-03],
+                         [1.0460623333800999e-03, -6.2970160568450190e-03, 1.5661533945779279e-03]])
+
+
+def test_qtip4pf():
+    """ForceField: q-TIP4P/F water agrees with the Fortran driver, for all the beads at once."""
+
+    atoms = Atoms(12)
+    cell = Cell(h=np.eye(3) * 36.0)
+    ff = FFQTIP4PF(name="water")
+    batches = []
+    evaluate_batch = ff.evaluate_batch
+    ff.evaluate_batch = lambda requests: batches.append(len(requests)) or evaluate_batch(requests)
+
+    requests = []
+    # rigid translations do not change the energy, and the atoms are wrapped in the cell
+    for b, shift in enumerate([0.0, 5.0, -20.0]):
+        atoms.q = (WATER_POS + shift).flatten()
+        requests.append(ff.queue(atoms, cell, reqid=b))
+    ff.run()
+    try:
+        for r in requests:
+            ff.wait(r)
+            assert np.allclose(r["result"][0], WATER_POT, rtol=0.0, atol=1e-10)
+            assert np.allclose(r["result"][1], WATER_FORCES.flatten(), rtol=0.0, atol=1e-10)
+            ff.release(r)
+    finally:
+        ff.stop()
+    assert batches == [3]
+
+
+def test_qtip4pf_triclinic(monkeypatch):
+    """ForceField: q-TIP4P/F forces and virial in a small triclinic cell match finite differences."""
+
+    h = np.array([[13.0, 2.0, -1.0], [0.0, 12.5, 1.5], [0.0, 0.0, 14.0]])
+    q = WATER_POS.copy()
+    q[3:6, 2] -= 22.0
+    q[9:, 0] -= 24.0
+    # the parameters of the Ewald sum must not change as the cell is strained
+    monkeypatch.setattr(forcefields, "ewald_parameters", lambda h, nsites: (6.0, 0.5, 3.5))
+    ff = FFQTIP4PF(name="water")
+
+    def evaluate(q, h):
+        return ff.evaluate_cell([{"pos": q.flatten(), "cell": (h, np.linalg.inv(h)), "id": 0}])
+
+    pot, f, vir = evaluate(q, h)
+    delta = 1e-5
+    for i, k in [(0, 0), (4, 1), (11, 2)]:
+        dq = np.zeros(q.shape)
+        dq[i, k] = delta
+        fd = (evaluate(q - dq, h)[0] - evaluate(q + dq, h)[0]) / (2 * delta)
+        assert abs(f[0, 3 * i + k] - fd) < 1e-6
+    # shear strains do not change the volume, nor the long-range correction to the pressure
+    for k, l in [(0, 1), (2, 0), (1, 2)]:
+        strain = np.zeros((3, 3))
+        strain[k, l] = delta
+        fd = (evaluate(np.dot(q, (np.eye(3) - strain).T), np.dot(np.eye(3) - strain, h))[0] -
+              evaluate(np.dot(q, (np.eye(3) + strain).T), np.dot(np.eye(3) + strain, h))[0]) / (2 * delta)
+        assert abs(vir[0, k, l] - fd) < 1e-6
+
+
+def test_batch():
+    """ForceField: all the queued beads are evaluated in a single batch."""
+
+    natoms, nbeads = 3, 4
+    prng = np.random.RandomState(12345)
+    hessian = prng.uniform(-1.0, 1.0, (3 * natoms, 3 * natoms))
+    hessian = np.dot(hessian, hessian.T)
+    xref = prng.uniform(-1.0, 1.0, 3 * natoms)
+    ff = FFDebye(name="debye", H=hessian, xref=xref, vref=0.5)
+
+    batches = []
+    evaluate_batch = ff.evaluate_batch
+    ff.evaluate_batch = lambda requests: batches.append(len(requests)) or evaluate_batch(requests)
+
+    atoms, cell = make_system(natoms)
+    requests = []
+    for b in range(nbeads):
+        atoms.q = prng.uniform(-1.0, 1.0, 3 * natoms)
+        requests.append(ff.queue(atoms, cell, reqid=b))
+    ff.run()
+    try:
+        for r in requests:
+            ff.wait(r)
+            ff.release(r)
+    finally:
+        ff.stop()
+    assert batches == [nbeads]
+    for r in requests:
+        d = r["pos"] - xref
+        assert r["status"] == "Done"
+        assert np.allclose(r["result"][0], 0.5 + 0.5 * np.dot(d, np.dot(hessian, d)))
+        assert np.allclose(r["result"][1], -np.dot(hessian, d))
+
+
+def test_inline():
+    """ForceField: without a polling thread, requests are evaluated by the waiting thread."""
+
+    ff = ForceField(latency=100.0, name="dummy", threaded=False)
+    threads = []
+    evaluate = ff.evaluate
+    ff.evaluate = lambda r: threads.append(threading.currentThread()) or evaluate(r)
+    ff.run()
+    try:
+        assert ff._thread is None
+        atoms, cell = make_system()
+        requests = [ff.queue(atoms, cell, reqid=b) for b in range(3)]
+        assert all(r["status"] == "Queued" for r in requests)
+        ff.wait(requests[0])
+        # the other queued requests are evaluated together with the first one
+        assert all(r["status"] == "Done" for r in requests)
+        assert threads == [threading.currentThread()] * 3
+    finally:
+        ff.stop()
+
+
+def test_hints():
+    """ForceField: the requests of a bead carry the positions of its previous configurations."""
+
+    ff = ForceField(latency=100.0, name="dummy", threaded=False)
+    ff.nhints = 2
+    hints = []
+    queue = ff.queue
+    ff.queue = lambda *args, **kwargs: hints.append(kwargs["hints"]) or queue(*args, **kwargs)
+    atoms, cell = make_system()
+    bead = ForceBead()
+    bead.bind(atoms, cell, ff)
+    ff.run()
+    try:
+        for step in range(4):
+            atoms.q = np.arange(6.0) + step
+            bead.pot
+    finally:
+        ff.stop()
+    assert [h[0] for h in hints] == range(4)
+    assert [len(h[2]) for h in hints] == [0, 1, 2, 2]
+    # the most recent configuration comes first
+    assert np.allclose(hints[3][1], np.arange(6.0) + 3)
+    assert np.allclose(hints[3][2][0], np.arange(6.0) + 2)
+    assert np.allclose(hints[3][2][1], np.arange(6.0) + 1)
+
+
+POTENTIAL = """
+import os
+import time
+
+def potential(pos, cell, k="1.0"):
+    time.sleep(0.2)
+    return 0.5 * float(k) * (pos**2).sum(), -float(k) * pos, cell, str(os.getpid())
+"""
+
+
+def test_process_pool():
+    """ForceField: a Python potential evaluated in parallel by worker processes."""
+
+    module = tempfile.NamedTemporaryFile(suffix=".py")
+    module.write(POTENTIAL)
+    module.flush()
+    ff = FFProcessPool(name="pool", module=module.name, nprocs=4, pars={"k": "2.0"})
+    ff.run()
+    try:
+        atoms, cell = make_system(3)
+        prng = np.random.RandomState(12345)
+        requests = []
+        for b in range(8):
+            atoms.q = prng.uniform(-1.0, 1.0, 3 * atoms.natoms)
+            requests.append(ff.queue(atoms, cell, reqid=b))
+        t0 = time.time()
+        for r in requests:
+            ff.wait(r)
+            ff.release(r)
+        # 8 beads taking 0.2 seconds each, on 4 workers
+        assert time.time() - t0 < 1.0
+    finally:
+        ff.stop()
+    for r in requests:
+        assert r["status"] == "Done"
+        assert np.allclose(r["result"][0], (r["pos"]**2).sum())
+        assert np.allclose(r["result"][1], -2.0 * r["pos"])
+        assert np.allclose(r["result"][2], dstrip(cell.h))
+    assert len(set(r["result"][3] for r in requests)) == 4
+    assert not ff.pool.workers
+
+
+def test_cache():
+    """ForceField: configurations that have already been computed are not dispatched."""
+
+    ff = ForceField(latency=100.0, name="dummy", dopbc=False)
+    ff.cache = ForceCache(2, tolerance=1e-6)
+    evaluated = []
+    evaluate = ff.evaluate
+    ff.evaluate = lambda r: evaluated.append(r["pos"].copy()) or evaluate(r)
+    ff.run()
+    try:
+        atoms, cell = make_system()
+
+        def compute(q):
+            atoms.q = q
+            r = ff.queue(atoms, cell)
+            ff.wait(r)
+            ff.release(r)
+            return r
+
+        q0 = atoms.q.copy()
+        compute(q0)
+        # within the tolerance, the result comes from the cache without being computed
+        r = compute(q0 + 1e-8)
+        assert r["status"] == "Done" and len(evaluated) == 1
+        assert np.allclose(r["result"][1], 0.0)
+        compute(q0 + 1.0)
+        compute(q0 + 2.0)
+        # the least recently used configuration has been evicted
+        compute(q0)
+        assert len(evaluated) == 4
+        stats = ff.get_stats()
+    finally:
+        ff.stop()
+    assert stats["cache_hits"] == 1 and stats["cache_misses"] == 4
+    assert stats["cache_size"] == 2
+
+
+def test_database():
+    """ForceField: results stored on disk are reused when the database is opened again."""
+
+    path = os.path.join(tempfile.mkdtemp(), "forces")
+    atoms, cell = make_system()
+    configs = [np.arange(6.0) * 0.1, np.arange(6.0) * 0.2]
+    qnew = np.arange(6.0) * 0.3
+
+    def run(extra):
+        ff = ForceField(latency=100.0, name="dummy", dopbc=False)
+        ff.database = ForceDatabase(path)
+        evaluated = []
+        ff.evaluate = lambda r: evaluated.append(r) or [1.0, -r["pos"], np.eye(3), extra]
+        ff.run()
+        try:
+            requests = []
+            for q in configs:
+                atoms.q = q
+                r = ff.queue(atoms, cell)
+                ff.wait(r)
+                ff.release(r)
+                requests.append(r)
+            stats = ff.get_stats()
+        finally:
+            ff.stop()
+        # stopping the forcefield closes the files
+        assert ff.database._data is None and ff.database._map is None
+        return requests, len(evaluated), stats
+
+    try:
+        requests, nevaluated, stats = run("first")
+        assert nevaluated == 2 and stats["db_misses"] == 2
+        # an index entry left incomplete by a crash is ignored
+        with open(path + ".idx", "a") as idx:
+            idx.write("0123 4096")
+        requests, nevaluated, stats = run("second")
+        assert nevaluated == 0 and stats["db_hits"] == 2 and stats["db_size"] == 2
+        for r, q in zip(requests, configs):
+            assert r["status"] == "Done"
+            assert r["result"][0] == 1.0 and r["result"][3] == "first"
+            assert np.allclose(r["result"][1], -q)
+            assert np.allclose(r["result"][2], np.eye(3))
+        # new results are appended to the existing ones
+        configs.append(qnew)
+        requests, nevaluated, stats = run("third")
+        assert nevaluated == 1 and stats["db_size"] == 3
+        requests, nevaluated, stats = run("fourth")
+        assert nevaluated == 0 and requests[2]["result"][3] == "third"
+    finally:
+        shutil.rmtree(os.path.dirname(path))
+
+
+def test_database_input(monkeypatch):
+    """InputForceField: the database of a forcefield is opened only once."""
+
+    opened = []
+    monkeypatch.setattr(ipi.inputs.forcefields, "ForceDatabase", lambda *args: opened.append(args) or ForceDatabase(*args))
+    path = os.path.join(tempfile.mkdtemp(), "forces")
+    try:
+        xml = xml_parse_string("<ffdebye name='debye'><hessian> [1.0] </hessian><x_reference> [0.0] </x_reference>"
+                               "<database> %s </database></ffdebye>" % path)
+        iff = InputFFDebye()
+        iff.parse(xml.fields[0][1])
+        ff = iff.fetch()
+        assert len(opened) == 1 and ff.database.path == path
+        ff.database.close()
+    finally:
+        shutil.rmtree(os.path.dirname(path))
+
+
+@pytest.mark.parametrize("options", ["<cache_size> 4 </cache_size>", "<database> forces </database>"])
+def test_plumed_cache(options):
+    """InputFFPlumed: history-dependent PLUMED biases are never cached."""
+
+    xml = xml_parse_string("<ffplumed name='plumed'> %s </ffplumed>" % options)
+    iff = InputFFPlumed()
+    iff.parse(xml.fields[0][1])
+    with pytest.raises(ValueError):
+        iff.fetch()
+
+
+def debye_forces(ff, configs):
+    """Returns the potentials and forces of a Debye crystal for a list of configurations."""
+
+    atoms, cell = make_system(len(configs[0]) / 3)
+    requests = []
+    for q in configs:
+        atoms.q = q
+        requests.append(ff.queue(atoms, cell))
+    ff.run()
+    try:
+        for r in requests:
+            ff.wait(r)
+            ff.release(r)
+    finally:
+        ff.stop()
+    return [r["result"][0] for r in requests], [r["result"][1] for r in requests]
+
+
+def test_debye_lowrank():
+    """ForceField: a Debye crystal with a low-rank plus diagonal Hessian read from file."""
+
+    prng = np.random.RandomState(12345)
+    diagonal, vectors, values = prng.uniform(1.0, 2.0, 12), prng.uniform(-1.0, 1.0, (12, 2)), np.array([0.5, -0.2])
+    xref = prng.uniform(-1.0, 1.0, 12)
+    configs = [prng.uniform(-1.0, 1.0, 12) for b in range(3)]
+
+    filename = tempfile.NamedTemporaryFile(suffix=".npz")
+    np.savez(filename, diagonal=diagonal, vectors=vectors, values=values)
+    filename.flush()
+    xml = xml_parse_string("<ffdebye name='debye'><hessian_file> %s </hessian_file><x_reference> %s </x_reference></ffdebye>" %
+                           (filename.name, list(xref)))
+    iff = InputFFDebye()
+    iff.parse(xml.fields[0][1])
+    lowrank = iff.fetch()
+    assert lowrank.H is None
+    dense = FFDebye(name="dense", H=np.diag(diagonal) + np.dot(vectors * values, vectors.T), xref=xref)
+
+    for vl, vd in zip(*[debye_forces(ff, configs)[0] for ff in [lowrank, dense]]):
+        assert np.allclose(vl, vd)
+    for fl, fd in zip(*[debye_forces(ff, configs)[1] for ff in [lowrank, dense]]):
+        assert np.allclose(fl, fd)
+
+
+@pytest.mark.skipif(sparse is None, reason="scipy is not available")
+def test_debye_sparse():
+    """ForceField: a Debye crystal with a sparse Hessian."""
+
+    prng = np.random.RandomState(12345)
+    hessian = np.diag(prng.uniform(1.0, 2.0, 12)) + np.diag(prng.uniform(-0.5, 0.5, 11), 1)
+    hessian += hessian.T
+    xref = prng.uniform(-1.0, 1.0, 12)
+    configs = [prng.uniform(-1.0, 1.0, 12) for b in range(3)]
+    ff = FFDebye(name="sparse", H=sparse.csr_matrix(hessian), xref=xref)
+    assert sparse.issparse(ff.H)
+    for v, f, q in zip(*(debye_forces(ff, configs) + (configs,))):
+        assert np.allclose(f, -np.dot(hessian, q - xref))
+        assert np.allclose(v, 0.5 * np.dot(q - xref, np.dot(hessian, q - xref)))
+
+
+@pytest.mark.skipif(sparse is None, reason="scipy is not available")
+def test_read_hessian_sparse():
+    """ForceField: sparse Hessians are read according to their format."""
+
+    prng = np.random.RandomState(12345)
+    # not symmetric, so that reading the transpose would be spotted
+    hessian = np.diag(prng.uniform(1.0, 2.0, 6)) + np.diag(prng.uniform(-0.5, 0.5, 5), 1)
+    for fmt in ["csr", "csc", "coo"]:
+        filename = tempfile.NamedTemporaryFile(suffix=".npz")
+        sparse.save_npz(filename, getattr(sparse, fmt + "_matrix")(hessian))
+        filename.flush()
+        H = read_hessian(filename.name)["H"]
+        assert sparse.isspmatrix_csr(H)
+        assert np.allclose(H.toarray(), hessian)
+
+
+def test_read_hessian_format():
+    """ForceField: sparse Hessians in an unsupported format are rejected."""
+
+    filename = tempfile.NamedTemporaryFile(suffix=".npz")
+    np.savez(filename, format=np.array("dia"), shape=np.array([6, 6]), data=np.ones((1, 6)), offsets=np.zeros(1, int))
+    filename.flush()
+    with pytest.raises(ValueError) as excinfo:
+        read_hessian(filename.name)
+    assert "dia" in str(excinfo.value)
@@ -0,0 +1,501 @@
+"""Deals with testing the socket interface against a python client."""
+
+# This file is part of i-PI.
+# i-PI Copyright (C) 2014-2015 i-PI developers
+# See the "licenses" directory for full license information.
+
+
+import os
+import sys
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from ipi.interfaces.sockets import InterfaceSocket, Status
+from ipi.interfaces.clients import Client, MultiClient
+from ipi.interfaces.drivers import DriverPool
+from ipi.engine.forcefields import ForceRequest
+from ipi.engine.forces import request_priority
+
+
+def harmonic(pos):
+    """Returns the forces and potential of a unit harmonic well."""
+
+    return -pos, np.array([0.5 * (pos**2).sum()])
+
+
+def harmonic_batch(pos):
+    """Returns the stacked forces and potentials of a batch of configurations."""
+
+    return -pos, 0.5 * (pos**2).sum(axis=-1).sum(axis=-1)
+
+
+def start_client(address, mode, natoms, callback=harmonic, **kwargs):
+    """Connects a python client to the interface and serves forces in a thread."""
+
+    client = Client(address=address, mode=mode, **kwargs)
+    client._positions = np.zeros((natoms, 3))
+    client._callback = callback
+    thread = threading.Thread(target=client.run, kwargs={"verbose": False, "fn_exit": None})
+    thread.daemon = True
+    thread.start()
+    return client
+
+
+def serve(interface, natoms, nreq, priorities=None):
+    """Queues nreq requests and polls the interface until they are done.
+
+    Returns:
+       The list of requests.
+    """
+
+    h = np.eye(3) * 10.0
+    if priorities is None:
+        priorities = [0] * nreq
+    interface.requests = [ForceRequest({"id": i, "pos": np.arange(3.0 * natoms) + i, "active": np.arange(3 * natoms),
+                                        "cell": (h, np.linalg.inv(h)), "pars": "", "status": "Queued", "priority": priorities[i],
+                                        "start": -1, "result": None, "t_dispatched": 0, "t_finished": 0}) for i in range(nreq)]
+    tmax = time.time() + 10.0
+    while any(r["status"] != "Done" for r in interface.requests) and time.time() < tmax:
+        interface.poll()
+        interface.wait(0.1)
+    return interface.requests
+
+
+def run_exchange(mode, natoms=4, nreq=3, batch=1, batch_callback=None):
+    """Serves a few requests to a client connected in the given mode.
+
+    Returns:
+       The list of completed requests and the client.
+    """
+
+    address = "test_%s_%d" % (mode, os.getpid())
+    interface = InterfaceSocket(address=address, mode=mode, timeout=0.0)
+    interface.open()
+    try:
+        client = start_client(address, mode, natoms, batch=batch)
+        client._batch_callback = batch_callback
+        return serve(interface, natoms, nreq), client
+    finally:
+        interface.close()
+
+
+def test_unix():
+    """Socket: forces are transferred through a unix socket."""
+
+    for r in run_exchange("unix")[0]:
+        assert r["status"] == "Done"
+        assert np.allclose(r["result"][1], -r["pos"])
+        assert np.allclose(r["result"][0], 0.5 * (r["pos"]**2).sum())
+
+
+def test_shm():
+    """Socket: forces are transferred through shared memory."""
+
+    for r in run_exchange("shm")[0]:
+        assert r["status"] == "Done"
+        assert np.allclose(r["result"][1], -r["pos"])
+        assert np.allclose(r["result"][0], 0.5 * (r["pos"]**2).sum())
+    # segments are unlinked as soon as the driver has mapped them
+    assert not [f for f in os.listdir("/dev/shm") if f.startswith("ipi_test_shm_%d" % os.getpid())]
+
+
+def test_stats():
+    """Socket: the traffic and the activity of the clients are accounted for."""
+
+    natoms = 4
+    address = "test_stats_%d" % os.getpid()
+    interface = InterfaceSocket(address=address, mode="unix", timeout=0.0)
+    interface.open()
+    try:
+        start_client(address, "unix", natoms)
+        requests = serve(interface, natoms, 3)
+        stats = interface.get_stats()
+    finally:
+        interface.close()
+    for r in requests:
+        # positions and cell go out, forces and virial come back
+        assert r["nbytes"] > 8 * (3 * natoms + 18) + 8 * (3 * natoms + 9)
+        assert r["t_io"] >= 0.0
+    assert stats["connected"] == 1 and stats["dropped"] == 0
+    assert stats["clients"][0]["served"] == 3
+    # status queries and replies add to the traffic of the requests
+    assert stats["clients"][0]["bytes"] > sum(r["nbytes"] for r in requests)
+    assert 0.0 <= stats["clients"][0]["utilisation"] <= 1.0
+
+
+def check_batch(batch_callback):
+    """Checks the results of requests served in batches by a single client."""
+
+    requests, client = run_exchange("unix", nreq=6, batch=4, batch_callback=batch_callback)
+    for r in requests:
+        assert r["status"] == "Done"
+        assert np.allclose(r["result"][1], -r["pos"])
+        assert np.allclose(r["result"][0], 0.5 * (r["pos"]**2).sum())
+    # 6 requests with up to 4 per message: the last message carried 2 configurations
+    assert client._nbatch == 2
+
+
+def test_batch():
+    """Socket: batches of configurations evaluated one at a time by the client."""
+
+    check_batch(None)
+
+
+def test_batch_callback():
+    """Socket: batches of configurations evaluated at once by the client."""
+
+    check_batch(harmonic_batch)
+
+
+def test_priority():
+    """Socket: the requests with a higher priority are served first."""
+
+    order = []
+
+    def record(pos):
+        order.append(int(pos[0, 0]))
+        return harmonic(pos)
+
+    address = "test_priority_%d" % os.getpid()
+    interface = InterfaceSocket(address=address, mode="unix", timeout=0.0)
+    interface.open()
+    try:
+        start_client(address, "unix", 4, record)
+        while len(interface.clients) < 1:
+            interface.pool_update()
+        for r in serve(interface, 4, 5, priorities=[0, 0, 1, 0, 2]):
+            assert r["status"] == "Done"
+    finally:
+        interface.close()
+    # ties are served in the order in which they were queued
+    assert order == [4, 2, 0, 1, 3]
+
+
+def test_request_priority():
+    """Socket: inner MTS levels and contracted components get a higher priority."""
+
+    assert request_priority([], 8, 8) == 0.0
+    assert request_priority([1, 0], 8, 8) < request_priority([0, 1], 8, 8)
+    assert request_priority([1, 0], 8, 8) < request_priority([1, 0], 2, 8) < request_priority([0, 1], 8, 8)
+
+
+def test_hints():
+    """Socket: clients that accept hints get the extrapolation coefficients of each replica."""
+
+    natoms = 4
+    received = []
+    address = "test_hints_%d" % os.getpid()
+    interface = InterfaceSocket(address=address, mode="unix", timeout=0.0)
+    interface.open()
+    try:
+        client = start_client(address, "unix", natoms, lambda pos: received.append(client._hints) or harmonic(pos), hints=2)
+        while len(interface.clients) < 1:
+            interface.pool_update()
+        # a trajectory moving at constant velocity, of which the replica has three previous configurations
+        q = [np.arange(3.0 * natoms) + 0.1 * t * np.arange(3.0 * natoms)**2 for t in range(4)]
+        h = np.eye(3) * 10.0
+        interface.requests = [ForceRequest({"id": 5, "pos": q[3], "active": np.arange(3 * natoms), "hints": (3, q[3], [q[2], q[1], q[0]]),
+                                            "cell": (h, np.linalg.inv(h)), "pars": "", "status": "Queued",
+                                            "start": -1, "result": None, "t_dispatched": 0, "t_finished": 0})]
+        tmax = time.time() + 10.0
+        while interface.requests[0]["status"] != "Done" and time.time() < tmax:
+            interface.poll()
+            interface.wait(0.1)
+    finally:
+        interface.close()
+    assert interface.requests[0]["status"] == "Done"
+    rid, step, coeffs = received[0]
+    # only as many coefficients as the client can use
+    assert (rid, step, len(coeffs)) == (5, 3, 2)
+    assert np.allclose(coeffs[0] * q[2] + coeffs[1] * q[1], q[3], atol=1e-4)
+
+
+def test_throughput():
+    """Socket: the throughput scheduler sends most requests to the fastest client."""
+
+    served = {"fast": 0, "slow": 0}
+
+    def timed(name, delay):
+        def callback(pos):
+            served[name] += 1
+            time.sleep(delay)
+            return harmonic(pos)
+        return callback
+
+    address = "test_throughput_%d" % os.getpid()
+    interface = InterfaceSocket(address=address, mode="unix", timeout=0.0, match_mode="throughput")
+    interface.open()
+    try:
+        start_client(address, "unix", 4, timed("fast", 0.01))
+        start_client(address, "unix", 4, timed("slow", 0.5))
+        # makes sure that both clients are connected before queueing work
+        while len(interface.clients) < 2:
+            interface.pool_update()
+        for step in range(3):
+            for r in serve(interface, 4, 8):
+                assert r["status"] == "Done"
+                assert np.allclose(r["result"][1], -r["pos"])
+    finally:
+        interface.close()
+    # the slow client is only used until it has been timed
+    assert served["fast"] + served["slow"] == 24
+    assert served["slow"] <= 2
+
+
+def test_hedge():
+    """Socket: a straggling request is hedged on an idle client, which is not timed out."""
+
+    slow = threading.Event()
+
+    def straggler(pos):
+        # the first client to get this replica gets stuck on it for a while
+        if pos[0, 0] == 12.0 and not slow.is_set():
+            slow.set()
+            time.sleep(2.0)
+        return harmonic(pos)
+
+    address = "test_hedge_%d" % os.getpid()
+    # the late copy must be discarded, even if it takes longer than the timeout
+    interface = InterfaceSocket(address=address, mode="unix", timeout=1.0, hedge=90.0)
+    interface.open()
+    try:
+        start_client(address, "unix", 4, straggler)
+        start_client(address, "unix", 4, straggler)
+        while len(interface.clients) < 2:
+            interface.pool_update()
+        # gathers latencies, runs a step with a straggler, then one in which its late result comes back
+        for nreq in [8, 16, 16]:
+            t0 = time.time()
+            for r in serve(interface, 4, nreq):
+                assert r["status"] == "Done"
+                assert np.allclose(r["result"][1], -r["pos"])
+            assert time.time() - t0 < 1.5
+        assert slow.is_set()
+        tmax = time.time() + 5.0
+        while interface.jobs and time.time() < tmax:
+            interface.poll()
+            interface.wait(0.1)
+        assert len(interface.jobs) == 0
+        assert len(interface.clients) == 2
+        assert interface.ndropped == 0
+    finally:
+        interface.close()
+
+
+def test_timeout():
+    """Socket: a client that hangs is timed out and its request is computed by another one."""
+
+    hung = threading.Event()
+
+    def hang(pos):
+        if pos[0, 0] == 12.0 and not hung.is_set():
+            hung.set()
+            time.sleep(3.0)
+        return harmonic(pos)
+
+    address = "test_timeout_%d" % os.getpid()
+    interface = InterfaceSocket(address=address, mode="unix", timeout=0.5)
+    interface.open()
+    try:
+        start_client(address, "unix", 4, hang)
+        start_client(address, "unix", 4, hang)
+        while len(interface.clients) < 2:
+            interface.pool_update()
+        for r in serve(interface, 4, 16):
+            assert r["status"] == "Done"
+            assert np.allclose(r["result"][1], -r["pos"])
+        assert hung.is_set()
+        assert interface.ndropped + len([c for c in interface.clients if not c.status & Status.Up]) == 1
+    finally:
+        interface.close()
+
+
+def test_output():
+    """Socket: forces of the active atoms are scattered into the request storage."""
+
+    natoms = 4
+    address = "test_output_%d" % os.getpid()
+    interface = InterfaceSocket(address=address, mode="unix", timeout=0.0)
+    interface.open()
+    try:
+        # the client only sees the two active atoms
+        start_client(address, "unix", 2)
+        f = np.ones(3 * natoms)
+        vir = np.ones((3, 3))
+        h = np.eye(3) * 10.0
+        r = ForceRequest({"id": 0, "pos": np.arange(3.0 * natoms), "active": np.arange(3, 9),
+                          "cell": (h, np.linalg.inv(h)), "pars": "", "status": "Queued", "output": (f, vir),
+                          "start": -1, "result": None, "t_dispatched": 0, "t_finished": 0})
+        interface.requests = [r]
+        tmax = time.time() + 10.0
+        while r["status"] != "Done" and time.time() < tmax:
+            interface.poll()
+            interface.wait(0.1)
+    finally:
+        interface.close()
+    assert r["result"][1] is f
+    assert r["result"][2] is vir
+    assert np.allclose(f[3:9], -r["pos"][3:9])
+    assert np.allclose(f[:3], 0.0) and np.allclose(f[9:], 0.0)
+    assert np.allclose(vir, 0.0)
+
+
+def test_multiclient():
+    """Socket: a single client serves several connections to two servers concurrently."""
+
+    def slow(pos):
+        time.sleep(0.5)
+        return harmonic(pos)
+
+    address = "test_multi_%d" % os.getpid()
+    first = InterfaceSocket(address=address + "_a", mode="unix", timeout=0.0)
+    second = InterfaceSocket(address=address + "_b", mode="shm", timeout=0.0)
+    first.open()
+    second.open()
+    try:
+        client = MultiClient(nworkers=4)
+        client._callback = slow
+        client.connect(address + "_a", mode="unix")
+        client.connect(address + "_a", mode="unix")
+        client.connect(address + "_b", mode="shm")
+        thread = threading.Thread(target=client.run, kwargs={"verbose": False, "fn_exit": None})
+        thread.daemon = True
+        thread.start()
+        while len(first.clients) < 2:
+            first.pool_update()
+        t0 = time.time()
+        requests = serve(first, 4, 4)
+        # the two connections keep two evaluations in flight
+        assert time.time() - t0 < 1.6
+        # the results of each configuration must be in the segment before the server reads them
+        requests += serve(second, 4, 4)
+        for r in requests:
+            assert r["status"] == "Done"
+            assert np.allclose(r["result"][1], -r["pos"])
+            assert np.allclose(r["result"][0], 0.5 * (r["pos"]**2).sum())
+    finally:
+        first.close()
+        second.close()
+    thread.join(10.0)
+    assert not thread.isAlive()
+
+
+DRIVER = """
+import sys
+import shutil
+import signal
+import numpy as np
+sys.path.insert(0, %r)
+from ipi.interfaces.clients import Client
+client = Client(address=sys.argv[1], mode="unix")
+client._positions = np.zeros((4, 3))
+client._callback = lambda pos: (-pos, np.array([0.5 * (pos**2).sum()]))
+client.run(verbose=False, fn_exit=None)
+"""
+
+
+def test_driver_pool():
+    """Socket: local drivers are started, scaled with the pending requests and restarted."""
+
+    script = tempfile.NamedTemporaryFile(suffix=".py")
+    script.write(DRIVER % os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    script.flush()
+    pool = DriverPool(sys.executable + " " + script.name + " {address}", nmin=1, nmax=3)
+    address = "test_pool_%d" % os.getpid()
+    interface = InterfaceSocket(address=address, mode="unix", timeout=0.0, drivers=pool)
+    interface.open()
+    try:
+        assert len(pool.procs) == 1
+        for r in serve(interface, 4, 6):
+            assert r["status"] == "Done"
+            assert np.allclose(r["result"][1], -r["pos"])
+        assert len(pool.procs) == 3
+        # a driver that dies is replaced
+        pool.procs[0].kill()
+        pool.procs[0].wait()
+        for r in serve(interface, 4, 6):
+            assert r["status"] == "Done"
+        assert len(pool.procs) == 3
+        assert pool.nstarted == 4
+        procs = pool.procs[:]
+    finally:
+        interface.close()
+    assert len(pool.procs) == 0
+    assert all(p.poll() is not None for p in procs)
+
+
+STUBBORN = """
+import sys
+import shutil
+import signal
+import time
+import signal
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+open(sys.argv[1], "w").close()
+while True:
+    time.sleep(1.0)
+"""
+
+
+def test_driver_pool_kill(monkeypatch):
+    """Socket: drivers that ignore the termination signal are killed on stop."""
+
+    import ipi.interfaces.drivers
+    monkeypatch.setattr(ipi.interfaces.drivers, "POOLKILL", 0.2)
+    script = tempfile.NamedTemporaryFile(suffix=".py")
+    script.write(STUBBORN)
+    script.flush()
+    pool = DriverPool(sys.executable + " " + script.name + " {address}", nmin=1, nmax=1)
+    address = os.path.join(tempfile.mkdtemp(), "ready")
+    pool.start(InterfaceSocket(address=address, mode="unix"))
+    proc = pool.procs[0]
+    try:
+        # the signal handler is in place once the driver has created the file
+        tmax = time.time() + 10.0
+        while not os.path.exists(address) and time.time() < tmax:
+            time.sleep(0.01)
+        assert os.path.exists(address)
+        pool.stop()
+        assert proc.returncode == -signal.SIGKILL
+        assert len(pool.procs) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        shutil.rmtree(os.path.dirname(address))
+
+
+def test_driver_pool_retire(monkeypatch):
+    """Socket: idle local drivers are retired without blocking once the demand drops."""
+
+    import ipi.interfaces.drivers
+    monkeypatch.setattr(ipi.interfaces.drivers, "POOLCOOLDOWN", 0.5)
+    script = tempfile.NamedTemporaryFile(suffix=".py")
+    script.write(DRIVER % os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    script.flush()
+    pool = DriverPool(sys.executable + " " + script.name + " {address}", nmin=1, nmax=3)
+    address = "test_retire_%d" % os.getpid()
+    interface = InterfaceSocket(address=address, mode="unix", timeout=0.0, drivers=pool)
+    interface.open()
+    try:
+        for r in serve(interface, 4, 6):
+            assert r["status"] == "Done"
+        assert len(pool.procs) == 3
+        tmax = time.time() + 10.0
+        while (len(pool.procs) > 1 or len(pool.retired) > 0) and time.time() < tmax:
+            interface.poll()
+            interface.wait(0.05)
+        assert len(pool.procs) == 1
+        assert len(pool.retired) == 0
+        assert len(interface.clients) == 1
+        assert interface.ndropped == 0
+        assert pool.nstarted == 3
+        for r in serve(interface, 4, 2):
+            assert r["status"] == "Done"
+    finally:
+        interface.close()
@@ -16,6 +16,26 @@ normal mode representations of the positions and momenta. In this case any of
 the representations can be set manually, and all the other representations
 must keep in step.
 
+Once all the objects have been bound, the network can optionally be frozen
+into a depend_graph, which replaces the recursive tainting with a vectorized
+update of a single array of flags.
+
+A depend_profiler can be started to count how many times each object is
+tainted and recomputed, and how long its recalculation takes.
+
+Within a dbatch block the tainting of the dependants of the objects that are
+changed is deferred, so that an object updated several times in a row sends
+a single taint down the network.
+
+The independent dependencies of an object can be declared as prefetchable,
+in which case those that are tainted are recomputed concurrently, on a shared
+pool of threads, before the object itself.
+
+Code that only reads arrays should use dview, which gives an up-to-date,
+read-only ndarray without any of the depend machinery. Functions marked with
+dhot are checked for the use of depend_array slices and ufuncs if the
+IPI_HOTCHECK environment variable is set.
+
 For a more detailed discussion, see the reference manual.
 """
 
@@ -24,16 +44,53 @@ For a more detailed discussion, see the reference manual.
 # See the "licenses" directory for full license information.
 
 
+import os
+import sys
+import gc
+import time
+import signal
 import weakref
 import threading
+import functools
+import Queue
+from collections import Counter, OrderedDict
 
 import numpy as np
 
-from ipi.utils.messages import verbosity, warning
+from ipi.utils.messages import verbosity, warning, info
+from ipi.utils.softexit import softexit
 
 
 __all__ = ['depend_value', 'depend_array', 'synchronizer', 'dobject', 'dd',
-           'dpipe', 'dcopy', 'dstrip', 'depraise']
+           'dpipe', 'dcopy', 'dstrip', 'depraise', 'depend_graph', 'depend_profiler',
+           'dbatch', 'dfetch', 'dview', 'dhot']
+
+
+# the frozen graphs, indexed by the id of the tainted flag of each of their nodes
+_frozen = {}
+# the same, leaving out the nodes that are always tainted recursively
+_fast = {}
+# the smallest number of dependants for which a frozen graph taints them with array operations
+MINCLOSURE = 8
+# the depend_profiler that is recording, if any
+_profiler = None
+# the objects whose dependants are still to be tainted, for the thread that opened a dbatch
+_batch = threading.local()
+# the number of dbatch blocks that are open in any thread, and its lock
+_nbatch = 0
+_nbatch_lock = threading.Lock()
+# the tainted flags downstream of each object, indexed by the id of its tainted flag
+_downstream = {}
+# the number of threads used to recompute the prefetchable dependencies, and the pool itself
+NFETCHTHREADS = 4
+_fetchpool = None
+# seconds between the checks for a soft exit while waiting for the pool
+FETCHLATENCY = 0.1
+# whether the use of depend arrays within the functions marked with dhot is reported
+HOTCHECK = os.environ.get("IPI_HOTCHECK", "") != ""
+# the number of hot functions being run by each thread, and the places already reported
+_hot = threading.local()
+_hotreported = set()
 
 
 class synchronizer(object):
@@ -89,9 +146,11 @@ class depend_base(object):
         _synchro: A synchronizer object to deal with synched objects, if
             required. None otherwise.
         _dependants: A list containing all objects dependent on the self.
+        _prefetch: A list of the dependencies that are recomputed concurrently
+            before self, a function returning such a list, or None.
     """
 
-    def __init__(self, name, synchro=None, func=None, dependants=None, dependencies=None, tainted=None, active=None):
+    def __init__(self, name, synchro=None, func=None, dependants=None, dependencies=None, tainted=None, active=None, prefetch=None):
         """Initialises depend_base.
 
         An unusual initialisation routine, as it has to be able to deal with
@@ -120,6 +179,10 @@ class depend_base(object):
                 depends upon.
             active: An optional boolean to indicate if this object is evaluated
                 (is active) or on hold.
+            prefetch: An optional list of depend objects that self depends
+                upon and that do not depend on each other, which are
+                recomputed concurrently before self. Can also be a function
+                that returns the list, if it changes over time.
         """
 
         if tainted is None:
@@ -138,6 +201,7 @@ class depend_base(object):
         self._threadlock = threading.RLock()
         self._dependants = []
         self._synchro = None
+        self._prefetch = prefetch
 
         self.add_synchro(synchro)
 
@@ -162,10 +226,16 @@ class depend_base(object):
     def hold(self):
         """ Sets depend object as on hold. """
         self._active[:] = False
+        frozen = _frozen.get(id(self._tainted))
+        if frozen is not None:
+            frozen[0].held.add(frozen[1])
 
     def resume(self):
         """ Sets depend object as active again. """
         self._active[:] = True
+        frozen = _frozen.get(id(self._tainted))
+        if frozen is not None:
+            frozen[0].held.discard(frozen[1])
         if self._func is None:
             self.taint(taintme=False)
         else:
@@ -176,6 +246,11 @@ class depend_base(object):
 
         assert self._synchro is None, "This object must not have a previous synchronizer!"
 
+        if synchro is not None and self._name not in synchro.synced:
+            _downstream.clear()
+            if id(self._tainted) in _frozen:
+                # a new member of the synchronizer changes the structure of the graph
+                _frozen[id(self._tainted)][0].thaw()
         self._synchro = synchro
         if self._synchro is not None and self._name not in self._synchro.synced:
             self._synchro.synced[self._name] = self
@@ -201,6 +276,10 @@ class depend_base(object):
                 be tainted. True by default.
         """
 
+        if id(newdep._tainted) in _frozen:
+            # the structure of a frozen graph cannot change
+            _frozen[id(newdep._tainted)][0].thaw()
+        _downstream.clear()
         newdep._dependants.append(weakref.ref(self))
         if tainted:
             self.taint(taintme=True)
@@ -226,14 +305,40 @@ class depend_base(object):
         if not self._active:
             return
 
+        frozen = _fast.get(id(self._tainted))
+        if frozen is not None and _profiler is None and frozen[0].taint(frozen[1]):
+            # everything downstream has been dealt with at once
+            if self._synchro is not None:
+                self._tainted[:] = (taintme and (not self._name == self._synchro.manual))
+            else:
+                self._tainted[:] = taintme
+        else:
+            self._taint(taintme)
+
+    def _taint(self, taintme=True):
+        """Sets the tainted flags one object at a time.
+
+        Used by taint, and by itself for the dependants, so that the objects
+        of a frozen graph that cannot be tainted at once do not check again
+        for each of their dependants.
+
+        Args:
+           taintme: A boolean giving whether self should be tainted at the end.
+        """
+
+        if not self._active:
+            return
+        if taintme and _profiler is not None:
+            _profiler.tainted(self)
+
         self._tainted[:] = True
         for item in self._dependants:
             if (not item()._tainted[0]):
-                item().taint()
+                item()._taint()
         if self._synchro is not None:
             for v in self._synchro.synced.values():
                 if (not v._tainted[0]) and (v is not self):
-                    v.taint(taintme=True)
+                    v._taint(taintme=True)
             self._tainted[:] = (taintme and (not self._name == self._synchro.manual))
         else:
             self._tainted[:] = taintme
@@ -251,15 +356,33 @@ class depend_base(object):
 
         if self._synchro is not None:
             if (not self._name == self._synchro.manual):
-                self.set(self._func[self._synchro.manual](), manual=False)
+                func = self._func[self._synchro.manual]
             else:
                 warning(self._name + " probably shouldn't be tainted (synchro)",
                         verbosity.low)
+                return
         elif self._func is not None:
-            self.set(self._func(), manual=False)
+            func = self._func
         else:
             warning(self._name + " probably shouldn't be tainted (value)",
                     verbosity.low)
+            return
+
+        if HOTCHECK:
+            # the recalculation is not part of the hot function that asked for the value
+            depth, _hot.depth = getattr(_hot, "depth", 0), 0
+        try:
+            if callable(self._prefetch):
+                dfetch(self._prefetch())
+            elif self._prefetch is not None:
+                dfetch(self._prefetch)
+            if _profiler is None:
+                self.set(func(), manual=False)
+            else:
+                self.set(_profiler.compute(self, func), manual=False)
+        finally:
+            if HOTCHECK:
+                _hot.depth = depth
 
     def update_man(self):
         """Manual update routine.
@@ -273,10 +396,16 @@ class depend_base(object):
         """
 
         if self._synchro is not None:
+            if _nbatch and self._synchro.manual != self._name and getattr(_batch, "roots", None):
+                # the deferred taints must be sent with the previous manual object
+                dbatch.flush()
             self._synchro.manual = self._name
         elif self._func is not None:
             raise NameError("Cannot set manually the value of the automatically-computed property <" + self._name + ">")
-        self.taint(taintme=False)
+        if _nbatch and getattr(_batch, "roots", None) is not None and self._active:
+            dbatch.defer(self)
+        else:
+            self.taint(taintme=False)
 
     def set(self, value, manual=False):
         """Dummy setting routine."""
@@ -297,7 +426,7 @@ class depend_value(depend_base):
         _value: The value associated with self.
     """
 
-    def __init__(self, name, value=None, synchro=None, func=None, dependants=None, dependencies=None, tainted=None, active=None):
+    def __init__(self, name, value=None, synchro=None, func=None, dependants=None, dependencies=None, tainted=None, active=None, prefetch=None):
         """Initialises depend_value.
 
         Args:
@@ -313,10 +442,14 @@ class depend_value(depend_base):
             dependants: An optional list containing objects that depend on self.
             dependencies: An optional list containing objects that self
                 depends upon.
+            prefetch: An optional list of depend objects that self depends
+                upon and that do not depend on each other, which are
+                recomputed concurrently before self. Can also be a function
+                that returns the list, if it changes over time.
         """
 
         self._value = value
-        super(depend_value, self).__init__(name, synchro, func, dependants, dependencies, tainted, active)
+        super(depend_value, self).__init__(name, synchro, func, dependants, dependencies, tainted, active, prefetch)
 
     def get(self):
         """Returns value, after recalculating if necessary.
@@ -325,6 +458,8 @@ class depend_value(depend_base):
         is recalculated if tainted.
         """
 
+        if _nbatch and id(self._tainted) in getattr(_batch, "stale", ()):
+            dbatch.flush()
         with self._threadlock:
             if self._tainted[0]:
                 self.update_auto()
@@ -370,7 +505,7 @@ class depend_array(np.ndarray, depend_base):
             self is a slice.
     """
 
-    def __new__(cls, value, name, synchro=None, func=None, dependants=None, dependencies=None, tainted=None, base=None, active=None):
+    def __new__(cls, value, name, synchro=None, func=None, dependants=None, dependencies=None, tainted=None, base=None, active=None, prefetch=None):
         """Creates a new array from a template.
 
         Called whenever a new instance of depend_array is created. Casts the
@@ -384,7 +519,7 @@ class depend_array(np.ndarray, depend_base):
         obj = np.asarray(value).view(cls)
         return obj
 
-    def __init__(self, value, name, synchro=None, func=None, dependants=None, dependencies=None, tainted=None, base=None, active=None):
+    def __init__(self, value, name, synchro=None, func=None, dependants=None, dependencies=None, tainted=None, base=None, active=None, prefetch=None):
         """Initialises depend_array.
 
         Note that this is only called when a new array is created by an
@@ -403,9 +538,13 @@ class depend_array(np.ndarray, depend_base):
             dependants: An optional list containing objects that depend on self.
             dependencies: An optional list containing objects that self
                 depends upon.
+            prefetch: An optional list of depend objects that self depends
+                upon and that do not depend on each other, which are
+                recomputed concurrently before self. Can also be a function
+                that returns the list, if it changes over time.
         """
 
-        super(depend_array, self).__init__(name, synchro, func, dependants, dependencies, tainted, active)
+        super(depend_array, self).__init__(name, synchro, func, dependants, dependencies, tainted, active, prefetch)
 
         if base is None:
             self._bval = value
@@ -430,6 +569,9 @@ class depend_array(np.ndarray, depend_base):
         __init__(), so need to be initialized.
         """
 
+        if HOTCHECK and getattr(_hot, "depth", 0):
+            _hotuse("creation")
+
         depend_base.__init__(self, name="")
 
         if type(obj) is depend_array:
@@ -480,6 +622,9 @@ class depend_array(np.ndarray, depend_base):
         See docstring of __array_prepare__().
         """
 
+        if HOTCHECK and getattr(_hot, "depth", 0):
+            _hotuse("ufunc")
+
         if context is None or len(context) < 2 or not type(context[0]) is np.ufunc:
             return np.ndarray.__array_wrap__(self.view(np.ndarray), arr.view(np.ndarray), context)
         elif len(context[1]) > context[0].nin and context[0].nout > 0:
@@ -555,6 +700,11 @@ class depend_array(np.ndarray, depend_base):
            index: A slice variable giving the appropriate slice to be read.
         """
 
+        if HOTCHECK and getattr(_hot, "depth", 0):
+            _hotuse("indexing")
+
+        if _nbatch and id(self._tainted) in getattr(_batch, "stale", ()):
+            dbatch.flush()
         with self._threadlock:
             if self._tainted[0]:
                 self.update_auto()
@@ -585,6 +735,8 @@ class depend_array(np.ndarray, depend_base):
         # It is worth duplicating this code that is also used in __getitem__ as this
         # is called most of the time, and we avoid creating a load of copies pointing to the same depend_array
 
+        if _nbatch and id(self._tainted) in getattr(_batch, "stale", ()):
+            dbatch.flush()
         with self._threadlock:
             if self._tainted[0]:
                 self.update_auto()
@@ -658,6 +810,79 @@ np.dot = dep_dot
 # ENDS NUMPY FUNCTIONS OVERRIDE
 
 
+def dview(da):
+    """Gives a read-only view of the value of a depend_array.
+
+    Differs from dstrip in that the value is brought up to date first, and
+    in that the view cannot be written to. Slicing the view and doing
+    arithmetics with it go straight to numpy, so it should be used instead of
+    the depend_array wherever its value is only read.
+
+    Args:
+        da: A depend_array.
+
+    Returns:
+        A read-only ndarray with the current value of da.
+    """
+
+    if isinstance(da, depend_array):
+        if da._tainted[0] or _nbatch:
+            da.__get__(None, None)
+        result = da.view(np.ndarray)
+        result.flags.writeable = False
+        return result
+    else:
+        return da
+
+
+def dhot(func):
+    """Marks a function as a hot path, which should not use depend arrays.
+
+    Only has an effect if HOTCHECK is set when the function is defined, in
+    which case each place where a depend_array is indexed, created or used
+    in a ufunc while the function runs is reported once.
+
+    Args:
+        func: The function to be marked.
+
+    Returns:
+        func, or a wrapper that keeps track of when it is running.
+    """
+
+    if not HOTCHECK:
+        return func
+
+    @functools.wraps(func)
+    def hot(*args, **kwargs):
+        _hot.depth = getattr(_hot, "depth", 0) + 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _hot.depth -= 1
+
+    return hot
+
+
+def _hotuse(what):
+    """Reports the use of a depend_array within a hot function.
+
+    Args:
+        what: A string describing what was done with the array.
+    """
+
+    # the innermost frame outside this module, and outside numpy, is the culprit
+    frame = sys._getframe(1)
+    while frame is not None and (frame.f_globals.get("__name__") == __name__ or
+                                 frame.f_globals.get("__name__", "").split(".")[0] == "numpy"):
+        frame = frame.f_back
+    if frame is None:
+        return
+    where = "%s:%d" % (frame.f_code.co_filename, frame.f_lineno)
+    if where not in _hotreported:
+        _hotreported.add(where)
+        warning(" @DEPEND: %s of a depend_array in a hot function at %s (%s)" % (what, where, frame.f_code.co_name))
+
+
 def dstrip(da):
     """Removes dependencies from a depend_array.
 
@@ -801,3 +1026,558 @@ class ddirect(object):
         member objects."""
 
         return object.__setattr__(object.__getattribute__(self, "dobj"), name, value)
+
+
+def dfetch(deps):
+    """Recomputes the tainted objects of a list concurrently.
+
+    The objects must not depend on each other. They are recomputed on a
+    shared pool of NFETCHTHREADS threads, and this returns once all of them
+    are up to date. Objects that are not tainted are skipped, and if at most
+    one of them needs recomputing, or if this is called from one of the
+    threads of the pool, everything is done in the calling thread.
+
+    Args:
+        deps: A list of depend objects.
+    """
+
+    global _fetchpool
+
+    tainted = [d for d in deps if d._tainted[0] and d._active[0]]
+    if len(tainted) < 2 or NFETCHTHREADS < 2 or getattr(threading.currentThread(), "_dfetch", False):
+        for d in tainted:
+            d.get()
+        return
+
+    if _fetchpool is None:
+        _fetchpool = _dfetch_pool(NFETCHTHREADS)
+    _fetchpool.run([d.get for d in tainted])
+
+
+class _dfetch_pool(object):
+
+    """A pool of daemon threads that run the tasks submitted by dfetch.
+
+    Attributes:
+        tasks: The queue of the tasks waiting for a thread.
+        threads: The list of the threads.
+    """
+
+    def __init__(self, nthreads):
+        """Starts the threads of the pool.
+
+        Args:
+            nthreads: The number of threads.
+        """
+
+        self.tasks = Queue.Queue()
+        self.threads = []
+        for i in range(nthreads):
+            thread = threading.Thread(target=self._worker, name="dfetch-%d" % i)
+            thread.daemon = True
+            thread._dfetch = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _worker(self):
+        """Runs tasks until the program exits."""
+
+        while True:
+            func, done, errors = self.tasks.get()
+            try:
+                func()
+            except BaseException as err:
+                # also passes on the SystemExit of a forcefield that has been stopped
+                errors.append(err)
+            finally:
+                done.put(None)
+
+    def run(self, funcs):
+        """Runs all the functions of a list on the pool, and waits for them.
+
+        Args:
+            funcs: A list of functions that take no arguments.
+
+        Raises:
+            The first exception raised by one of the functions, if any.
+        """
+
+        done = Queue.Queue()
+        errors = []
+        for func in funcs:
+            self.tasks.put((func, done, errors))
+        ndone = 0
+        while ndone < len(funcs):
+            # with a timeout, as python 2 does not run the signal handlers
+            # while the main thread is blocked on a lock
+            try:
+                done.get(timeout=FETCHLATENCY)
+                ndone += 1
+            except Queue.Empty:
+                if softexit.triggered:
+                    # the functions may be waiting for forcefields that are being stopped
+                    while softexit.exiting:
+                        time.sleep(FETCHLATENCY)
+                    sys.exit()
+        if errors:
+            raise errors[0]
+
+
+class dbatch(object):
+
+    """Context manager that defers the tainting of the dependants of the depend
+    objects changed within a block.
+
+    The objects that are set manually are marked as up to date straight away,
+    but their dependants are only tainted when the outermost block exits, once
+    for each of the objects that were changed. Reading an object that is
+    downstream of a changed one, or manually setting an object of a
+    synchronizer other than the one that was last set, sends the pending
+    taints first, so the values that are read are never out of date. Only the
+    thread that opened the block is affected.
+
+    Example:
+        with dbatch():
+            beads.p += dp
+            beads.p[:, 0] = 0.0
+    """
+
+    def __enter__(self):
+        """Starts deferring the taints of this thread."""
+
+        global _nbatch
+        if getattr(_batch, "depth", 0) == 0:
+            _batch.roots = OrderedDict()
+            _batch.stale = set()
+            _batch.depth = 0
+        _batch.depth += 1
+        with _nbatch_lock:
+            _nbatch += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Sends the pending taints when the outermost block exits."""
+
+        global _nbatch
+        _batch.depth -= 1
+        with _nbatch_lock:
+            _nbatch -= 1
+        if _batch.depth == 0:
+            try:
+                dbatch.flush()
+            finally:
+                _batch.roots = None
+                _batch.stale = set()
+        return False
+
+    @staticmethod
+    def defer(obj):
+        """Marks obj as up to date, leaving the tainting of its dependants for later.
+
+        Args:
+           obj: The depend object that has been set manually.
+        """
+
+        obj._tainted[:] = False
+        key = id(obj._tainted)
+        if key not in _batch.roots:
+            _batch.roots[key] = obj
+            _batch.stale.update(dbatch.downstream(obj))
+            _batch.stale.difference_update(_batch.roots)
+
+    @staticmethod
+    def flush():
+        """Taints the dependants of the objects changed so far in this thread."""
+
+        roots = _batch.roots
+        _batch.roots = None
+        _batch.stale = set()
+        try:
+            for obj in roots.values():
+                obj.taint(taintme=False)
+        finally:
+            _batch.roots = OrderedDict() if getattr(_batch, "depth", 0) > 0 else None
+
+    @staticmethod
+    def downstream(obj):
+        """Returns the set of the ids of the tainted flags downstream of obj."""
+
+        cached = _downstream.get(id(obj._tainted))
+        if cached is not None and cached[0]() is obj._tainted:
+            return cached[1]
+
+        seen = set()
+        pending = [obj]
+        while pending:
+            item = pending.pop()
+            deps = [d() for d in item._dependants]
+            if item._synchro is not None:
+                deps += item._synchro.synced.values()
+            for d in deps:
+                if d is not None and id(d._tainted) not in seen:
+                    seen.add(id(d._tainted))
+                    pending.append(d)
+        seen.discard(id(obj._tainted))
+        _downstream[id(obj._tainted)] = (weakref.ref(obj._tainted), seen)
+        return seen
+
+
+class depend_graph(object):
+
+    """A frozen copy of a network of depend objects.
+
+    Compiles the dependants of each object into arrays of indices, so that
+    tainting an object marks everything downstream of it with a single
+    vectorized assignment, rather than by visiting the objects one by one.
+    All the objects that share a tainted flag (e.g. an array and its slices)
+    form a node of the graph, and their flags are replaced by views of a
+    single array, so that reading a flag is unchanged.
+
+    The recursive tainting is still used whenever its result could differ
+    from the vectorized one, that is when only some of the nodes downstream
+    are tainted, or when some node is on hold. Adding a dependency to a node
+    thaws the graph, and its objects go back to the recursive tainting.
+
+    Attributes:
+        flags: The tainted flags of all the nodes.
+        children: For each node, an array with the indices of its dependants
+            and of the objects it is synchronized with.
+        held: The set of the nodes that are on hold.
+        nfast: The number of taints done with a vectorized update.
+        nslow: The number of taints left to the recursive update.
+        _views: The views of flags that replace the tainted flags of each node.
+        _synced: For each node, None or a tuple with a weak reference to its
+            synchronizer and its name.
+        _closures: A cache of the nodes downstream of each node, split into
+            the plain and the synchronized ones.
+    """
+
+    def __init__(self, roots=None):
+        """Compiles the network of the objects that depend on the roots.
+
+        Args:
+            roots: An optional list of depend objects, and of dobjects whose
+                depend members are taken. By default, all the depend objects
+                that exist are frozen.
+        """
+
+        # all the objects that share a flag must get the new one, wherever they are stored
+        groups = {}
+        for obj in gc.get_objects():
+            if isinstance(obj, depend_base):
+                groups.setdefault(id(obj._tainted), []).append(obj)
+
+        if roots is None:
+            pending = groups.keys()
+        else:
+            pending = []
+            for r in roots:
+                if isinstance(r, dobject):
+                    pending += [id(v._tainted) for v in r.__dict__.values() if isinstance(v, depend_base)]
+                else:
+                    pending.append(id(r._tainted))
+
+        # walks down the network, collecting the nodes and their dependants
+        children = {}
+        while pending:
+            k = pending.pop()
+            if k in children:
+                continue
+            if k in _frozen:
+                _frozen[k][0].thaw()
+            kids = set()
+            for obj in groups[k]:
+                deps = [d() for d in obj._dependants]
+                if obj._synchro is not None:
+                    deps += obj._synchro.synced.values()
+                for d in deps:
+                    if d is not None:
+                        groups.setdefault(id(d._tainted), [d])
+                        kids.add(id(d._tainted))
+            kids.discard(k)
+            children[k] = kids
+            pending += [c for c in kids if c not in children]
+
+        keys = children.keys()
+        index = dict((k, i) for i, k in enumerate(keys))
+        self.flags = np.array([groups[k][0]._tainted[0] for k in keys], bool)
+        self.children = [np.array(sorted(index[c] for c in children[k]), int) for k in keys]
+        self.held = set()
+        self.nfast = 0
+        self.nslow = 0
+        self._views = []
+        self._synced = []
+        self._closures = {}
+        for i, k in enumerate(keys):
+            view = self.flags[i:i + 1]
+            synced = [obj for obj in groups[k] if obj._synchro is not None]
+            self._synced.append((weakref.ref(synced[0]._synchro), synced[0]._name) if synced else None)
+            for obj in groups[k]:
+                obj._tainted = view
+                if not obj._active[0]:
+                    self.held.add(i)
+            self._views.append(view)
+            _frozen[id(view)] = _fast[id(view)] = (self, i)
+
+        info(" @DEPEND: Frozen a graph of %d nodes." % len(keys), verbosity.medium)
+
+    def _closure(self, i):
+        """Lists the nodes downstream of node i, split into plain and synchronized ones."""
+
+        seen = set([i])
+        pending = [i]
+        while pending:
+            for c in self.children[pending.pop()]:
+                if c not in seen:
+                    seen.add(c)
+                    pending.append(c)
+        seen.discard(i)
+        plain = np.array(sorted(j for j in seen if self._synced[j] is None), int)
+        synced = np.array(sorted(j for j in seen if self._synced[j] is not None), int)
+        return plain, synced
+
+    def _manual(self, j):
+        """Returns whether node j is the manually set one of its synchronizer."""
+
+        synchro = self._synced[j][0]()
+        return synchro is not None and synchro.manual == self._synced[j][1]
+
+    def taint(self, i):
+        """Taints the nodes downstream of node i, if it can be done at once.
+
+        Args:
+            i: The index of the node.
+
+        Returns:
+            False if the recursive tainting must be used instead, True
+            otherwise. The flag of node i itself is left to the caller.
+        """
+
+        if self.held:
+            self.nslow += 1
+            return False
+
+        closure = self._closures.get(i)
+        if closure is None:
+            closure = self._closures[i] = self._closure(i)
+        plain, synced = closure
+        if len(plain) + len(synced) == 0:
+            # nothing downstream
+            return True
+        elif len(plain) + len(synced) < MINCLOSURE:
+            # the recursion is cheaper than the array operations, so the node
+            # is not worth looking up again
+            _fast.pop(id(self._views[i]), None)
+            self.nslow += 1
+            return False
+
+        if self.flags[self.children[i]].all():
+            # the recursion would stop at the first level
+            pass
+        elif not self.flags[plain].any() and (len(synced) == 0 or not self.flags[synced].any()):
+            # the recursion would visit every node. manually set synchronized objects stay untainted
+            self.flags[plain] = True
+            if len(synced) > 0:
+                self.flags[synced[np.array([not self._manual(j) for j in synced], bool)]] = True
+        else:
+            self.nslow += 1
+            return False
+        self.nfast += 1
+        return True
+
+    def thaw(self):
+        """Reverts the nodes of the graph to the recursive tainting.
+
+        The objects keep their views of the flags, which work as standalone
+        flags once the graph is gone.
+        """
+
+        for view in self._views:
+            _frozen.pop(id(view), None)
+            _fast.pop(id(view), None)
+        self._closures = {}
+        info(" @DEPEND: Thawed a graph of %d nodes." % len(self._views), verbosity.medium)
+
+
+class depend_profiler(object):
+
+    """Records how often the depend objects are tainted and recomputed.
+
+    While it is running, every taint of an object and every call to the
+    function that recomputes it are counted, and the recalculations are timed.
+    The objects are grouped by a label made of their name and of the class
+    (or the source file) of the function that computes them, so that e.g. the
+    forces of all the beads show up as a single line. The time is given both
+    including and excluding the recalculation of the other objects that are
+    needed along the way.
+
+    Attributes:
+        filename: The file the report is written to. The report is printed
+            to standard output if it is empty.
+        taints: A Counter of the number of times each label was tainted.
+        computes: A Counter of the number of times each label was recomputed.
+        time: A Counter of the time spent recomputing each label, including
+            the recalculation of its dependencies.
+        self_time: A Counter of the time spent recomputing each label, excluding
+            the recalculation of its dependencies.
+        nodes: A dictionary giving the set of the tainted flags of each label,
+            which counts the distinct objects.
+        callers: A dictionary giving a Counter of the places each label was
+            recomputed from.
+        _labels: A cache of the labels, indexed by the id of the tainted flags.
+        _stack: A thread-local list of the recalculations being timed.
+        _pending: True if SIGUSR1 was received and the report is still to be
+            written.
+    """
+
+    def __init__(self, filename=""):
+        """Initialises depend_profiler.
+
+        Args:
+            filename: The file the report is written to. Optional.
+        """
+
+        self.filename = filename
+        self.taints = Counter()
+        self.computes = Counter()
+        self.time = Counter()
+        self.self_time = Counter()
+        self.nodes = {}
+        self.callers = {}
+        self._labels = {}
+        self._stack = threading.local()
+        # reentrant, in case the report is asked for while the counters are updated
+        self._lock = threading.RLock()
+        self._pending = False
+        self._prev_signal = None
+
+    def start(self):
+        """Starts recording, and writes the report when SIGUSR1 is received."""
+
+        global _profiler
+        _profiler = self
+        try:
+            self._prev_signal = signal.signal(signal.SIGUSR1, self._signal_handler)
+        except ValueError:
+            # signals can only be caught from the main thread
+            self._prev_signal = None
+        info(" @DEPEND: Profiling the depend objects.", verbosity.low)
+
+    def stop(self):
+        """Stops recording."""
+
+        global _profiler
+        if _profiler is self:
+            _profiler = None
+        if self._prev_signal is not None:
+            signal.signal(signal.SIGUSR1, self._prev_signal)
+            self._prev_signal = None
+
+    def _signal_handler(self, signum, frame):
+        """Asks for the report to be written without stopping the simulation.
+
+        The handler can interrupt the main thread while it updates the
+        counters, so the report is only written at the next taint or
+        recalculation, outside of the lock.
+        """
+
+        self._pending = True
+
+    def _poll(self):
+        """Writes the report if it was asked for by SIGUSR1."""
+
+        if self._pending:
+            self._pending = False
+            self.write()
+
+    def _label(self, obj):
+        """Returns the label that groups obj with the equivalent objects."""
+
+        label = self._labels.get(id(obj._tainted))
+        if label is None:
+            func = obj._func
+            if isinstance(func, dict):
+                func = func.values()[0] if len(func) > 0 else None
+            owner = getattr(func, "im_self", None)
+            code = getattr(func, "func_code", None)
+            if owner is not None:
+                label = "%s.%s" % (owner.__class__.__name__, obj._name)
+            elif code is not None and func.func_globals.get("__name__") != __name__:
+                label = "%s (%s:%d)" % (obj._name, os.path.basename(code.co_filename), code.co_firstlineno)
+            else:
+                label = obj._name
+            self._labels[id(obj._tainted)] = label
+        return label
+
+    def tainted(self, obj):
+        """Counts a taint of obj."""
+
+        label = self._label(obj)
+        with self._lock:
+            self.taints[label] += 1
+            self.nodes.setdefault(label, set()).add(id(obj._tainted))
+        self._poll()
+
+    def compute(self, obj, func):
+        """Calls func to recompute obj, counting and timing the call.
+
+        Args:
+            obj: The depend object being recomputed.
+            func: The function that computes the value of obj.
+
+        Returns:
+            The value returned by func.
+        """
+
+        label = self._label(obj)
+        # the innermost frame outside this module is the one that asked for the value
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_globals.get("__name__") == __name__:
+            frame = frame.f_back
+        if frame is None:
+            caller = "?"
+        else:
+            caller = "%s:%d (%s)" % (os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+
+        stack = getattr(self._stack, "calls", None)
+        if stack is None:
+            stack = self._stack.calls = []
+        stack.append(0.0)
+        start = time.time()
+        try:
+            return func()
+        finally:
+            elapsed = time.time() - start
+            inner = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.computes[label] += 1
+                self.time[label] += elapsed
+                self.self_time[label] += elapsed - inner
+                self.nodes.setdefault(label, set()).add(id(obj._tainted))
+                self.callers.setdefault(label, Counter())[caller] += 1
+            self._poll()
+
+    def report(self):
+        """Returns the report as a string, sorted by the time spent on each label."""
+
+        with self._lock:
+            labels = set(self.taints.keys()) | set(self.computes.keys())
+            lines = ["# %12s %12s %10s %10s %6s  %-40s %s" % ("self_time/s", "total_time/s", "computes", "taints", "nodes", "label", "most frequent caller")]
+            for label in sorted(labels, key=lambda l: (-self.self_time[l], -self.computes[l], -self.taints[l], l)):
+                callers = self.callers.get(label)
+                caller = "%s [%d]" % callers.most_common(1)[0] if callers else "-"
+                lines.append("  %12.6f %12.6f %10d %10d %6d  %-40s %s" % (self.self_time[label], self.time[label], self.computes[label],
+                                                                          self.taints[label], len(self.nodes.get(label, ())), label, caller))
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Writes the report to filename, or to standard output."""
+
+        if self.filename == "":
+            info(self.report(), verbosity.low)
+        else:
+            with open(self.filename, "w") as rfile:
+                rfile.write(self.report())
+            info(" @DEPEND: Written the profile of the depend objects to " + self.filename, verbosity.low)
@@ -0,0 +1,201 @@
+"""Ewald summation of the electrostatic interactions of point charges.
+
+Splits the Coulomb energy of a periodic system of point charges into a
+short-ranged part, summed over the pairs closer than a cutoff, and a
+long-ranged part, summed over the wavevectors of the reciprocal lattice
+inside a cutoff. The reciprocal-space sum is evaluated for several
+configurations that share the same cell at once, e.g. for all the beads
+of a ring polymer.
+"""
+
+# This file is part of i-PI.
+# i-PI Copyright (C) 2014-2015 i-PI developers
+# See the "licenses" directory for full license information.
+
+
+import itertools
+
+import numpy as np
+
+
+__all__ = ['erfc_approx', 'ewald_parameters', 'kvectors', 'real_space', 'reciprocal_space', 'self_energy']
+
+
+# coefficients of the approximation to erfc(x) of Abramowitz and Stegun, 7.1.26
+_ERFC_P = 3.0525860
+_ERFC_A = [1.061405429, -1.453152027, 1.421413741, -0.284496736, 0.254829592]
+
+# maximum number of elements of the arrays of structure factors computed at once
+_CHUNK = 2**21
+
+
+def erfc_approx(x):
+    """Computes the complementary error function of an array.
+
+    Uses the rational approximation of Abramowitz and Stegun, 7.1.26, which
+    has an absolute error smaller than 1.5e-7 for x >= 0, the same used by
+    the q-TIP4P/F driver.
+
+    Args:
+       x: An array of non-negative numbers.
+
+    Returns:
+       A tuple with erfc(x) and exp(-x**2).
+    """
+
+    e = np.exp(-x * x)
+    t = _ERFC_P / (_ERFC_P + x)
+    poly = np.zeros(x.shape)
+    for a in _ERFC_A:
+        poly = t * (a + poly)
+    return e * poly, e
+
+
+def ewald_parameters(h, nsites, cvar=1.2):
+    """Chooses the cutoffs and the splitting parameter of the Ewald sum.
+
+    Uses the same heuristic as the q-TIP4P/F driver, which balances the cost
+    of the real and reciprocal space sums for a given number of charges.
+
+    Args:
+       h: The cell matrix, with the lattice vectors as columns.
+       nsites: The number of charges in the cell.
+       cvar: The ratio between the real-space cutoff and the average
+          distance between the charges.
+
+    Returns:
+       A tuple (rcut, alpha, kcut) with the real-space cutoff, the inverse
+       width of the screening Gaussians and the reciprocal-space cutoff.
+    """
+
+    # shortest distance between opposite faces of the box
+    rshort = (1.0 / np.sqrt((np.linalg.inv(h)**2).sum(axis=1))).min()
+    rcut = rshort * min(0.5, cvar * nsites**(-1.0 / 6.0))
+    alpha = np.pi / rcut
+    return rcut, alpha, 2.0 * np.pi * alpha
+
+
+def kvectors(h, alpha, kcut):
+    """Lists the wavevectors of the reciprocal-space sum.
+
+    Only one of each pair of opposite wavevectors is listed, with a weight
+    that accounts for both.
+
+    Args:
+       h: The cell matrix, with the lattice vectors as columns.
+       alpha: The inverse width of the screening Gaussians.
+       kcut: The reciprocal-space cutoff.
+
+    Returns:
+       A tuple (n, k, w) with an array (nk, 3) of the integer coordinates of
+       the wavevectors in the reciprocal lattice, an array (nk, 3) of the
+       wavevectors and an array of their weights,
+       4 pi / V exp(-k**2 / (4 alpha**2)) / k**2.
+    """
+
+    ih = np.linalg.inv(h)
+    nmax = np.floor(kcut * np.sqrt((h**2).sum(axis=0)) / (2.0 * np.pi)).astype(int)
+    n = np.array(list(itertools.product(range(0, nmax[0] + 1), range(-nmax[1], nmax[1] + 1), range(-nmax[2], nmax[2] + 1))), int)
+
+    # keeps one half of the reciprocal lattice, without the origin
+    half = (n[:, 0] > 0) | ((n[:, 0] == 0) & ((n[:, 1] > 0) | ((n[:, 1] == 0) & (n[:, 2] > 0))))
+    n = n[half]
+    k = 2.0 * np.pi * np.dot(n, ih)
+    k2 = (k**2).sum(axis=1)
+    inside = k2 < kcut**2
+    n, k, k2 = n[inside], k[inside], k2[inside]
+
+    volume = abs(np.linalg.det(h))
+    return n, k, 4.0 * np.pi / volume * np.exp(-0.25 * k2 / alpha**2) / k2
+
+
+def real_space(d, qij, alpha, bonded=None):
+    """Computes the real-space part of the Ewald sum over a list of pairs.
+
+    Args:
+       d: An array (npairs, 3) with the vectors going from the first to the
+          second charge of each pair.
+       qij: The products of the charges of each pair.
+       alpha: The inverse width of the screening Gaussians.
+       bonded: An optional boolean array that flags the pairs whose direct
+          Coulomb interaction is excluded, so that only the (negative)
+          interaction between their screening charges is left.
+
+    Returns:
+       A tuple (v, fij) with the energy of each pair and an array (npairs, 3)
+       with the force acting on the second charge of each pair.
+    """
+
+    r2 = (d**2).sum(axis=1)
+    r = np.sqrt(r2)
+    erfc, e = erfc_approx(alpha * r)
+    if bonded is not None:
+        erfc[bonded] -= 1.0
+    v = qij * erfc / r
+    fij = d * (qij * (2.0 * alpha / np.sqrt(np.pi) * e + erfc / r) / r2)[:, np.newaxis]
+    return v, fij
+
+
+def reciprocal_space(q, z, h, n, k, w, alpha):
+    """Computes the reciprocal-space part of the Ewald sum.
+
+    Args:
+       q: An array (nconfs, ncharges, 3) with the positions of the charges in
+          several configurations that share the same cell.
+       z: The charges.
+       h: The cell matrix, with the lattice vectors as columns.
+       n, k, w: The wavevectors and their weights, as returned by kvectors.
+       alpha: The inverse width of the screening Gaussians.
+
+    Returns:
+       A tuple (v, f, vir) with the energy of each configuration, an array
+       (nconfs, ncharges, 3) with the forces, and an array (nconfs, 3, 3) with
+       the virial tensors.
+    """
+
+    nconfs, ncharges = q.shape[:2]
+    v = np.zeros(nconfs)
+    f = np.zeros(q.shape)
+    vir = np.zeros((nconfs, 3, 3))
+    if len(k) == 0:
+        return v, f, vir
+
+    # derivative of the weights with respect to a strain of the cell
+    kk = k[:, :, np.newaxis] * k[:, np.newaxis, :] * (2.0 / (k**2).sum(axis=1) + 0.5 / alpha**2)[:, np.newaxis, np.newaxis]
+
+    frac = np.dot(q, np.linalg.inv(h).T)
+    nmax = np.abs(n).max(axis=0)
+
+    # the structure factors of several configurations are computed at once, within a memory budget
+    nchunk = max(1, _CHUNK / (ncharges * len(k)))
+    for start in range(0, nconfs, nchunk):
+        chunk = slice(start, start + nchunk)
+        # exp(i k.r) is the product of integer powers of exp(2 pi i s), where s are the
+        # fractional coordinates, which is cheaper than computing a sine and a cosine for each k
+        phase = 1.0
+        for a in range(3):
+            powers = np.exp(2j * np.pi * frac[chunk, :, a, np.newaxis] * np.arange(-nmax[a], nmax[a] + 1))
+            phase = phase * powers[:, :, n[:, a] + nmax[a]]
+        sk = np.dot(z, phase)
+
+        et = w * (sk.real**2 + sk.imag**2)
+        v[chunk] = et.sum(axis=1)
+        # the derivative of |S(k)|^2 with respect to the position of charge i is 2 z_i k Im(S(k)^* exp(i k.r_i))
+        f[chunk] = z[:, np.newaxis] * np.dot((phase * np.conj(sk)[:, np.newaxis, :]).imag, 2.0 * w[:, np.newaxis] * k)
+        vir[chunk] = et.sum(axis=1)[:, np.newaxis, np.newaxis] * np.identity(3) - np.tensordot(et, kk, axes=1)
+
+    return v, f, vir
+
+
+def self_energy(z, alpha):
+    """Computes the interaction of the charges with their own screening Gaussians.
+
+    Args:
+       z: The charges.
+       alpha: The inverse width of the screening Gaussians.
+
+    Returns:
+       The energy that must be subtracted from the Ewald sum.
+    """
+
+    return alpha / np.sqrt(np.pi) * (z**2).sum()
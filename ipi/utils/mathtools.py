@@ -14,7 +14,7 @@ from ipi.utils.messages import verbosity, warning
 
 __all__ = ['matrix_exp', 'stab_cholesky', 'h2abc', 'h2abc_deg', 'abc2h',
            'invert_ut3x3', 'det_ut3x3', 'eigensystem_ut3x3', 'exp_ut3x3',
-           'root_herm', 'logsumlog']
+           'root_herm', 'logsumlog', 'extrapolation_coefficients']
 
 
 def logsumlog(lasa, lbsb):
@@ -365,3 +365,34 @@ def root_herm(A):
         warning("Checking decomposition after negative eigenvalue: \n" + str(A - np.dot(rv, rv.T)), verbosity.low)
 
     return rv
+
+
+def extrapolation_coefficients(q, history, reg=1e-6):
+    """Expresses a configuration as a combination of the previous ones.
+
+    Finds the coefficients c, summing to one, that minimise
+    |q - sum_k c_k history[k]|^2. A code that has stored some quantity
+    (e.g. the electron density) for each of the previous configurations can
+    combine them with the same coefficients to guess its value for q, which
+    for a smooth trajectory is as good as a polynomial extrapolation in time.
+
+    Args:
+       q: The current configuration, as a flat array.
+       history: A list of previous configurations, the most recent first.
+       reg: The relative strength of a Tikhonov regularisation that keeps
+          the coefficients bounded when the configurations are almost
+          linearly dependent.
+
+    Returns:
+       An array with a coefficient for each configuration of history.
+    """
+
+    if len(history) < 2:
+        return np.ones(len(history))
+
+    # writing c_0 = 1 - sum_k c_k leaves an unconstrained fit of the displacement from the last configuration
+    d = np.asarray([np.asarray(h - history[0]).flatten() for h in history[1:]])
+    a = np.dot(d, d.T)
+    a += reg * max(np.trace(a), 1e-300) * np.identity(len(a))
+    c = np.linalg.solve(a, np.dot(d, np.asarray(q - history[0]).flatten()))
+    return np.concatenate(([1.0 - c.sum()], c))
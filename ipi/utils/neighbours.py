@@ -0,0 +1,224 @@
+"""Cell lists and Verlet neighbour lists for short-ranged interactions.
+
+Finds all the pairs of atoms closer than a cutoff, using a linked-cell
+decomposition of the (possibly triclinic) simulation box, and keeps the
+list of pairs within the cutoff plus a skin so that it only needs to be
+rebuilt when the atoms have moved by more than half the skin.
+"""
+
+# This file is part of i-PI.
+# i-PI Copyright (C) 2014-2015 i-PI developers
+# See the "licenses" directory for full license information.
+
+
+import itertools
+
+import numpy as np
+
+
+__all__ = ['NeighbourList']
+
+
+class NeighbourList(object):
+
+    """A Verlet neighbour list built with cell lists.
+
+    Each pair is stored once, as two atom indices and the integer lattice
+    translation that brings the image of the second atom next to the first,
+    so that pair vectors can be computed for any set of positions without
+    applying the minimum image convention. This also works when the cutoff
+    is larger than half the box, in which case an atom can interact with
+    several images of another atom, or with its own images.
+
+    Attributes:
+       cutoff: The interaction cutoff. If None, all the pairs are listed.
+       skin: The extra distance beyond the cutoff within which pairs are
+          listed, so that the list remains valid while the atoms move.
+       pbc: Whether the box is periodic. If not, the cell is only used to
+          check when it changes.
+       nbuild: The number of times the list has been built.
+       i: The indices of the first atom of each pair.
+       j: The indices of the second atom of each pair.
+       shifts: The lattice translations of the second atom of each pair,
+          in units of the cell vectors.
+       _q0: The positions of the atoms when the list was built.
+       _h0: The cell matrix when the list was built.
+    """
+
+    def __init__(self, cutoff=None, skin=0.0, pbc=True):
+        """Initialises NeighbourList.
+
+        Args:
+           cutoff: The interaction cutoff. If None, all the pairs are listed.
+           skin: The extra distance beyond the cutoff within which pairs are
+              listed.
+           pbc: Whether the box is periodic.
+
+        Raises:
+           ValueError: Raised if periodic boundary conditions are requested
+              without a cutoff, or if the cutoff or the skin are negative.
+        """
+
+        if pbc and cutoff is None:
+            raise ValueError("A cutoff is needed to list neighbours with periodic boundary conditions.")
+        if (cutoff is not None and cutoff <= 0.0) or skin < 0.0:
+            raise ValueError("The cutoff must be positive and the skin cannot be negative.")
+
+        self.cutoff = cutoff
+        self.skin = skin
+        self.pbc = pbc
+        self.nbuild = 0
+        self.i = np.zeros(0, int)
+        self.j = np.zeros(0, int)
+        self.shifts = np.zeros((0, 3), int)
+        self._q0 = None
+        self._h0 = None
+
+    def update(self, q, h):
+        """Rebuilds the list if the atoms have moved too much since it was built.
+
+        Atoms that have been wrapped back in the box since the list was built
+        do not cause a rebuild: the shifts of their pairs are corrected instead.
+
+        Args:
+           q: An array (natoms, 3) with the atomic positions.
+           h: The cell matrix, with the lattice vectors as columns.
+
+        Returns:
+           True if the list has been rebuilt, False otherwise.
+        """
+
+        if self._q0 is None or len(q) != len(self._q0) or (self.pbc and not np.array_equal(h, self._h0)):
+            self.build(q, h)
+            return True
+        if self.cutoff is None:
+            return False   # all the pairs are already listed
+
+        dq = q - self._q0
+        if self.pbc:
+            # takes out the lattice translations due to the atoms being wrapped back in the box
+            nwrap = np.round(np.dot(dq, np.linalg.inv(h).T))
+            dq -= np.dot(nwrap, h.T)
+        if (dq**2).sum(axis=1).max() > 0.25 * self.skin**2:
+            self.build(q, h)
+            return True
+
+        if self.pbc and nwrap.any():
+            nwrap = nwrap.astype(int)
+            self.shifts += nwrap[self.i] - nwrap[self.j]
+            self._q0 += np.dot(nwrap, h.T)
+        return False
+
+    def build(self, q, h):
+        """Builds the list of the pairs closer than the cutoff plus the skin.
+
+        Args:
+           q: An array (natoms, 3) with the atomic positions.
+           h: The cell matrix, with the lattice vectors as columns.
+        """
+
+        nat = len(q)
+        rlist = np.inf if self.cutoff is None else self.cutoff + self.skin
+
+        if self.pbc:
+            ih = np.linalg.inv(h)
+            s = np.dot(q, ih.T)
+            n0 = np.floor(s)
+            s -= n0
+            n0 = n0.astype(int)
+            # distances between opposite faces of the box
+            widths = 1.0 / np.sqrt((ih**2).sum(axis=1))
+        else:
+            origin = q.min(axis=0)
+            widths = q.max(axis=0) - origin + (rlist if self.cutoff is not None else 1.0)
+            s = (q - origin) / widths
+            n0 = np.zeros((nat, 3), int)
+
+        # the cells are at least as wide as rlist, so that the neighbours of an atom are in
+        # the adjacent cells, unless the box is so small that rlist spans several periods
+        if self.cutoff is None:
+            ncell = np.ones(3, int)
+            nsearch = np.zeros(3, int)
+        else:
+            ncell = np.maximum(1, np.floor(widths / rlist)).astype(int)
+            nsearch = np.ceil(rlist * ncell / widths).astype(int)
+            if not self.pbc:
+                nsearch = np.minimum(nsearch, ncell - 1)
+
+        cidx = np.minimum((s * ncell).astype(int), ncell - 1)
+        cflat = (cidx[:, 0] * ncell[1] + cidx[:, 1]) * ncell[2] + cidx[:, 2]
+        order = np.argsort(cflat, kind="mergesort")
+        ccount = np.bincount(cflat, minlength=ncell.prod())
+        cstart = np.cumsum(ccount) - ccount
+
+        pi, pj, pshift = [], [], []
+        atoms = np.arange(nat)
+        for offset in itertools.product(*[range(-n, n + 1) for n in nsearch]):
+            nb = cidx + offset
+            if self.pbc:
+                image = nb // ncell
+                nb -= image * ncell
+                ai = atoms
+            else:
+                inside = np.logical_and(nb >= 0, nb < ncell).all(axis=1)
+                nb, image, ai = nb[inside], np.zeros((inside.sum(), 3), int), atoms[inside]
+            nbflat = (nb[:, 0] * ncell[1] + nb[:, 1]) * ncell[2] + nb[:, 2]
+
+            # expands each atom into the list of the atoms in its neighbouring cell
+            count = ccount[nbflat]
+            if count.sum() == 0:
+                continue
+            first = np.cumsum(count) - count
+            i = np.repeat(ai, count)
+            k = np.repeat(image, count, axis=0)
+            j = order[np.repeat(cstart[nbflat] - first, count) + np.arange(count.sum())]
+            shift = k + n0[i] - n0[j]
+
+            # keeps each pair once, and each image of an atom interacting with itself once
+            keep = i < j
+            same = np.nonzero(i == j)[0]
+            if len(same) > 0:
+                sign = np.sign(shift[same])
+                lead = sign[np.arange(len(same)), np.argmax(sign != 0, axis=1)]
+                keep[same] = lead > 0
+            i, j, shift = i[keep], j[keep], shift[keep]
+
+            if self.cutoff is not None:
+                d = q[j] - q[i] + np.dot(shift, h.T) if self.pbc else q[j] - q[i]
+                close = (d**2).sum(axis=1) < rlist**2
+                i, j, shift = i[close], j[close], shift[close]
+            pi.append(i)
+            pj.append(j)
+            pshift.append(shift)
+
+        if len(pi) > 0:
+            self.i = np.concatenate(pi)
+            self.j = np.concatenate(pj)
+            self.shifts = np.concatenate(pshift)
+        else:
+            self.i, self.j, self.shifts = np.zeros(0, int), np.zeros(0, int), np.zeros((0, 3), int)
+        self._q0 = q.copy()
+        self._h0 = None if h is None else h.copy()
+        self.nbuild += 1
+
+    def pairs(self, q, h):
+        """Returns the listed pairs and their separation vectors.
+
+        Updates the list first, if needed. The list contains all the pairs
+        closer than the cutoff, but also some that are further apart.
+
+        Args:
+           q: An array (natoms, 3) with the atomic positions.
+           h: The cell matrix, with the lattice vectors as columns.
+
+        Returns:
+           A tuple (i, j, d) with the indices of the atoms in each pair and an
+           array (npairs, 3) with the vectors going from atom i to the
+           appropriate image of atom j.
+        """
+
+        self.update(q, h)
+        d = q[self.j] - q[self.i]
+        if self.pbc:
+            d += np.dot(self.shifts, h.T)
+        return self.i, self.j, d
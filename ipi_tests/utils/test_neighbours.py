@@ -0,0 +1,67 @@
+#!/usr/bin/env python2
+import itertools
+
+import numpy as np
+
+from ipi.utils.neighbours import NeighbourList
+
+
+def brute_pairs(q, h, cutoff):
+    """Lists the pairs closer than cutoff, looping over atoms and images."""
+
+    pairs = set()
+    for i, j in itertools.combinations_with_replacement(range(len(q)), 2):
+        for shift in itertools.product(range(-3, 4), repeat=3):
+            # each image of an atom interacting with itself is counted once
+            if i == j and [s for s in shift if s != 0][:1] <= [0]:
+                continue
+            d = q[j] + np.dot(h, shift) - q[i]
+            if (d**2).sum() < cutoff**2:
+                pairs.add((i, j, shift))
+    return pairs
+
+
+def listed_pairs(q, h, cutoff, skin=0.0, pbc=True):
+    """Lists the pairs closer than cutoff using a NeighbourList."""
+
+    nlist = NeighbourList(cutoff, skin, pbc)
+    i, j, d = nlist.pairs(q, h)
+    close = (d**2).sum(axis=1) < cutoff**2
+    return set((a, b, tuple(s)) for a, b, s in zip(i[close], j[close], nlist.shifts[close]))
+
+
+def test_triclinic():
+    """Neighbour lists in a triclinic cell, with cutoffs shorter and longer than the box."""
+
+    h = np.array([[5.0, 1.0, 0.5], [0.0, 6.0, 1.2], [0.0, 0.0, 5.5]])
+    q = np.random.RandomState(0).uniform(-8.0, 8.0, (20, 3))
+    for cutoff in [2.5, 6.0]:
+        assert listed_pairs(q, h, cutoff, skin=0.5) == brute_pairs(q, h, cutoff)
+
+
+def test_open():
+    """Neighbour lists without periodic boundary conditions."""
+
+    q = np.random.RandomState(0).uniform(-8.0, 8.0, (40, 3))
+    pairs = set((i, j, (0, 0, 0)) for i, j in itertools.combinations(range(len(q)), 2)
+                if ((q[i] - q[j])**2).sum() < 9.0)
+    assert listed_pairs(q, None, 3.0, pbc=False) == pairs
+    assert len(NeighbourList(None, pbc=False).pairs(q, None)[0]) == 40 * 39 / 2
+
+
+def test_rebuild():
+    """Neighbour lists are only rebuilt when atoms move by more than half the skin."""
+
+    h = np.eye(3) * 10.0
+    q = np.random.RandomState(0).uniform(0.0, 10.0, (30, 3))
+    nlist = NeighbourList(3.0, 1.0)
+    nlist.pairs(q, h)
+    # wrapping atoms back in the box does not invalidate the list
+    q[0] += h[:, 0]
+    nlist.pairs(q, h)
+    q[1, 0] += 0.4
+    nlist.pairs(q, h)
+    assert nlist.nbuild == 1
+    q[1, 0] += 0.4
+    nlist.pairs(q, h)
+    assert nlist.nbuild == 2
@@ -0,0 +1,302 @@
+#!/usr/bin/env python2
+
+description = """Measures the overhead of i-PI per MD step.
+
+Runs short PIMD simulations of a Lennard-Jones-like system in which the
+forces are computed by synthetic drivers that return zero forces, possibly
+after sleeping for a given time, and reports the wall-clock time per step
+and the part of it that is not spent waiting for the drivers. Every
+combination of the given numbers of beads, atoms, clients and driver
+latencies is run, so that the results give the scaling of the overhead.
+The forces can also come from the in-process Lennard-Jones forcefield,
+from the in-process q-TIP4P/F forcefield, for a box of water molecules,
+or from a dummy in-process forcefield that does no work at all.
+
+Each simulation runs in a separate process, in a temporary directory.
+"""
+
+
+import sys
+import os
+import time
+import json
+import shutil
+import tempfile
+import itertools
+import subprocess
+import argparse
+
+import numpy as np
+
+# Check that we have the import path for this i-PI set and if not, add it.
+dir_root = os.path.realpath(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+if not dir_root in sys.path:
+    sys.path.insert(0, dir_root)
+
+
+SPACING = 3.2   # lattice spacing of the synthetic system, in angstrom
+WATER_SPACING = 3.1   # lattice spacing of the water molecules, about the density of liquid water
+
+
+INPUT = """<simulation verbosity='quiet' frozen_graph='{frozen}'>
+  <output prefix='bench'>
+    {outputs}
+  </output>
+  <total_steps> {steps} </total_steps>
+  <prng><seed> 12345 </seed></prng>
+  {forcefield}
+  <system>
+    <initialize nbeads='{beads}'>
+      <file mode='pdb'> init.pdb </file>
+      <velocities mode='thermal' units='kelvin'> 100 </velocities>
+    </initialize>
+    <forces><force forcefield='bench'/></forces>
+    <ensemble><temperature units='kelvin'> 100 </temperature></ensemble>
+    <motion mode='dynamics'>
+      <dynamics mode='{ensemble}'>
+        <thermostat mode='pile_l'><tau units='femtosecond'> 100 </tau></thermostat>
+        <timestep units='femtosecond'> 1.0 </timestep>
+      </dynamics>
+    </motion>
+  </system>
+</simulation>
+"""
+
+OUTPUTS = """<properties stride='1' filename='out'> [ step, time, conserved, temperature, potential, kinetic_cv ] </properties>
+    <trajectory stride='1' filename='pos' format='xyz'> positions </trajectory>"""
+
+SOCKET = """<ffsocket mode='{mode}' name='bench'>
+    <address> {address} </address>
+    <latency> 0.01 </latency>
+    <command> {command} </command>
+    <pool_min> {clients} </pool_min>
+    <pool_max> {clients} </pool_max>
+  </ffsocket>"""
+
+LJ = """<fflj name='bench' pbc='true'>
+    <parameters> {{ eps: 1.1663e-4, sigma: 5.270446, cutoff: 13.0, skin: 1.0 }} </parameters>
+  </fflj>"""
+
+QTIP4PF = """<ffqtip4pf name='bench' pbc='true'>
+    <parameters> {{ skin: 1.0 }} </parameters>
+  </ffqtip4pf>"""
+
+
+class StepTimer(object):
+
+    """Pseudo-output that records the time at which each step ends.
+
+    Attributes:
+       filename: A name for the output, used to label its thread.
+       times: The list of the times at which write has been called.
+    """
+
+    def __init__(self):
+        """Initialises StepTimer."""
+
+        self.filename = "timer"
+        self.times = []
+
+    def write(self):
+        """Records the current time."""
+
+        self.times.append(time.time())
+
+
+def write_pdb(natoms, filename, water=False):
+    """Writes a simple cubic lattice of natoms atoms in a cubic box.
+
+    If water is True, each site of the lattice holds a water molecule, and
+    natoms must be a multiple of three.
+    """
+
+    nsites = natoms / 3 if water else natoms
+    spacing = WATER_SPACING if water else SPACING
+    nside = int(np.ceil(nsites**(1.0 / 3.0)))
+    box = nside * spacing
+    # the O and H atoms of a water molecule, relative to the lattice site
+    molecule = [("O", np.zeros(3)), ("H", np.array([0.757, 0.586, 0.0])), ("H", np.array([-0.757, 0.586, 0.0]))]
+    with open(filename, "w") as pdb:
+        pdb.write("CRYST1%9.3f%9.3f%9.3f%7.2f%7.2f%7.2f P 1           1\n" % (box, box, box, 90.0, 90.0, 90.0))
+        for i in range(natoms):
+            k = i / 3 if water else i
+            name, offset = molecule[i % 3] if water else ("Ne", np.zeros(3))
+            x, y, z = (np.array([k % nside, (k / nside) % nside, k / nside**2]) + 0.5) * spacing + offset
+            pdb.write("ATOM  %5d %4s %3s %1s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n" % (i + 1, name, "1", " ", 1, x, y, z, 0.0, 0.0, "0"))
+
+
+def run_point(point):
+    """Runs one simulation in the current directory, and writes its timings in result.json.
+
+    Args:
+       point: A dictionary with the parameters of the benchmark.
+    """
+
+    from ipi.inputs.simulation import InputSimulation
+    from ipi.engine.forcefields import ForceField
+    from ipi.utils.io.inputs.io_xml import xml_parse_string
+    from ipi.utils.softexit import softexit
+
+    write_pdb(point["atoms"], "init.pdb", water=(point["forcefield"] == "qtip4pf"))
+
+    if point["forcefield"] in ["unix", "shm"]:
+        command = "%s %s --driver {address} %d %g %s" % (sys.executable, os.path.realpath(__file__), point["atoms"], point["latency"], point["forcefield"])
+        forcefield = SOCKET.format(mode=point["forcefield"], address="bench_%d" % os.getpid(),
+                                   command=command, clients=point["clients"])
+    elif point["forcefield"] == "qtip4pf":
+        forcefield = QTIP4PF.format()
+    else:
+        forcefield = LJ.format()
+
+    xml = INPUT.format(outputs=OUTPUTS if point["outputs"] else "", steps=point["warmup"] + point["steps"],
+                       forcefield=forcefield, beads=point["beads"], ensemble=point["ensemble"],
+                       frozen=point.get("frozen", False))
+    isimul = InputSimulation()
+    isimul.parse(xml_parse_string(xml).fields[0][1])
+    simul = isimul.fetch()
+    if point["forcefield"] == "dummy":
+        # a forcefield that returns zero forces as soon as the requests are queued
+        simul.fflist["bench"] = ForceField(latency=1.0, name="bench")
+    simul.bind()
+
+    timer = StepTimer()
+    simul.outputs.append(timer)
+    simul.run()
+
+    dt = np.diff(timer.times)[point["warmup"]:]
+    with open("result.json", "w") as result:
+        json.dump({"step": float(np.mean(dt)), "std": float(np.std(dt)), "min": float(np.min(dt))}, result)
+
+    softexit.trigger(" @ BENCHMARK: Done.")
+
+
+def run_driver(address, natoms, latency, mode):
+    """Serves zero forces to i-PI, after sleeping for latency seconds.
+
+    Args:
+       address: The address of the socket.
+       natoms: The number of atoms.
+       latency: The time in seconds the driver takes for each configuration.
+       mode: The type of socket, 'unix' or 'shm'.
+    """
+
+    from ipi.interfaces.clients import Client
+
+    force = np.zeros((natoms, 3))
+    potential = np.zeros(1)
+
+    def zero(pos):
+        if latency > 0:
+            time.sleep(latency)
+        return force, potential
+
+    sys.stdout = open(os.devnull, "w")
+    client = Client(address=address, mode=mode)
+    client._positions = np.zeros((natoms, 3))
+    client._callback = zero
+    client.run(verbose=False, fn_exit=None)
+
+
+def benchmark(point):
+    """Runs a simulation in a new process and returns its timings.
+
+    Args:
+       point: A dictionary with the parameters of the benchmark.
+
+    Returns:
+       A dictionary with the average, standard deviation and minimum of the
+       time per step, or None if the simulation failed.
+    """
+
+    rundir = tempfile.mkdtemp(prefix="ipi_bench_")
+    try:
+        with open(os.path.join(rundir, "log"), "w") as log:
+            subprocess.call([sys.executable, os.path.realpath(__file__), "--point", json.dumps(point)],
+                            cwd=rundir, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            with open(os.path.join(rundir, "result.json")) as result:
+                return json.load(result)
+        except IOError:
+            sys.stderr.write("Benchmark failed for %s. Output:\n" % json.dumps(point))
+            sys.stderr.write(open(os.path.join(rundir, "log")).read())
+            return None
+    finally:
+        shutil.rmtree(rundir, ignore_errors=True)
+
+
+def main(args):
+    """Runs all the combinations of the benchmark parameters and prints the results."""
+
+    if args.forcefield in ["unix", "shm"]:
+        clients, latencies = args.clients, args.latency
+    else:
+        # in-process forcefields have no clients, and no latency besides their own cost
+        clients, latencies = [0], [0.0]
+
+    fmt_header = "# {0:>6s} {1:>6s} {2:>7s} {3:>10s} {4:>12s} {5:>12s} {6:>14s}"
+    fmt_line = "  {0:6d} {1:6d} {2:7d} {3:10.4f} {4:12.4f} {5:12.4f} {6:14.3f}"
+    print "# i-PI overhead benchmark. forcefield: %s, ensemble: %s, outputs: %s, frozen graph: %s, %d steps after %d warm-up steps" % (
+        args.forcefield, args.ensemble, args.outputs, args.frozen, args.steps, args.warmup)
+    print fmt_header.format("beads", "atoms", "clients", "latency/s", "t/step/ms", "std/ms", "overhead/ms")
+
+    results = []
+    for beads, atoms, nclients, latency in itertools.product(args.beads, args.atoms, clients, latencies):
+        point = {"beads": beads, "atoms": atoms, "clients": nclients, "latency": latency,
+                 "forcefield": args.forcefield, "ensemble": args.ensemble, "outputs": args.outputs, "frozen": args.frozen,
+                 "steps": args.steps, "warmup": args.warmup}
+        timings = benchmark(point)
+        if timings is None:
+            continue
+        # with ideal dispatching, each client computes its share of the beads one after the other
+        ideal = latency * np.ceil(float(beads) / max(nclients, 1))
+        point.update(timings)
+        point["overhead"] = timings["step"] - ideal
+        results.append(point)
+        print fmt_line.format(beads, atoms, nclients, latency, 1e3 * timings["step"], 1e3 * timings["std"], 1e3 * point["overhead"])
+        sys.stdout.flush()
+
+    if args.json is not None:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+
+    # internal entry points used to run a single simulation or a synthetic driver
+    if len(sys.argv) > 2 and sys.argv[1] == "--point":
+        run_point(json.loads(sys.argv[2]))
+        sys.exit()
+    if len(sys.argv) > 5 and sys.argv[1] == "--driver":
+        run_driver(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]), sys.argv[5])
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('-b', '--beads', type=int, nargs='+', default=[8],
+                        help='Numbers of beads.')
+    parser.add_argument('-a', '--atoms', type=int, nargs='+', default=[108],
+                        help='Numbers of atoms.')
+    parser.add_argument('-c', '--clients', type=int, nargs='+', default=[1, 4],
+                        help='Numbers of synthetic drivers.')
+    parser.add_argument('-l', '--latency', type=float, nargs='+', default=[0.0],
+                        help='Time in seconds each driver takes to compute one configuration.')
+    parser.add_argument('-f', '--forcefield', choices=['unix', 'shm', 'lj', 'qtip4pf', 'dummy'], default='unix',
+                        help='Where the forces come from: synthetic drivers on a unix socket, or on a unix '
+                             'socket with shared memory, the in-process Lennard-Jones forcefield, the '
+                             'in-process q-TIP4P/F forcefield for water (the number of atoms must be a '
+                             'multiple of three) or a dummy in-process forcefield.')
+    parser.add_argument('-e', '--ensemble', choices=['nve', 'nvt'], default='nvt',
+                        help='The ensemble to sample.')
+    parser.add_argument('-o', '--outputs', action='store_true',
+                        help='Write properties and positions at every step.')
+    parser.add_argument('-g', '--frozen', action='store_true',
+                        help='Freeze the dependency graph after binding the simulation.')
+    parser.add_argument('-s', '--steps', type=int, default=200,
+                        help='Number of steps that are timed.')
+    parser.add_argument('-w', '--warmup', type=int, default=20,
+                        help='Number of steps run before starting to time.')
+    parser.add_argument('-j', '--json', type=str, default=None,
+                        help='File to save the results to, in JSON format.')
+
+    main(parser.parse_args())